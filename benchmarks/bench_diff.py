@@ -0,0 +1,57 @@
+# benchmarks/bench_diff.py
+# Character-level difflib against the paragraph-anchored diff used by ContentEditor.
+# Run from the repository root: python -m benchmarks.bench_diff
+import difflib
+import random
+import time
+from src.utils.text_diff import paragraph_diff_opcodes
+
+SIZES = [25_000, 100_000, 200_000]
+BASELINE_MAX_SIZE = 100_000  # character-level difflib gets too slow to wait for beyond this
+
+def _article(size: int, seed: int = 0) -> str:
+    """Plaintext article made of paragraphs of pseudo-random sentences"""
+    rng = random.Random(seed)
+    words = ["the", "ship", "was", "built", "in", "1860", "at", "Pembroke", "Dockyard", "and", "served",
+             "on", "the", "China", "Station", "until", "she", "was", "sold", "for", "scrap", "gunvessel"]
+    paragraphs = []
+    length = 0
+    while length < size:
+        sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(8, 20))).capitalize() + "."
+                     for _ in range(rng.randint(3, 7))]
+        paragraphs.append(" ".join(sentences))
+        length += len(paragraphs[-1]) + 2
+    return "\n\n".join(paragraphs)
+
+def _edit(article: str, seed: int = 1) -> str:
+    """Insert a new sentence into every tenth paragraph, like an LLM adding missing information"""
+    rng = random.Random(seed)
+    paragraphs = article.split("\n\n")
+    for idx in range(0, len(paragraphs), 10):
+        sentences = paragraphs[idx].split(". ")
+        sentences.insert(rng.randint(0, len(sentences)), "She was recommissioned in 1868 with a new crew")
+        paragraphs[idx] = ". ".join(sentences)
+    return "\n\n".join(paragraphs)
+
+def _time(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def run():
+    for size in SIZES:
+        original = _article(size)
+        edited = _edit(original)
+
+        new_time, opcodes = _time(paragraph_diff_opcodes, original, edited)
+        changes = sum(1 for opcode in opcodes if opcode[0] != 'equal')
+        line = f"{len(original) // 1000:>4} KB  paragraph diff {new_time * 1000:9.1f} ms ({changes} changes)"
+
+        if size <= BASELINE_MAX_SIZE:
+            old_time, old_opcodes = _time(lambda: difflib.SequenceMatcher(None, original, edited).get_opcodes())
+            old_changes = sum(1 for opcode in old_opcodes if opcode[0] != 'equal')
+            line += f"  char difflib {old_time * 1000:9.1f} ms ({old_changes} changes)  speedup {old_time / new_time:6.1f}x"
+        print(line)
+
+if __name__ == "__main__":
+    run()
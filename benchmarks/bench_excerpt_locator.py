@@ -0,0 +1,77 @@
+# benchmarks/bench_excerpt_locator.py
+# Worst-case latency of fallback_find_excerpt on pathological inputs. Every search must stop
+# within FALLBACK_TIME_BUDGET plus the cost of checking one more candidate, i.e. one parse
+# (the slowest parse of the same search).
+# Run from the repository root: python -m benchmarks.bench_excerpt_locator
+import time
+from src.utils.helpers import fallback_find_excerpt, FALLBACK_MAX_CANDIDATES, FALLBACK_TIME_BUDGET
+
+REPEATS = 5
+SIZE = 300_000
+SENTENCE = "the ship was laid down at Pembroke Dockyard in 1859 and launched two years later as a gunvessel of the Royal Navy"
+
+def _repeat(block: str, size: int = SIZE) -> str:
+    return (block * (size // len(block) + 1))[:size]
+
+def _article_with_templates() -> str:
+    """Excerpt text only appears inside template parameters and table cells"""
+    return _repeat(
+        "{{Infobox ship|name=HMS Example|builder=[[Pembroke Dockyard]]|laid_down=1859}}\n"
+        "{| class=\"wikitable\"\n|-\n| The ship was laid || down in 1859\n|}\n"
+        "The ship was refitted several times.<ref>{{cite book|title=Ships}}</ref>\n\n"
+    )
+
+def _large_table(size: int = SIZE) -> str:
+    """Every row holds the excerpt's words split over two cells, so every candidate is parsed and rejected"""
+    words = SENTENCE.split(" ")
+    half = len(words) // 2
+    return "{| class=\"wikitable\"\n" + _repeat(f"|-\n| {' '.join(words[:half])} || {' '.join(words[half:])}\n", size) + "\n|}"
+
+def _template_names() -> str:
+    """The excerpt is the name of a repeated template, so it reads right but lies in markup"""
+    return _repeat(f"{{{{{SENTENCE}}}}}\n")
+
+def _near_miss_table() -> str:
+    """Every row matches all but the last word of the excerpt"""
+    return "{| class=\"wikitable\"\n" + _repeat(f"|-\n| {SENTENCE.rsplit(' ', 1)[0]} ||\n") + "\n|}"
+
+def _repeated_first_word() -> str:
+    """The first word of the excerpt occurs everywhere but the excerpt never completes"""
+    return _repeat("the ")
+
+def _near_misses() -> str:
+    """Every window matches all but the last word of the excerpt"""
+    return _repeat("alpha [[beta]] ''gamma'' delta ")
+
+# (name, wikitext, excerpt, max_candidates)
+CASES = [
+    ("templates and tables", _article_with_templates(), "The ship was laid down in 1859", FALLBACK_MAX_CANDIDATES),
+    ("repeated row in a large table", _large_table(), SENTENCE, FALLBACK_MAX_CANDIDATES),
+    ("repeated template name", _template_names(), SENTENCE, FALLBACK_MAX_CANDIDATES),
+    ("near miss in a large table", _near_miss_table(), SENTENCE, FALLBACK_MAX_CANDIDATES),
+    ("repeated first word", _repeated_first_word(), "the quick brown fox", FALLBACK_MAX_CANDIDATES),
+    ("near misses", _near_misses(), "alpha beta gamma delta epsilon", FALLBACK_MAX_CANDIDATES),
+    # without the candidate cap only the time budget stops the search
+    ("10 MB table, no candidate cap", _large_table(10_000_000), SENTENCE, 10 ** 9),
+]
+
+def run():
+    print(f"time budget {FALLBACK_TIME_BUDGET}s, at most {FALLBACK_MAX_CANDIDATES} candidates, {SIZE // 1000} KB inputs")
+    for name, wikitext, excerpt, max_candidates in CASES:
+        timings = []
+        slowest_parse = 0.0
+        for _ in range(REPEATS):
+            stats = {}
+            start = time.perf_counter()
+            result = fallback_find_excerpt(excerpt, wikitext, max_candidates=max_candidates, stats=stats)
+            elapsed = time.perf_counter() - start
+            timings.append(elapsed)
+            slowest_parse = max(slowest_parse, stats["slowest_parse"])
+            assert elapsed < FALLBACK_TIME_BUDGET + stats["slowest_parse"], f"{name} ran over the time budget"
+
+        print(f"{name:<30} worst {max(timings) * 1000:8.1f} ms  best {min(timings) * 1000:8.1f} ms  "
+              f"candidates {stats['candidates']:5d}  parsed {stats['parsed']:5d}  "
+              f"budget hit {'yes' if stats['budget_exhausted'] else 'no ':<3}  slowest parse {slowest_parse * 1000:6.2f} ms  result {result}")
+
+if __name__ == "__main__":
+    run()
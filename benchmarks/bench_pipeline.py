@@ -0,0 +1,84 @@
+# benchmarks/bench_pipeline.py
+# Orchestration, diff and patch cost of the core.py flows, with the local LLM stand-in
+# (LLM_BACKEND=local) instead of OpenAI and Anthropic, so no network access is needed.
+# Every flow runs once with an instant model (the pipeline's own cost) and once with the
+# simulated latency and output speed. LinkingImprover is left out, as its tool looks up
+# articles on Wikipedia.
+# Run from the repository root: python -m benchmarks.bench_pipeline
+import io
+import os
+import random
+import time
+
+os.environ.setdefault("LLM_BACKEND", "local")
+# the stand-in answers far faster than the real rate limits assume
+os.environ.setdefault("RATE_LIMIT", "100000")
+os.environ.setdefault("TOKEN_RATE_LIMIT", "1000000000")
+
+from src import core
+from src.config.settings import config
+from src.utils.helpers import wikitext_to_plaintext_skip_tables_refs
+from src.utils.llm_clients import LLMClientRegistry
+
+SIZES = [25_000, 100_000]
+SOURCES = 4
+SIMULATED_LATENCY = 0.5  # seconds to the first token
+SIMULATED_TOKENS_PER_SECOND = 200
+
+def _wikitext(size: int, seed: int = 0) -> str:
+    """Article of sections of pseudo-random paragraphs, with some links and loaded words"""
+    rng = random.Random(seed)
+    words = ["the", "ship", "was", "built", "in", "1860", "at", "[[Pembroke Dockyard]]", "and", "served",
+             "on", "the", "[[China Station]]", "until", "she", "was", "famously", "sold", "for", "scrap",
+             "tragically", "gunvessel", "legendary", "crew"]
+    parts = []
+    length = 0
+    while length < size:
+        if len(parts) % 6 == 5:
+            parts.append(f"== Section {len(parts) // 6 + 1} ==")
+        sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(8, 20))).capitalize() + "."
+                     for _ in range(rng.randint(3, 7))]
+        parts.append(" ".join(sentences))
+        length += len(parts[-1]) + 2
+    return "\n\n".join(parts)
+
+def _use_model(latency: float, tokens_per_second: float):
+    config.llm_backend.local_latency = latency
+    config.llm_backend.local_tokens_per_second = tokens_per_second
+    # the stand-in clients read the settings when they are created
+    LLMClientRegistry.clear()
+
+def _flows(wikitext: str) -> list:
+    plaintext = wikitext_to_plaintext_skip_tables_refs(wikitext)
+    sources = [io.BytesIO(f"%PDF-1.4 source {idx}".encode()) for idx in range(SOURCES)]
+    state = {}
+
+    def summarize():
+        state["summaries"] = core.summarize_sources("Example", plaintext, wikitext, sources)
+        return state["summaries"]
+
+    return [
+        ("summarize sources", summarize),
+        ("enhance with summaries", lambda: core.enhance_with_source_summaries("Example", plaintext, wikitext, state["summaries"])),
+        ("check neutrality", lambda: core.check_neutrality("Example", plaintext, wikitext)),
+    ]
+
+def run():
+    for size in SIZES:
+        wikitext = _wikitext(size)
+        print(f"{len(wikitext) // 1000} KB article, {SOURCES} sources")
+        timings = {}
+        for label, latency, tokens_per_second in [("instant", 0.0, 0.0), ("simulated", SIMULATED_LATENCY, SIMULATED_TOKENS_PER_SECOND)]:
+            _use_model(latency, tokens_per_second)
+            for name, flow in _flows(wikitext):
+                start = time.perf_counter()
+                result = flow()
+                timings[(name, label)] = (time.perf_counter() - start, len(result))
+
+        for name, _ in _flows(wikitext):
+            instant, count = timings[(name, "instant")]
+            simulated, _ = timings[(name, "simulated")]
+            print(f"  {name:<24} pipeline {instant * 1000:9.1f} ms  with model {simulated:7.2f} s  ({count} results)")
+
+if __name__ == "__main__":
+    run()
@@ -1,30 +1,83 @@
-from openai import OpenAI
 from pydantic import BaseModel
 from src.config.settings import config
 from src.ui.logger import StreamlitLogger
 from src.ui.suggestion import Suggestion
+from src.utils.rate_limiter import limited_call
+from src.utils.llm_clients import get_openai_client
+from src.utils.concurrency import run_concurrently
+from src.utils.lexical_index import parse_bullets
+from src.utils.token_budget import count_tokens, split_to_budget
 
 
+class CoveredItems(BaseModel):
+    item_numbers: list[int]
+
 class ContentAnalyzer:
     def __init__(self, topic: str, article_text: str, provided_summary: str):
         self.topic: str = topic
         self.text: str = article_text
         self.summary: str = provided_summary
         self.response: str = None
-        self.client = OpenAI(api_key=config.openai.api_key)
+        self.client = get_openai_client()
     
     def find_missing_information(self) -> str:
         """Use GPT-4 to improve content based on analysis."""
-        response = self.client.chat.completions.create(
+        if count_tokens(self.summary) + count_tokens(self.text) > config.max_input_tokens:
+            return self._find_missing_information_chunked()
+
+        response = limited_call("openai", self.client.chat.completions.create, **self.missing_information_request())
+        self.response = response.choices[0].message.content
+
+        return response.choices[0].message.content
+
+    def _find_missing_information_chunked(self) -> str:
+        """
+        Map-reduce variant for articles too long for one request. The summary is split into
+        numbered bullets; every part of the article is asked (in parallel) which bullets it
+        already covers, and the bullets no part covers are the missing information. A list
+        of bullets too long to share a request with the article is split into groups as well.
+        """
+        bullets = parse_bullets(self.summary)
+        numbered = "\n".join(f"{idx}. {bullet}" for idx, bullet in enumerate(bullets, start=1))
+        # the bullets get at most three quarters of the budget, the article the rest
+        groups = split_to_budget(numbered, config.max_input_tokens - config.max_input_tokens // 4)
+        chunk_tokens = config.max_input_tokens - max((count_tokens(group) for group in groups), default=0)
+        chunks = split_to_budget(self.text, chunk_tokens)
+        jobs = [(group, chunk) for group in groups for chunk in chunks]
+        StreamlitLogger.log(f"[Analyzer] Article is too long for one request, checking {len(bullets)} item(s) in {len(groups)} group(s) against {len(chunks)} part(s)...")
+
+        def covered_items(job) -> list[int]:
+            group, chunk = job
+            response = limited_call("openai", self.client.beta.chat.completions.parse,
+                model="gpt-4o-mini-2024-07-18",
+                messages=[
+                    {"role": "system", "content": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style, and do not make up information that is not in the presented documents."},
+                    {"role": "user", "content": f"You will be given a numbered list of information from an external source, and one part of an article about the same topic. List the numbers of the items whose information is already fully present in this part of the article. The list is the following:\n{group}\n\n\nTHE LIST ENDS HERE. The part of the article is the following:\n{chunk}"}
+                ],
+                response_format=CoveredItems,
+            )
+            return response.choices[0].message.parsed.item_numbers
+
+        covered = set()
+        for idx, result in enumerate(run_concurrently(covered_items, jobs, config.max_concurrency), start=1):
+            if result.ok:
+                covered.update(result.value)
+            else:
+                # an unchecked part cannot rule anything out; at worst an item is suggested twice
+                StreamlitLogger.log(f"[Analyzer] Part {idx}/{len(jobs)} failed: {str(result.error)}")
+
+        self.response = "\n".join(f"- {bullet}" for idx, bullet in enumerate(bullets, start=1) if idx not in covered)
+        return self.response
+
+    def missing_information_request(self) -> dict:
+        """Chat completion parameters of find_missing_information, e.g. for batch jobs"""
+        return dict(
             model="gpt-4o-mini-2024-07-18",
             messages=[
                 {"role": "system", "content": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style, and do not make up information that is not in the presented documents."},
                 {"role": "user", "content": f"You will be given a summary of an external source of information, and an article about the same topic. In bullet form, while preserving all details, identify any information in the summary that is not present in the article. The summary is the following:\n{self.summary}\n\n\nTHE SUMMARY ENDS HERE. The article is the following:\n{self.text}"}
             ]
         )
-        self.response = response.choices[0].message.content
-
-        return response.choices[0].message.content
 
 
 
@@ -1,19 +1,19 @@
-from openai import OpenAI
 from pydantic import BaseModel
 from enum import Enum
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from src.config.settings import config
 from src.ui.logger import StreamlitLogger
 from src.ui.suggestion import Suggestion
-from src.utils.helpers import extract_context_from_words
-import difflib
+from src.utils.helpers import extract_context_from_words, compact_refinement_context, strip_html
 from src.utils.wikitext_patcher import WikitextPatcher
+from src.utils.text_diff import IncrementalParagraphDiff, paragraph_diff_opcodes
+from src.utils.lexical_index import LexicalIndex, parse_bullets, split_sections
+from src.utils.rate_limiter import limited_call
+from src.utils.llm_clients import get_openai_client
 
-# Surrounding context length
+# Surrounding context length, also used to anchor insertions
 LEN_CTX = 60
 
-SMALLER_LEN_CTX = 20
-
 # unused
 class EditType(str, Enum):
     ADDED = "added"
@@ -28,12 +28,17 @@ class Edit(BaseModel):
     original_content: Optional[str] = None  # For modified changes
     modified_content: Optional[str] = None  # For modified changes
 
+class PassageEdit(BaseModel):
+    original_passage: str
+    edited_passage: str
+
+class AnalysisAndEdits(BaseModel):
+    missing_information: list[str]
+    edits: list[PassageEdit]
+
 def generate_diff_context(text, i1, i2):
     return f"...{text[max(i1-LEN_CTX,0):i1]}<b>{text[i1:i2]}</b>{text[i2:min(i2+LEN_CTX,len(text))]}..."
 
-def generate_diff_context_clean(text, i1, i2):
-    return f"{text[max(i1-SMALLER_LEN_CTX,0):i1]}<b>{text[i1:i2]}</b>{text[i2:min(i2+SMALLER_LEN_CTX,len(text))]}"
-
 class ContentEditor:
     def __init__(self, topic: str, article_text, summary_missing, idx):
         self.topic: str = topic
@@ -41,13 +46,28 @@ class ContentEditor:
         self.summary = summary_missing
         self.index = idx
         self.response: str = None
-        self.client = OpenAI(api_key=config.openai.api_key)
+        # missing-information bullets found by analyze_and_edit
+        self.analysis: str = None
+        self.client = get_openai_client()
 
         self.conversation_context = []
+        # (start, end, new_text) passages of self.text rewritten in section-targeted mode
+        self.section_edits: Optional[List[Tuple[int, int, str]]] = None
+
+    def _refinement_context(self, original_suggestion: Suggestion) -> list:
+        """Conversation to refine a suggestion in: the suggestion and its surroundings only, unless configured otherwise"""
+        if config.full_refinement_context:
+            return list(self.conversation_context)
+        return compact_refinement_context(
+            self.conversation_context,
+            f"Edit the Wikipedia article on {self.topic} to include missing information from another source. The source's information:\n{self.analysis or self.summary}",
+            strip_html(original_suggestion.context),
+            strip_html(original_suggestion.text),
+        )
 
     def continue_conversation(self, original_suggestion: Suggestion, user_input: str) -> Suggestion:
         # create a new context
-        new_conversation_context = list(self.conversation_context)
+        new_conversation_context = self._refinement_context(original_suggestion)
         # refine prompt
         new_conversation_context.append(
             {
@@ -55,7 +75,7 @@ class ContentEditor:
                 "content": f"The user wants clarification on the suggestion to \"{original_suggestion.text}\" in your edited article. The following is their comment: \"{user_input}\". Provide a short reasoning that responds directly to the user."
             }
         )
-        response = self.client.chat.completions.create(
+        response = limited_call("openai", self.client.chat.completions.create,
             model="gpt-4o-mini-2024-07-18",
             messages=new_conversation_context
         )
@@ -71,30 +91,205 @@ class ContentEditor:
 
         return new_suggestion
     
-    def improve_article_with_missing_info(self) -> str:
-        """Use GPT-4o to improve content based on analysis."""
-
-        messages_prompt = [
+    def _missing_info_prompt(self) -> list:
+        return [
                 {"role": "system", "content": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style. You focus on adding missing information rather than rewording existing information in the article."},
                 {"role": "user", "content": f"Given a summary of a different source and our current article, edit the current article to include all information contained in the summary, placing the information in the relevant place. Write NEW sentences inside the article. You may reword information from the summary, but avoid changing existing text in the article too much. Answer with ONLY the new article. Here is the summary:\n{self.summary}\n\n\nSUMMARY ENDS HERE. The following is the current article to edit:\n{self.text}"}
             ]
 
-        response = self.client.chat.completions.create(
+    def improve_article_with_missing_info(self) -> str:
+        """Use GPT-4o to improve content based on analysis."""
+
+        response = limited_call("openai", self.client.chat.completions.create, **self.missing_info_request())
+
+        return self.complete_missing_info(response.choices[0].message.content)
+
+    def missing_info_request(self) -> dict:
+        """Chat completion parameters of improve_article_with_missing_info, e.g. for batch jobs"""
+        return dict(
             model="gpt-4o-mini-2024-07-18",
-            messages=messages_prompt
+            messages=self._missing_info_prompt()
         )
-        self.response = response.choices[0].message.content
+
+    def complete_missing_info(self, edited_article: str) -> str:
+        """Store the rewritten article returned for missing_info_request"""
+        self.response = edited_article
         # Save the conversation context for refinement later
-        messages_prompt.append(response.choices[0].message)
+        self.conversation_context = self._missing_info_prompt() + [{"role": "assistant", "content": edited_article}]
+
+        return edited_article
+
+    def stream_article_with_missing_info(self, on_suggestion: Callable[[Suggestion], None] = None) -> list[Suggestion]:
+        """
+        Streaming variant of improve_article_with_missing_info that also does the diffing.
+        The completion is logged as it arrives, and as soon as a rewritten paragraph
+        re-aligns with the original, the changes before it become suggestions and are
+        passed to on_suggestion.
+        """
+        messages_prompt = self._missing_info_prompt()
+        source = f"ContentEditor#{self.index}"
+        diff = IncrementalParagraphDiff(self.text)
+        suggestion_list = []
+
+        def emit(opcodes):
+            for suggestion in self._suggestions_from_opcodes(opcodes, self.text, diff.b):
+                suggestion_list.append(suggestion)
+                if on_suggestion:
+                    on_suggestion(suggestion)
+
+        stream = limited_call("openai", self.client.chat.completions.create,
+            model="gpt-4o-mini-2024-07-18",
+            messages=messages_prompt,
+            stream=True
+        )
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            StreamlitLogger.stream(source, chunk.choices[0].delta.content)
+            emit(diff.feed(chunk.choices[0].delta.content))
+        emit(diff.finish())
+        StreamlitLogger.end_stream(source)
+
+        self.response = diff.b
+        # Save the conversation context for refinement later
+        messages_prompt.append({"role": "assistant", "content": self.response})
         self.conversation_context = list(messages_prompt)
 
-        return response.choices[0].message.content
+        return suggestion_list
+
+    def improve_sections_with_missing_info(self) -> str:
+        """
+        Section-targeted variant of improve_article_with_missing_info. Each missing-information
+        bullet is matched to its most relevant section with a local BM25 index, and only those
+        sections are sent for editing, so output tokens scale with the edit, not the article.
+        Every bullet goes to a single section, so a fact is never added twice.
+        """
+        sections = split_sections(self.text)
+        if not sections:
+            return self.improve_article_with_missing_info()
+
+        # headings are part of what a section is about, but are not sent for editing
+        index = LexicalIndex([f"{heading}\n{self.text[start:end]}" for heading, start, end in sections])
+        bullets_by_section: Dict[int, List[str]] = {}
+        for bullet in parse_bullets(self.summary):
+            # information that matches nothing goes to the lead
+            section_idx = (index.top(bullet, 1) or [0])[0]
+            bullets_by_section.setdefault(section_idx, []).append(bullet)
+
+        system_prompt = {"role": "system", "content": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style. You focus on adding missing information rather than rewording existing information in the article."}
+        self.section_edits = []
+        edited_sections = []
+        for section_idx in sorted(bullets_by_section):
+            heading, start, end = sections[section_idx]
+            bullets = "\n".join(f"- {bullet}" for bullet in bullets_by_section[section_idx])
+            StreamlitLogger.log(f"[ContentEditor#{self.index}] Editing section {section_idx+1}/{len(sections)} ({heading or 'lead'}) with {len(bullets_by_section[section_idx])} bullet(s)...")
+
+            response = limited_call("openai", self.client.chat.completions.create,
+                model="gpt-4o-mini-2024-07-18",
+                messages=[
+                    system_prompt,
+                    {"role": "user", "content": f"Given information from a different source and one section of the Wikipedia article on {self.topic}, edit the section to include the information that belongs in it. Write NEW sentences inside the section. You may reword the information, but avoid changing existing text in the section too much, and leave out information that does not fit this section. Answer with ONLY the new section text, without its heading. Here is the information:\n{bullets}\n\n\nINFORMATION ENDS HERE. The following is the {'section ' + heading if heading else 'lead section'} to edit:\n{self.text[start:end]}"}
+                ]
+            )
+            new_section = response.choices[0].message.content.strip()
+            self.section_edits.append((start, end, new_section))
+            edited_sections.append((self.text[start:end], new_section))
+
+        self._assemble_section_edits()
+
+        # Save a compact conversation context for refinement later
+        self.conversation_context = [
+            system_prompt,
+            {"role": "user", "content": f"Edit these sections of the Wikipedia article on {self.topic} to include the following information:\n{self.summary}\n\nSections:\n\n" + "\n\n".join(old for old, _ in edited_sections)},
+            {"role": "assistant", "content": "\n\n".join(new for _, new in edited_sections)},
+        ]
+
+        return self.response
+
+    def analyze_and_edit(self) -> str:
+        """
+        Fused variant of ContentAnalyzer.find_missing_information followed by
+        improve_article_with_missing_info: one structured-output call lists the missing
+        information of the source summary (self.summary) and rewrites only the passages it
+        belongs in. The bullets are kept in self.analysis.
+        """
+        system_prompt = {"role": "system", "content": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style, and do not make up information that is not in the presented documents. You focus on adding missing information rather than rewording existing information in the article."}
+        messages_prompt = [
+            system_prompt,
+            {"role": "user", "content": f"You will be given a summary of an external source of information, and the Wikipedia article on {self.topic}. First, while preserving all details, list every piece of information in the summary that is not present in the article. Then add that information to the article: for each passage (paragraph) that should contain some of it, copy the original passage exactly, and give the edited passage with NEW sentences placed in the relevant place. Avoid changing existing text too much, and only include passages that you changed. The summary is the following:\n{self.summary}\n\n\nTHE SUMMARY ENDS HERE. The article is the following:\n{self.text}"}
+        ]
+        response = limited_call("openai", self.client.beta.chat.completions.parse,
+            model="gpt-4o-mini-2024-07-18",
+            messages=messages_prompt,
+            response_format=AnalysisAndEdits,
+        )
+        result: AnalysisAndEdits = response.choices[0].message.parsed
+        self.analysis = "\n".join(f"- {bullet}" for bullet in result.missing_information)
+
+        self.section_edits = []
+        for edit in result.edits:
+            original_passage = edit.original_passage.strip()
+            start = self.text.find(original_passage) if original_passage else -1
+            if start < 0:
+                StreamlitLogger.log(f"[ContentEditor#{self.index}] Edited passage was not found in the article: '{original_passage[:80]}'")
+                continue
+            self.section_edits.append((start, start + len(original_passage), edit.edited_passage.strip()))
+        # in article order, dropping edits that overlap an earlier one
+        kept_edits = []
+        for edit in sorted(self.section_edits):
+            if not kept_edits or edit[0] >= kept_edits[-1][1]:
+                kept_edits.append(edit)
+        self.section_edits = kept_edits
+        self._assemble_section_edits()
+
+        # Save a compact conversation context for refinement later
+        self.conversation_context = [
+            system_prompt,
+            {"role": "user", "content": f"Edit passages of the Wikipedia article on {self.topic} to include the following information:\n{self.analysis}\n\nPassages:\n\n" + "\n\n".join(self.text[start:end] for start, end, _ in self.section_edits)},
+            {"role": "assistant", "content": "\n\n".join(new for _, _, new in self.section_edits)},
+        ]
+
+        return self.response
+
+    def _assemble_section_edits(self):
+        """Build the full rewritten article from self.section_edits, for display and refinement"""
+        parts = []
+        pos = 0
+        for start, end, new_passage in self.section_edits:
+            parts.append(self.text[pos:start])
+            parts.append(new_passage)
+            pos = end
+        parts.append(self.text[pos:])
+        self.response = "".join(parts)
+
+    def _section_opcodes(self) -> list:
+        """Diff only the rewritten passages, shifting their opcodes into article coordinates"""
+        opcodes = []
+        a_pos, delta = 0, 0
+        for start, end, new_passage in self.section_edits:
+            if start > a_pos:
+                opcodes.append(('equal', a_pos, start, a_pos + delta, start + delta))
+            for tag, i1, i2, j1, j2 in paragraph_diff_opcodes(self.text[start:end], new_passage):
+                opcodes.append((tag, start + i1, start + i2, start + delta + j1, start + delta + j2))
+            delta += len(new_passage) - (end - start)
+            a_pos = end
+        if a_pos < len(self.text):
+            opcodes.append(('equal', a_pos, len(self.text), a_pos + delta, len(self.text) + delta))
+        return opcodes
     
     def get_diff_suggestions(self) -> list[Suggestion]:
+        original, edited = self.text, self.response
+        if self.section_edits is not None:
+            opcodes = self._section_opcodes()
+        else:
+            # align paragraphs first, then diff changed paragraphs word by word
+            opcodes = paragraph_diff_opcodes(original, edited)
+        return self._suggestions_from_opcodes(opcodes, original, edited)
+
+    def _suggestions_from_opcodes(self, opcodes: list, original: str, edited: str) -> list[Suggestion]:
+        """Merge nearby changes and turn the opcodes (in offsets of original and edited) into suggestions"""
         THRESHOLD = 10  # Adjust this threshold as needed
 
-        matcher = difflib.SequenceMatcher(None, self.text, self.response)
-        opcodes = matcher.get_opcodes()
         # Merge nearby opcodes
         merged = []
         i = 0
@@ -140,60 +335,64 @@ class ContentEditor:
 
         def process_tag(tag, i1, i2, j1, j2):
             if tag == 'replace':
-                if (not matcher.a[i1:i2].strip()) and (not matcher.b[j1:j2].strip()):
+                if (not original[i1:i2].strip()) and (not edited[j1:j2].strip()):
                     return
                 
                 # pseudo-insert
-                if (not matcher.a[i1:i2].strip()):
+                if (not original[i1:i2].strip()):
                     tag = 'insert'
 
                 # pseudo-delete
-                elif (not matcher.b[j1:j2].strip()):
+                elif (not edited[j1:j2].strip()):
                     tag = 'delete'
 
 
                 else:
                     new_suggestion = Suggestion(
                         type=f"Edit (ContentEditor, with source {self.index})",
-                        text=f"Replace <b>'{matcher.a[i1:i2]}'</b><br>with <b>'{matcher.b[j1:j2]}'</b>",
-                        patch=WikitextPatcher.create_text_replacement_patch(matcher.a[i1:i2],matcher.b[j1:j2]),
+                        text=f"Replace <b>'{original[i1:i2]}'</b><br>with <b>'{edited[j1:j2]}'</b>",
+                        patch=WikitextPatcher.create_text_replacement_patch(original[i1:i2],edited[j1:j2]),
                         callback=self,
-                        context=f"<br><br><b>Original surrounding:</b> {generate_diff_context(matcher.a,i1,i2)}<br><b>New surrounding:</b> {generate_diff_context(matcher.b,j1,j2)}",
+                        context=f"<br><br><b>Original surrounding:</b> {generate_diff_context(original,i1,i2)}<br><b>New surrounding:</b> {generate_diff_context(edited,j1,j2)}",
                     )
                     suggestion_list.append(new_suggestion)
-                    #return '~~`' + matcher.a[i1:i2] + '`~~**`' + matcher.b[j1:j2] + '`**'
+                    #return '~~`' + original[i1:i2] + '`~~**`' + edited[j1:j2] + '`**'
                     return
             if tag == 'delete':
-                if not matcher.a[i1:i2].strip():
+                if not original[i1:i2].strip():
                     return
                 new_suggestion = Suggestion(
                     type=f"Edit (ContentEditor, with source {self.index})",
-                    text=f"Delete <b>'{matcher.a[i1:i2]}'</b>",
-                    patch=WikitextPatcher.create_text_replacement_patch(matcher.a[i1:i2],""),
+                    text=f"Delete <b>'{original[i1:i2]}'</b>",
+                    patch=WikitextPatcher.create_text_replacement_patch(original[i1:i2],""),
                     callback=self,
-                    context=f"<br><br><b>Original surrounding:</b> {generate_diff_context(matcher.a,i1,i2)}<br><b>New surrounding:</b> {generate_diff_context(matcher.b,j1,j2)}",
+                    context=f"<br><br><b>Original surrounding:</b> {generate_diff_context(original,i1,i2)}<br><b>New surrounding:</b> {generate_diff_context(edited,j1,j2)}",
                 )
                 suggestion_list.append(new_suggestion)
-                #return '~~`' + matcher.a[i1:i2] + '`~~'
+                #return '~~`' + original[i1:i2] + '`~~'
                 return
             if tag == 'equal':
                 return
-                #return matcher.a[i1:i2]
+                #return original[i1:i2]
             if tag == 'insert':
-                if not matcher.a[i1:i2].strip():
+                if not edited[j1:j2].strip():
                     return
+                # anchor the insertion on the unchanged text around it; a pseudo-insert
+                # replaces the whitespace original[i1:i2]
                 new_suggestion = Suggestion(
                     type=f"Edit (ContentEditor, with source {self.index})",
-                    text=f"Insert <b>'{matcher.a[i1:i2]}'</b>",
-                    patch=WikitextPatcher.create_text_replacement_patch(
-                        generate_diff_context_clean(matcher.a,i1,i2),
-                        generate_diff_context_clean(matcher.b,j1,j2)
+                    text=f"Insert <b>'{edited[j1:j2]}'</b>",
+                    patch=WikitextPatcher.create_insertion_patch(
+                        original[max(i1-LEN_CTX,0):i1],
+                        original[i1:i2],
+                        original[i2:min(i2+LEN_CTX,len(original))],
+                        edited[j1:j2]
                         ),
                     callback=self,
-                    context=f"<br><br><b>Original surrounding:</b> {generate_diff_context(matcher.a,i1,i2)}<br><b>New surrounding:</b> {generate_diff_context(matcher.b,j1,j2)}",
+                    context=f"<br><br><b>Original surrounding:</b> {generate_diff_context(original,i1,i2)}<br><b>New surrounding:</b> {generate_diff_context(edited,j1,j2)}",
                 )
                 suggestion_list.append(new_suggestion)
-                #return '**`' + matcher.b[j1:j2] + '`**'
+                #return '**`' + edited[j1:j2] + '`**'
                 return
             StreamlitLogger.log(f"[ContentEditor{self.index}] Unknown tag {tag} while diff-ing.")
             return
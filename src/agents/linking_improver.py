@@ -1,22 +1,79 @@
-from openai import OpenAI
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, ValidationError
+import openai
 from src.config.settings import config
 from src.ui.logger import StreamlitLogger
 from src.ui.suggestion import Suggestion
-from src.utils.helpers import extract_context_from_words, strip_code_block, get_wikipedia_link
+from src.utils.helpers import extract_context_from_words, get_wikipedia_link, compact_refinement_context, strip_html
 from src.utils.wikitext_patcher import WikitextPatcher
 from src.utils.wikipedia import WikipediaClient
+from src.utils.term_scanner import TermScanner, CONTEXT_TEXT, CONTEXT_WIKILINK
+from src.utils.rate_limiter import limited_call
+from src.utils.llm_clients import get_openai_client
+from src.utils.concurrency import run_concurrently
 import json
+import time
+
+MAX_TOOL_ROUNDS = 8  # tool-calling rounds before the model must answer
+MAX_REPAIR_CHARS = 20000  # longest malformed answer sent back for repair
+
+LINKING_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_wiki_article_preview_tool",
+            "description": "Check whether or not an article with the supplied title exists. If it exists, also returns a short preview to see if it is relevant.",
+            "parameters": {
+            "type": "object",
+            "properties": {
+                "title": {
+                    "type": "string",
+                    "description": "The title of the article to search."
+                }
+            },
+            "required": ["title"],
+            "additionalProperties": False
+            },
+            "strict": True
+        }
+    },
+]
 
 
 class TermToLink(BaseModel):
+    # strict structured outputs require closed objects
+    model_config = ConfigDict(extra="forbid")
+
     term_to_link: str
     article: str
     reasoning: str
 
 class ListOfTerms(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     term_list: list[TermToLink]
 
+# schema-constrained final answer of the tool-calling loop; a raw schema rather than the
+# parse helper, so a malformed answer can still be salvaged
+LINKING_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "ListOfTerms", "strict": True, "schema": ListOfTerms.model_json_schema()},
+}
+
+def _salvage_terms(output: str) -> list[TermToLink]:
+    """Every complete term object in a truncated or otherwise malformed answer"""
+    decoder = json.JSONDecoder()
+    terms = []
+    position = output.find("{")
+    while position != -1:
+        try:
+            value, end = decoder.raw_decode(output, position)
+            terms.append(TermToLink.model_validate(value))
+            position = output.find("{", end)
+        except (ValueError, ValidationError):
+            # not a term object (e.g. the unfinished outer object), look inside it
+            position = output.find("{", position + 1)
+    return terms
+
 class LinkingImprover:
     def __init__(self, topic: str, wikitext: str):
         self.topic: str = topic
@@ -24,7 +81,7 @@ class LinkingImprover:
         self.cached_term_list = None
         self.conversation_context = []
         self.wiki_client = WikipediaClient()
-        self.client = OpenAI(api_key=config.openai.api_key)
+        self.client = get_openai_client()
 
     def get_wiki_article_preview_tool(self, title: str):
         data = self.wiki_client.exists_article(title)
@@ -36,9 +93,21 @@ class LinkingImprover:
         else:
             return f"Article '{title}' does not exist."
 
+    def _refinement_context(self, original_suggestion: Suggestion) -> list:
+        """Conversation to refine a suggestion in: the suggestion and its surroundings only, unless configured otherwise"""
+        if config.full_refinement_context:
+            return list(self.conversation_context)
+        term = TermToLink(term_to_link=original_suggestion.extra[0], article=original_suggestion.extra[1], reasoning=original_suggestion.extra[2])
+        return compact_refinement_context(
+            self.conversation_context,
+            f"Identify terms of the Wikipedia article on {self.topic} that would benefit from linking to other Wikipedia articles, with a reasoning for each.",
+            strip_html(original_suggestion.context),
+            term.model_dump_json(),
+        )
+
     def continue_conversation(self, original_suggestion: Suggestion, user_input: str) -> Suggestion:
         # create a new context
-        new_conversation_context = list(self.conversation_context)
+        new_conversation_context = self._refinement_context(original_suggestion)
         # refine prompt
         new_conversation_context.append(
             {
@@ -46,7 +115,7 @@ class LinkingImprover:
                 "content": f"On the Wikipeda article {self.topic}, the user wants clarification on the suggestion to link the text \"{original_suggestion.extra[0]}\" to the article \"{original_suggestion.extra[1]}\". The following is their comment: \"{user_input}\". For the specified suggestion, provide an updated edit suggestion that does not change the text to be linked. Provide a reasoning that responds directly to the user."
             }
         )
-        response = self.client.beta.chat.completions.parse(
+        response = limited_call("openai", self.client.beta.chat.completions.parse,
             model="gpt-4o-mini-2024-07-18",
             messages=new_conversation_context,
             response_format=TermToLink,
@@ -106,7 +175,12 @@ class LinkingImprover:
             new_suggestion = Suggestion(
                 type="Add hyperlinking",
                 text=f"Link <b>'{term['term_to_link']}'</b> to article <b>'[{term['article']}]({get_wikipedia_link(term['article'])})'</b>",
-                patch=WikitextPatcher.create_text_replacement_patch(term['term_to_link'],replacement),
+                patch=WikitextPatcher.create_text_replacement_patch(
+                    term['term_to_link'],
+                    replacement,
+                    span=(term['first_occurrence'], term['first_occurrence'] + len(term['term_to_link'])),
+                    wikitext=self.wikitext
+                    ),
                 callback=self,
                 context=f"<br><b>Featured in this sentence:</b> {original_sentence}.<br><b>Reasoning:</b> {term['reasoning']}",
                 extra=[term['term_to_link'],term['article'],term['reasoning']]
@@ -115,140 +189,125 @@ class LinkingImprover:
 
         return suggestion_list
     
-    def _run_until_completion(self, run, thread, assistant):
-        if run.status == 'completed':
-            messages = self.client.beta.threads.messages.list(
-                thread_id=thread.id
-            )
-            print(messages, flush=True)
-            print(messages.data[0].content[0].text.value, flush=True)
-            return strip_code_block(messages.data[0].content[0].text.value)
-        else:
-            print(run.status, flush=True)
-
-        # Define the list to store tool outputs
-        tool_outputs = []
-        
-        # Loop through each tool in the required action section
-        for tool in run.required_action.submit_tool_outputs.tool_calls:
-            if tool.function.name == "get_wiki_article_preview_tool":
-                print(f"MW Search tool with arg {tool.function.arguments}", flush=True)
-
-                args = json.loads(tool.function.arguments)
-                output = self.get_wiki_article_preview_tool(args['title'])
-                tool_outputs.append({
-                    "tool_call_id": tool.id,
-                    "output": output
-                })
-            else:
+    def _execute_tool_calls(self, tool_calls) -> list:
+        """Run the tool calls of one round in parallel and return their tool messages, in order"""
+        def execute(tool):
+            if tool.function.name != "get_wiki_article_preview_tool":
                 print("Unknown tool", flush=True)
-        
-        # Submit all tool outputs at once after collecting them in a list
-        if tool_outputs:
-            StreamlitLogger.log(f"Tool outputs: {tool_outputs}")
-            try:
-                run = self.client.beta.threads.runs.submit_tool_outputs_and_poll(
-                thread_id=thread.id,
-                run_id=run.id,
-                tool_outputs=tool_outputs
-                )
-                print("Tool outputs submitted successfully.")
-            except Exception as e:
-                print("Failed to submit tool outputs:", e)
-        else:
-            ("No tool outputs to submit.")
+                return f"Unknown tool '{tool.function.name}'."
+            print(f"MW Search tool with arg {tool.function.arguments}", flush=True)
+            args = json.loads(tool.function.arguments)
+            return self.get_wiki_article_preview_tool(args['title'])
 
-        return self._run_until_completion(run,thread,assistant)
-    
+        results = run_concurrently(execute, tool_calls, config.max_concurrency)
+        tool_messages = []
+        for tool, result in zip(tool_calls, results):
+            output = result.value if result.ok else f"Tool call failed: {str(result.error)}"
+            tool_messages.append({"role": "tool", "tool_call_id": tool.id, "content": output})
+        return tool_messages
 
-    def _request_additional_linking(self):
-        """Use GPT-4o to check for neutrality."""
+    def _run_until_completion(self, messages: list) -> str:
+        """
+        Tool-calling loop over chat completions. Every round answers all the tool calls of
+        the previous response at once; after MAX_TOOL_ROUNDS the model has to answer
+        without tools.
+        """
+        for round_idx in range(1, MAX_TOOL_ROUNDS + 1):
+            round_start = time.perf_counter()
+            last_round = round_idx == MAX_TOOL_ROUNDS
+            response = limited_call("openai", self.client.chat.completions.create,
+                model="gpt-4o-mini-2024-07-18",
+                messages=messages,
+                tools=LINKING_TOOLS,
+                tool_choice="none" if last_round else "auto",
+                response_format=LINKING_RESPONSE_FORMAT,
+            )
+            message = response.choices[0].message
+            messages.append(message)
 
-        assistant = self.client.beta.assistants.create(
-            instructions="You are a Wikipedia editor. Follow Wikipedia's neutral tone and style. You want to improve readability of articles by linking to other article in-text when appropriate.",
-            model="gpt-4o-mini-2024-07-18",
-            tools=[
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "get_wiki_article_preview_tool",
-                        "description": "Check whether or not an article with the supplied title exists. If it exists, also returns a short preview to see if it is relevant.",
-                        "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "title": {
-                                "type": "string",
-                                "description": "The title of the article to search."
-                            }
-                        },
-                        "required": ["title"],
-                        "additionalProperties": False
-                        },
-                        "strict": True
-                    }
-                },
-            ]
-        )
+            if not message.tool_calls:
+                StreamlitLogger.log(f"[LinkingImprover] Round {round_idx}: answered in {time.perf_counter() - round_start:.1f}s ({response.choices[0].finish_reason}).")
+                if message.refusal:
+                    StreamlitLogger.log(f"[LinkingImprover] Model refused: {message.refusal}")
+                print(message.content, flush=True)
+                return message.content or ""
 
-        thread = self.client.beta.threads.create()
-        message = self.client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=f"In order to improve readability, Wikipedia articles may link to other Wikipedia articles for completeness on a topic. The syntax is [[Title]] where Title is the linked article, or [[Title|Appearance]] where the term Appearance links to article Title. Identify terms that are not previously linked anywhere on the article, and that would benefit from being linked from article topic {self.topic}. Use the provided 'get_wiki_article_preview_tool' to check if an article exists, and if the article is appropriate, before linking. Provide a reasoning for each change. Format the output as ONLY a JSON list containing objects as such: [{{'term_to_link':'string','article':'string','reasoning':'string'}},...] where 'term_to_link' is the term found in text, 'article' is the name of the article it should link to, and 'reasoning' is the reasoning for doing so. The MediaWiki-formatted text starts now: \n\n{self.wikitext}",
-        )
+            messages += self._execute_tool_calls(message.tool_calls)
+            StreamlitLogger.log(f"[LinkingImprover] Round {round_idx}: {len(message.tool_calls)} tool call(s) in {time.perf_counter() - round_start:.1f}s.")
 
-        run = self.client.beta.threads.runs.create_and_poll(
-            thread_id=thread.id,
-            assistant_id=assistant.id,
-        )
+        return ""
 
-        output = self._run_until_completion(run,thread,assistant)
-        #StreamlitLogger.log(output)
-        correct_output = self._guardrail_ensure_valid_json_output(output)
+    def _request_additional_linking(self) -> list:
+        """Ask for terms to link, letting the model check candidate articles with a tool."""
+        messages_prompt = [
+            {"role": "system", "content": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style. You want to improve readability of articles by linking to other article in-text when appropriate."},
+            {"role": "user", "content": f"In order to improve readability, Wikipedia articles may link to other Wikipedia articles for completeness on a topic. The syntax is [[Title]] where Title is the linked article, or [[Title|Appearance]] where the term Appearance links to article Title. Identify terms that are not previously linked anywhere on the article, and that would benefit from being linked from article topic {self.topic}. Use the provided 'get_wiki_article_preview_tool' to check if an article exists, and if the article is appropriate, before linking. Provide a reasoning for each change. For each term, give 'term_to_link', the term as found in the text, 'article', the name of the article it should link to, and 'reasoning', the reasoning for doing so. The MediaWiki-formatted text starts now: \n\n{self.wikitext}"},
+        ]
 
-        if not correct_output:
-            return self._request_additional_linking()
-        
-        return json.loads(output)
-    
-    def _guardrail_ensure_valid_json_output(self, output):
-        passed = True
+        output = self._run_until_completion(messages_prompt)
+        term_list = self._parse_term_list(output)
+        # Save the prompt and final answer for refinement later; the tool rounds are not needed
+        self.conversation_context = messages_prompt[:2] + [messages_prompt[-1]]
+        return [term.model_dump() for term in term_list]
+
+    def _parse_term_list(self, output: str) -> list[TermToLink]:
+        """
+        Terms of the final answer. An answer that does not match the schema (e.g. cut off at
+        the output limit) keeps its complete terms; only if there are none, one small request
+        asks the model to repair the answer, instead of running the whole tool loop again.
+        """
         try:
-            list_of_terms = json.loads(output)
-
-            for term in list_of_terms:
-                if "term_to_link" in term and "article" in term and "reasoning" in term:
-                    pass
-                else:
-                    StreamlitLogger.log("Invalid JSON output from linking improver.")
-                    print("Invalid JSON output from linking improver.")
-                    passed = False
+            return ListOfTerms.model_validate_json(output).term_list
+        except ValidationError:
             pass
-        except ValueError:
-            StreamlitLogger.log("Invalid JSON output from linking improver.")
-            print("Invalid JSON output from linking improver.")
-            passed = False
+        if not output.strip():
+            StreamlitLogger.log("[LinkingImprover] Empty answer, no terms to link.")
+            return []
 
-        return passed
+        salvaged = _salvage_terms(output)
+        if salvaged:
+            StreamlitLogger.log(f"[LinkingImprover] Malformed answer, kept {len(salvaged)} complete term(s).")
+            return salvaged
+
+        StreamlitLogger.log("[LinkingImprover] Malformed answer, asking for a repair...")
+        try:
+            response = limited_call("openai", self.client.beta.chat.completions.parse,
+                model="gpt-4o-mini-2024-07-18",
+                messages=[
+                    {"role": "system", "content": "Convert the answer given by the user into the requested format. Keep every term, article and reasoning it contains, and do not add new ones."},
+                    {"role": "user", "content": output[:MAX_REPAIR_CHARS]},
+                ],
+                response_format=ListOfTerms,
+            )
+        except (ValidationError, openai.OpenAIError) as e:
+            StreamlitLogger.log(f"[LinkingImprover] Repair failed: {str(e)}")
+            return []
+        repaired = response.choices[0].message.parsed
+        return repaired.term_list if repaired else []
 
     def _guardrail_ensure_existing_terms(self, text :str, term_list) -> ListOfTerms:
-        idx = 0
-        while idx < len(term_list):
-            term = term_list[idx]
+        # find and classify every occurrence of every term in a single pass over the wikitext
+        hits = TermScanner(term["term_to_link"] for term in term_list).scan_by_term(text)
+
+        kept_terms = []
+        seen_terms = set()
+        for term in term_list:
+            term_hits = hits.get(term["term_to_link"], [])
+            plain_hits = [hit for hit in term_hits if hit.context == CONTEXT_TEXT]
 
-            if not (term["term_to_link"] in text):
+            if not term_hits:
                 # remove term if it wasn't found in original text
                 StreamlitLogger.log(f"[Guardrail] Term '{term["term_to_link"]}' was not found in original text.")
-                term_list.pop(idx)
-            elif f"{term["term_to_link"]}]]" in text:
+            elif any(hit.context == CONTEXT_WIKILINK for hit in term_hits):
                 StreamlitLogger.log(f"[Guardrail] Term '{term["term_to_link"]}' already has a hyperlink.")
-                term_list.pop(idx)
-            elif f"[[{term["term_to_link"]}" in text:
-                StreamlitLogger.log(f"[Guardrail] Term '{term["term_to_link"]}' is already a hyperlinked article.")
-                term_list.pop(idx)
-                
+            elif not plain_hits:
+                StreamlitLogger.log(f"[Guardrail] Term '{term["term_to_link"]}' only appears inside templates or references.")
+            elif term["term_to_link"] in seen_terms:
+                # only the first occurrence of a term gets linked
+                StreamlitLogger.log(f"[Guardrail] Term '{term["term_to_link"]}' was suggested more than once.")
             else:
-                # only increment if no erasure
-                idx += 1
+                term["first_occurrence"] = plain_hits[0].start
+                seen_terms.add(term["term_to_link"])
+                kept_terms.append(term)
 
-        return term_list
\ No newline at end of file
+        return kept_terms
\ No newline at end of file
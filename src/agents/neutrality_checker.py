@@ -1,11 +1,20 @@
-from openai import OpenAI
-from pydantic import BaseModel
+from collections import OrderedDict
+import hashlib
+import threading
+from pydantic import BaseModel, ValidationError
+from typing import Callable
 from src.config.settings import config
 from src.ui.logger import StreamlitLogger
 from src.ui.suggestion import Suggestion
-from src.utils.helpers import extract_context_from_words
+from src.utils.helpers import extract_context_from_words, compact_refinement_context, strip_html
 from src.utils.wikitext_patcher import WikitextPatcher
+from src.utils.term_scanner import TermScanner
+from src.utils.rate_limiter import limited_call, limited_stream
+from src.utils.llm_clients import get_openai_client
+from src.utils.concurrency import run_concurrently
+from src.utils.token_budget import split_to_budget
 
+MAX_CACHED_SECTIONS = 512  # section results kept across NeutralityChecker instances
 
 class TermReplacement(BaseModel):
     non_neutral_term: str
@@ -15,15 +24,41 @@ class TermReplacement(BaseModel):
 class ListOfTerms(BaseModel):
     term_list: list[TermReplacement]
 
+def _deduplicate_terms(term_list: list[TermReplacement]) -> list[TermReplacement]:
+    """Keep the first suggestion for every non-neutral term"""
+    seen = set()
+    unique_terms = []
+    for term in term_list:
+        if term.non_neutral_term not in seen:
+            seen.add(term.non_neutral_term)
+            unique_terms.append(term)
+    return unique_terms
+
 class NeutralityChecker:
+    # terms found per section, keyed by a hash of the section text
+    _section_cache: "OrderedDict[str, list[TermReplacement]]" = OrderedDict()
+    _section_cache_lock = threading.Lock()
+
     def __init__(self):
         self.cached_term_list = None
         self.conversation_context = []
-        self.client = OpenAI(api_key=config.openai.api_key)
+        self.client = get_openai_client()
+
+    def _refinement_context(self, original_suggestion: Suggestion) -> list:
+        """Conversation to refine a suggestion in: the suggestion and its surroundings only, unless configured otherwise"""
+        if config.full_refinement_context:
+            return list(self.conversation_context)
+        term = TermReplacement(non_neutral_term=original_suggestion.extra[0], alternative_term=original_suggestion.extra[1], reasoning=original_suggestion.extra[2])
+        return compact_refinement_context(
+            self.conversation_context,
+            "Find non-neutral terms in a Wikipedia article and suggest a neutral alternative wording for each, with a reasoning.",
+            strip_html(original_suggestion.context),
+            term.model_dump_json(),
+        )
 
     def continue_conversation(self, original_suggestion: Suggestion, user_input: str) -> Suggestion:
         # create a new context
-        new_conversation_context = list(self.conversation_context)
+        new_conversation_context = self._refinement_context(original_suggestion)
         # refine prompt
         new_conversation_context.append(
             {
@@ -31,7 +66,7 @@ class NeutralityChecker:
                 "content": f"The user wants clarification on the suggestion to \"{original_suggestion.extra[0]}\" with \"{original_suggestion.extra[1]}\". The following is their comment: \"{user_input}\". For the specified suggestion, provide an updated edit suggestion that does not change the non-neutral term but may change the alternative replacement. Provide a reasoning that responds directly to the user."
             }
         )
-        response = self.client.beta.chat.completions.parse(
+        response = limited_call("openai", self.client.beta.chat.completions.parse,
             model="gpt-4o-mini-2024-07-18",
             messages=new_conversation_context,
             response_format=TermReplacement,
@@ -64,6 +99,52 @@ class NeutralityChecker:
 
         return sanitized_list_container.term_list
 
+    def get_neutral_alternatives_by_section(self, text: str, sections: list[str]) -> list[TermReplacement]:
+        """
+        Section-parallel variant of get_neutral_alternatives. Every section is checked in its
+        own request, on at most max_concurrency threads, and the terms are merged in section
+        order. Results are cached by section content, so after an edit only the sections
+        that changed are checked again.
+        """
+        if not (self.cached_term_list is None):
+            return self.cached_term_list
+
+        keys = [hashlib.sha256(section.encode("utf-8")).hexdigest() for section in sections]
+        with self._section_cache_lock:
+            known = {key for key in keys if key in self._section_cache}
+        pending = {key: section for key, section in zip(keys, sections) if key not in known}
+        StreamlitLogger.log(f"[NeutralityChecker] Checking {len(pending)} of {len(sections)} section(s), {len(sections) - len(pending)} unchanged.")
+
+        results = run_concurrently(self._check_section, list(pending.values()), config.max_concurrency)
+        with self._section_cache_lock:
+            for key, result in zip(pending, results):
+                if not result.ok:
+                    StreamlitLogger.log(f"[NeutralityChecker] Section check failed: {str(result.error)}")
+                    continue
+                self._section_cache[key] = result.value
+            merged = ListOfTerms(term_list=[])
+            for key in keys:
+                if key in self._section_cache:
+                    self._section_cache.move_to_end(key)
+                    merged.term_list += self._section_cache[key]
+            while len(self._section_cache) > MAX_CACHED_SECTIONS:
+                self._section_cache.popitem(last=False)
+        merged.term_list = _deduplicate_terms(merged.term_list)
+
+        sanitized_list_container = self._guardrail_ensure_existing_terms(text, merged)
+        StreamlitLogger.log(f"Non-neutral language and alternatives: {sanitized_list_container.term_list}")
+
+        self.conversation_context = self._merged_context(sanitized_list_container)
+        self.cached_term_list = sanitized_list_container.term_list
+        return sanitized_list_container.term_list
+
+    def _check_section(self, section: str) -> list[TermReplacement]:
+        # a section longer than the input budget is still split into chunks
+        term_list = []
+        for chunk in split_to_budget(section, config.max_input_tokens):
+            term_list += self._check_text(chunk).term_list
+        return term_list
+
     def get_suggestions(self, text: str) -> list[Suggestion]:
         
         if self.cached_term_list is None:
@@ -73,34 +154,90 @@ class NeutralityChecker:
         suggestion_list = []
         print(f"gen suggestions, {self.conversation_context}", flush=True)
         for term in self.cached_term_list:
-            term: TermReplacement
+            suggestion_list.append(self._make_suggestion(term, text))
 
-            original_sentence: str = extract_context_from_words(text,term.non_neutral_term)[0]
-            new_sentence = original_sentence.replace(term.non_neutral_term,term.alternative_term)
+        return suggestion_list
 
-            new_suggestion = Suggestion(
-                type="Non-neutral language",
-                text=f"Replace <b>'{term.non_neutral_term}'</b> with <b>'{term.alternative_term}'</b>",
-                patch=WikitextPatcher.create_text_replacement_patch(term.non_neutral_term,term.alternative_term),
-                callback=self,
-                context=f"<br><b>Featured in this sentence:</b> {original_sentence}.<br><b>Reasoning:</b> {term.reasoning}",
-                extra=[term.non_neutral_term, term.alternative_term, term.reasoning]
-            )
-            suggestion_list.append(new_suggestion)
+    def stream_suggestions(self, text: str, on_suggestion: Callable[[Suggestion], None] = None) -> list[Suggestion]:
+        """
+        Streaming variant of get_neutral_alternatives followed by get_suggestions. The JSON
+        answer is parsed as it arrives; every term is checked and turned into a suggestion
+        as soon as the model moves on to the next one.
+        """
+        messages_prompt = self._neutrality_prompt(text)
+        source = "NeutralityChecker"
+        suggestion_list = []
+        kept_terms = []
+
+        def emit(raw_term):
+            try:
+                term = TermReplacement.model_validate(raw_term)
+            except ValidationError:
+                return
+            if term.non_neutral_term not in text:
+                StreamlitLogger.log(f"[Guardrail] Term '{term.non_neutral_term}' with replacement '{term.alternative_term}' was not found in original text.")
+                return
+            suggestion = self._make_suggestion(term, text)
+            kept_terms.append(term)
+            suggestion_list.append(suggestion)
+            if on_suggestion:
+                on_suggestion(suggestion)
+
+        emitted = 0
+        with limited_stream("openai", self.client.beta.chat.completions.stream,
+            model="gpt-4o-mini-2024-07-18",
+            messages=messages_prompt,
+            response_format=ListOfTerms,
+        ) as stream:
+            for event in stream:
+                if event.type != "content.delta":
+                    continue
+                StreamlitLogger.stream(source, event.delta)
+                terms = (event.parsed or {}).get("term_list") or []
+                # an item is complete once the next one has started
+                while emitted < len(terms) - 1:
+                    emit(terms[emitted])
+                    emitted += 1
+            completion = stream.get_final_completion()
+        StreamlitLogger.end_stream(source)
+
+        term_list: list[TermReplacement] = completion.choices[0].message.parsed.term_list
+        for term in term_list[emitted:]:
+            emit(term.model_dump())
+
+        messages_prompt.append(completion.choices[0].message)
+        self.conversation_context = list(messages_prompt)
+        self.cached_term_list = kept_terms
 
         return suggestion_list
-    
-    
 
-    def _request_neutral_alternatives(self, text: str) -> ListOfTerms:
-        """Use GPT-4o to check for neutrality."""
+    def _make_suggestion(self, term: TermReplacement, text: str) -> Suggestion:
+        original_sentence: str = extract_context_from_words(text,term.non_neutral_term)[0]
+
+        return Suggestion(
+            type="Non-neutral language",
+            text=f"Replace <b>'{term.non_neutral_term}'</b> with <b>'{term.alternative_term}'</b>",
+            patch=WikitextPatcher.create_text_replacement_patch(term.non_neutral_term,term.alternative_term),
+            callback=self,
+            context=f"<br><b>Featured in this sentence:</b> {original_sentence}.<br><b>Reasoning:</b> {term.reasoning}",
+            extra=[term.non_neutral_term, term.alternative_term, term.reasoning]
+        )
 
-        messages_prompt = [
+    def _neutrality_prompt(self, text: str) -> list:
+        return [
             {"role": "system", "content": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style. You prioritize important issues rather than being pedantic over language usage."},
             {"role": "user", "content": f"Output a JSON list of non-neutral terms with a suggested alternative neutral wording for the following text. The alternative term may be an empty string if the non-neutral term is superfluous. Output an empty list if everything is in a neutral tone or if there are no big issues. Do not report the non-neutral term if there are no neutral alternatives. Provide a reasoning for each change. The text starts now: \n\n{text}"}
             ]
+    
+    def _request_neutral_alternatives(self, text: str) -> ListOfTerms:
+        """Use GPT-4o to check for neutrality."""
+        chunks = split_to_budget(text, config.max_input_tokens)
+        if len(chunks) > 1:
+            return self._request_neutral_alternatives_chunked(chunks)
+
+        messages_prompt = self._neutrality_prompt(text)
 
-        response = self.client.beta.chat.completions.parse(
+        response = limited_call("openai", self.client.beta.chat.completions.parse,
             model="gpt-4o-mini-2024-07-18",
             messages=messages_prompt,
             response_format=ListOfTerms,
@@ -109,19 +246,46 @@ class NeutralityChecker:
         messages_prompt.append(response.choices[0].message)
         self.conversation_context = list(messages_prompt)
         return response.choices[0].message.parsed
+
+    def _request_neutral_alternatives_chunked(self, chunks: list[str]) -> ListOfTerms:
+        """Check the parts of a long text in parallel and merge their terms in text order, without repeats"""
+        StreamlitLogger.log(f"[NeutralityChecker] Text is too long for one request, checking it in {len(chunks)} parts...")
+
+        merged = ListOfTerms(term_list=[])
+        for idx, result in enumerate(run_concurrently(self._check_text, chunks, config.max_concurrency), start=1):
+            if not result.ok:
+                StreamlitLogger.log(f"[NeutralityChecker] Part {idx}/{len(chunks)} failed: {str(result.error)}")
+                continue
+            merged.term_list += result.value.term_list
+        merged.term_list = _deduplicate_terms(merged.term_list)
+
+        self.conversation_context = self._merged_context(merged)
+        return merged
+
+    def _check_text(self, text: str) -> ListOfTerms:
+        """One stand-alone neutrality request, safe to run from worker threads"""
+        return limited_call("openai", self.client.beta.chat.completions.parse,
+            model="gpt-4o-mini-2024-07-18",
+            messages=self._neutrality_prompt(text),
+            response_format=ListOfTerms,
+        ).choices[0].message.parsed
+
+    def _merged_context(self, merged: ListOfTerms) -> list:
+        # the whole exchange does not fit a request; keep the instructions and merged answer
+        return self._neutrality_prompt("")[:1] + [{"role": "assistant", "content": merged.model_dump_json()}]
     
     def _guardrail_ensure_existing_terms(self, text :str, term_list_container :ListOfTerms) -> ListOfTerms:
-        idx = 0
-        while idx < len(term_list_container.term_list):
-            term :TermReplacement = term_list_container.term_list[idx]
+        # find every term in a single pass over the text
+        hits = TermScanner(term.non_neutral_term for term in term_list_container.term_list).scan_by_term(text, classify=False)
 
-            if not (term.non_neutral_term in text):
+        kept_terms = []
+        for term in term_list_container.term_list:
+            term :TermReplacement
+            if not hits.get(term.non_neutral_term):
                 # remove term if it wasn't found in original text
                 StreamlitLogger.log(f"[Guardrail] Term '{term.non_neutral_term}' with replacement '{term.alternative_term}' was not found in original text.")
-                term_list_container.term_list.pop(idx)
-                
             else:
-                # only increment if no erause
-                idx += 1
+                kept_terms.append(term)
 
+        term_list_container.term_list = kept_terms
         return term_list_container
\ No newline at end of file
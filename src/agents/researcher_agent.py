@@ -1,8 +1,11 @@
-from openai import OpenAI
 from pydantic import BaseModel
 from src.config.settings import config
 from src.ui.logger import StreamlitLogger
 from src.ui.suggestion import Suggestion
+from src.utils.rate_limiter import limited_call
+from src.utils.llm_clients import get_openai_client
+from src.utils.concurrency import run_concurrently
+from src.utils.token_budget import split_to_budget
 
 
 
@@ -11,22 +14,37 @@ class ResearcherAgent:
         self.topic: str = topic
         self.text: str = research_text
         self.response: str = None
-        self.client = OpenAI(api_key=config.openai.api_key)
+        self.client = get_openai_client()
     
     def summarize_source(self) -> str:
         """Use GPT-4 to improve content based on analysis."""
-        response = self.client.chat.completions.create(
+        chunks = split_to_budget(self.text, config.max_input_tokens)
+        if len(chunks) <= 1:
+            self.response = self._summarize_chunk(self.text)
+            return self.response
+
+        # map: summarize the parts in parallel; reduce: join their bullets, dropping repeats
+        StreamlitLogger.log(f"[ResearcherAgent] Source is too long for one request, summarizing it in {len(chunks)} parts...")
+        bullets = []
+        seen = set()
+        for idx, result in enumerate(run_concurrently(self._summarize_chunk, chunks, config.max_concurrency), start=1):
+            if not result.ok:
+                StreamlitLogger.log(f"[ResearcherAgent] Part {idx}/{len(chunks)} failed: {str(result.error)}")
+                continue
+            for line in result.value.splitlines():
+                if line.strip() and line.strip() not in seen:
+                    seen.add(line.strip())
+                    bullets.append(line)
+        self.response = "\n".join(bullets)
+
+        return self.response
+
+    def _summarize_chunk(self, text: str) -> str:
+        response = limited_call("openai", self.client.chat.completions.create,
             model="gpt-4o-mini-2024-07-18",
             messages=[
                 {"role": "system", "content": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style, and do not make up information that is not in the presented documents."},
-                {"role": "user", "content": f"In bullet point form, extract information of encyclopedic value including but not limited to metrics and dates, that is related to the topic of '{self.topic}' in the text that will follow. It must relate to '{self.topic}' in some form. The text starts now:\n\n{self.text}"}
+                {"role": "user", "content": f"In bullet point form, extract information of encyclopedic value including but not limited to metrics and dates, that is related to the topic of '{self.topic}' in the text that will follow. It must relate to '{self.topic}' in some form. The text starts now:\n\n{text}"}
             ]
         )
-        self.response = response.choices[0].message.content
-
         return response.choices[0].message.content
-
-
-
-        
-
@@ -1,10 +1,11 @@
-from anthropic import Anthropic
 from pydantic import BaseModel
 from src.config.settings import config
 from src.ui.logger import StreamlitLogger
 from src.ui.suggestion import Suggestion
 from src.utils.helpers import parse_to_mediawiki, parse_to_streamlit
 from src.utils.wikitext_patcher import WikitextPatcher
+from src.utils.rate_limiter import limited_call, limited_stream
+from src.utils.llm_clients import get_anthropic_client
 import difflib
 
 
@@ -15,8 +16,9 @@ def generate_diff_context(text, i1, i2):
 
 
 class ResearcherAgentV2:
-    def __init__(self, topic: str, research_text_b64: str, plaintext_article: str):
+    def __init__(self, topic: str, research_text_b64: str, plaintext_article: str, idx: int = 1):
         self.topic: str = topic
+        self.index = idx
         self.document: str = research_text_b64
         self.plaintext_article: str = plaintext_article
 
@@ -24,13 +26,40 @@ class ResearcherAgentV2:
         self.stparsed_response: str = None
 
         self.response: str = None
-        self.client = Anthropic(api_key=config.anthropic.api_key)
+        # input token counts of the last call, including prompt cache writes and reads
+        self.token_usage: dict = {}
+        self.client = get_anthropic_client()
     
-    def summarize_source(self) -> str:
-        response = self.client.messages.create(
+    def summarize_source(self, stream: bool = False) -> str:
+        request = self.summary_request()
+
+        if stream:
+            # show the bullet points in the log as they are written
+            source = f"ResearcherAgentV2#{self.index}"
+            with limited_stream("anthropic", self.client.messages.stream, **request) as message_stream:
+                for text in message_stream.text_stream:
+                    StreamlitLogger.stream(source, text)
+                response = message_stream.get_final_message()
+            StreamlitLogger.end_stream(source)
+        else:
+            response = limited_call("anthropic", self.client.messages.create, **request)
+
+        return self.complete_summary(response)
+
+    def summary_request(self) -> dict:
+        """Message parameters of summarize_source, e.g. for batch jobs"""
+        return dict(
             model="claude-3-5-haiku-20241022",
             max_tokens=2048,
-            system="You are a Wikipedia editor. Follow Wikipedia's neutral tone and style, and do not make up information that is not in the presented documents.",
+            # static prefix first (system prompt, then the document), so repeat summaries of
+            # the same PDF read it from the provider's prompt cache; the request varies after it
+            system=[
+                {
+                    "type": "text",
+                    "text": "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style, and do not make up information that is not in the presented documents.",
+                    "cache_control": {"type": "ephemeral"}
+                }
+            ],
             messages=[
                 {
                     "role": "user",
@@ -44,7 +73,8 @@ class ResearcherAgentV2:
                             },
                             "title": "User-submitted document",
                             "context": "This is a trustworthy document.",
-                            "citations": {"enabled": True}
+                            "citations": {"enabled": True},
+                            "cache_control": {"type": "ephemeral"}
                         },
                         {
                             "type": "text",
@@ -55,7 +85,16 @@ class ResearcherAgentV2:
             ]
         )
 
+    def complete_summary(self, response):
+        """Parse the message returned for summary_request"""
         print(response, flush=True)
+        self.token_usage = {
+            "input_tokens": response.usage.input_tokens,
+            "cache_creation_input_tokens": response.usage.cache_creation_input_tokens or 0,
+            "cache_read_input_tokens": response.usage.cache_read_input_tokens or 0,
+            "output_tokens": response.usage.output_tokens,
+        }
+        StreamlitLogger.log(f"[ResearcherAgentV2#{self.index}] Token usage: {self.token_usage}")
         self.mwparsed_response = parse_to_mediawiki(response)
         self.stparsed_response = parse_to_streamlit(response)
         
@@ -0,0 +1,248 @@
+# src/batch.py
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+import io
+import json
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, List
+from anthropic.types import Message
+from openai.types.chat import ChatCompletion
+from src.agents import ContentAnalyzer, ContentEditor, ResearcherAgentV2
+from src.core import format_source_summary
+from src.ui.logger import StreamlitLogger
+from src.ui.suggestion import Suggestion
+from src.utils.helpers import wikitext_to_plaintext_skip_tables_refs
+from src.utils.llm_clients import get_anthropic_client, get_openai_client
+from src.utils.rate_limiter import limited_call
+from src.utils.wikitext_patcher import WikitextPatcher
+
+BATCH_ENDED = "ended"
+BATCH_RUNNING = "running"
+
+RESPONSE_TYPES = {"openai": ChatCompletion, "anthropic": Message}
+
+class BatchBackend(ABC):
+    """
+    Runs a set of LLM requests of one provider as a single asynchronous job.
+
+    Requests are the keyword arguments of a normal client call (chat.completions.create
+    for OpenAI, messages.create for Anthropic), keyed by a custom id of at most 64
+    characters in [a-zA-Z0-9_-]. results() maps each custom id to its response, or to an
+    Exception if that request failed.
+    """
+
+    @abstractmethod
+    def submit(self, provider: str, requests: Dict[str, dict]) -> str:
+        """Start a batch job and return its id"""
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """BATCH_ENDED once the results are available, BATCH_RUNNING before"""
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Dict[str, Any]:
+        """Responses of an ended batch, keyed by custom id"""
+
+class ProviderBatchBackend(BatchBackend):
+    """OpenAI Batch API and Anthropic Message Batches API"""
+
+    def submit(self, provider: str, requests: Dict[str, dict]) -> str:
+        if provider == "anthropic":
+            batch = get_anthropic_client().messages.batches.create(
+                requests=[{"custom_id": custom_id, "params": params} for custom_id, params in requests.items()]
+            )
+            return f"anthropic:{batch.id}"
+
+        lines = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": params})
+            for custom_id, params in requests.items()
+        ]
+        client = get_openai_client()
+        input_file = client.files.create(
+            file=("batch_input.jsonl", io.BytesIO("\n".join(lines).encode("utf-8"))),
+            purpose="batch",
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return f"openai:{batch.id}"
+
+    def status(self, batch_id: str) -> str:
+        provider, provider_id = batch_id.split(":", 1)
+        if provider == "anthropic":
+            batch = get_anthropic_client().messages.batches.retrieve(provider_id)
+            return BATCH_ENDED if batch.processing_status == "ended" else BATCH_RUNNING
+        batch = get_openai_client().batches.retrieve(provider_id)
+        return BATCH_ENDED if batch.status in ("completed", "failed", "expired", "cancelled") else BATCH_RUNNING
+
+    def results(self, batch_id: str) -> Dict[str, Any]:
+        provider, provider_id = batch_id.split(":", 1)
+        results = {}
+        if provider == "anthropic":
+            for entry in get_anthropic_client().messages.batches.results(provider_id):
+                if entry.result.type == "succeeded":
+                    results[entry.custom_id] = entry.result.message
+                else:
+                    results[entry.custom_id] = RuntimeError(f"Batch request {entry.result.type}.")
+            return results
+
+        client = get_openai_client()
+        batch = client.batches.retrieve(provider_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[entry["custom_id"]] = ChatCompletion.model_validate(response["body"])
+                else:
+                    results[entry["custom_id"]] = RuntimeError(f"Batch request failed: {entry.get('error') or response.get('body')}")
+        return results
+
+def call_synchronously(provider: str, params: dict):
+    """Send one batch request as a normal (rate-limited) API call"""
+    if provider == "anthropic":
+        return limited_call("anthropic", get_anthropic_client().messages.create, **params)
+    return limited_call("openai", get_openai_client().chat.completions.create, **params)
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for the provider batch APIs. A batch is a JSONL input file in
+    directory; it is processed on the first status() call by sending every request to
+    responder(provider, params), and the responses are written to a JSONL output file.
+    The default responder makes normal API calls; tests can pass a fake instead.
+    """
+
+    def __init__(self, directory: str, responder: Callable[[str, dict], Any] = call_synchronously):
+        self.directory: str = directory
+        self.responder = responder
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    def submit(self, provider: str, requests: Dict[str, dict]) -> str:
+        batch_id = f"{provider}-{uuid.uuid4().hex[:12]}"
+        with open(self._path(batch_id, "input"), "w", encoding="utf-8") as file:
+            for custom_id, params in requests.items():
+                file.write(json.dumps({"custom_id": custom_id, "provider": provider, "params": params}) + "\n")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        if not os.path.exists(self._path(batch_id, "output")):
+            self._process(batch_id)
+        return BATCH_ENDED
+
+    def _process(self, batch_id: str):
+        output_lines = []
+        with open(self._path(batch_id, "input"), encoding="utf-8") as file:
+            for line in file:
+                entry = json.loads(line)
+                try:
+                    response = self.responder(entry["provider"], entry["params"])
+                    output_lines.append({"custom_id": entry["custom_id"], "provider": entry["provider"], "response": response.model_dump(mode="json")})
+                except Exception as e:
+                    output_lines.append({"custom_id": entry["custom_id"], "provider": entry["provider"], "error": str(e)})
+        # write the whole output at once so an interrupted run is processed again
+        with open(self._path(batch_id, "output"), "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(line) + "\n" for line in output_lines)
+
+    def results(self, batch_id: str) -> Dict[str, Any]:
+        results = {}
+        with open(self._path(batch_id, "output"), encoding="utf-8") as file:
+            for line in file:
+                entry = json.loads(line)
+                if "error" in entry:
+                    results[entry["custom_id"]] = RuntimeError(entry["error"])
+                else:
+                    results[entry["custom_id"]] = RESPONSE_TYPES[entry["provider"]].model_validate(entry["response"])
+        return results
+
+@dataclass
+class BatchArticle:
+    """
+    An article to improve in a batch run.
+
+    Attributes:
+        title (str): Wikipedia article title
+        wikitext (str): Current wikitext of the article
+        sources (List[str]): Base64-encoded source PDFs
+    """
+    title: str
+    wikitext: str
+    sources: List[str] = field(default_factory=list)
+
+class BatchRunner:
+    """
+    Source-improvement flow (ResearcherAgentV2, ContentAnalyzer, ContentEditor) for many
+    articles at once. Each stage becomes one batch job covering every article and source,
+    and the next stage is built from its results, so a run costs three batch jobs however
+    many articles it covers. A request that fails only drops its own source.
+    """
+
+    def __init__(self, backend: BatchBackend, poll_interval: float = 60):
+        self.backend: BatchBackend = backend
+        self.poll_interval: float = poll_interval
+
+    def run(self, articles: List[BatchArticle]) -> List[List[Suggestion]]:
+        """Return the suggestions of every article, in the order of articles"""
+        plaintexts = [wikitext_to_plaintext_skip_tables_refs(article.wikitext) for article in articles]
+        article_of = {}
+
+        researchers = {}
+        for article_idx, article in enumerate(articles):
+            for source_idx, source in enumerate(article.sources, start=1):
+                key = f"a{article_idx}-s{source_idx}"
+                article_of[key] = article_idx
+                researchers[key] = ResearcherAgentV2(article.title, source, plaintexts[article_idx], source_idx)
+        responses = self._run_stage("anthropic", "research", {key: agent.summary_request() for key, agent in researchers.items()})
+
+        analyzers = {}
+        for key, response in responses.items():
+            researchers[key].complete_summary(response)
+            article_idx = article_of[key]
+            analyzers[key] = ContentAnalyzer(articles[article_idx].title, plaintexts[article_idx], format_source_summary(researchers[key].stparsed_response))
+        responses = self._run_stage("openai", "analyze", {key: agent.missing_information_request() for key, agent in analyzers.items()})
+
+        editors = {}
+        for key, response in responses.items():
+            article_idx = article_of[key]
+            analysis = response.choices[0].message.content
+            editors[key] = ContentEditor(articles[article_idx].title, plaintexts[article_idx], analysis, researchers[key].index)
+        responses = self._run_stage("openai", "edit", {key: agent.missing_info_request() for key, agent in editors.items()})
+
+        suggestions = [[] for _ in articles]
+        for key, response in responses.items():
+            editors[key].complete_missing_info(response.choices[0].message.content)
+            suggestions[article_of[key]] += editors[key].get_diff_suggestions()
+        for article, suggestion_list in zip(articles, suggestions):
+            WikitextPatcher.anchor_suggestions(suggestion_list, article.wikitext)
+        return suggestions
+
+    def _run_stage(self, provider: str, stage: str, requests: Dict[str, dict]) -> Dict[str, Any]:
+        """Submit one stage as a batch, wait for it and return the successful responses by key"""
+        if not requests:
+            return {}
+        batch_id = self.backend.submit(provider, {f"{key}-{stage}": params for key, params in requests.items()})
+        StreamlitLogger.log(f"[Batch] Submitted {stage} batch {batch_id} with {len(requests)} request(s).")
+        started = time.perf_counter()
+        while self.backend.status(batch_id) != BATCH_ENDED:
+            time.sleep(self.poll_interval)
+
+        results = self.backend.results(batch_id)
+        responses = {}
+        for key in requests:
+            result = results.get(f"{key}-{stage}")
+            if result is None or isinstance(result, Exception):
+                StreamlitLogger.log(f"[Batch] {stage} request {key} failed: {result or 'no result'}")
+            else:
+                responses[key] = result
+        StreamlitLogger.log(f"[Batch] {stage} batch {batch_id} ended after {time.perf_counter() - started:.0f}s: {len(responses)}/{len(requests)} succeeded.")
+        return responses
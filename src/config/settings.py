@@ -41,6 +41,29 @@ class FileConfig:
         self.allowed_types = os.getenv("ALLOWED_FILE_TYPES", "pdf,txt,md,html").split(",")
         self.max_size = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB default
 
+class HTTPPoolConfig:
+    def __init__(self):
+        # connection pool shared by all agents of a provider
+        self.max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+        self.max_keepalive_connections = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+        self.keepalive_expiry = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+
+class LLMCacheConfig:
+    def __init__(self):
+        # off, on (read and write) or replay (read only, fail on a miss)
+        self.mode = os.getenv("LLM_CACHE", "off").lower()
+        self.path = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite")
+        self.ttl_seconds = float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600
+        self.max_bytes = int(os.getenv("LLM_CACHE_MB", "512")) * 1024 * 1024
+
+class LLMBackendConfig:
+    def __init__(self):
+        # api (OpenAI and Anthropic) or local (deterministic in-process stand-in, no network)
+        self.name = os.getenv("LLM_BACKEND", "api").lower()
+        # simulated time to first token and output speed of the local backend
+        self.local_latency = float(os.getenv("LOCAL_LLM_LATENCY", "0.5"))
+        self.local_tokens_per_second = float(os.getenv("LOCAL_LLM_TOKENS_PER_SECOND", "100"))
+
 class LoggingConfig:
     def __init__(self):
         self.level = os.getenv("LOG_LEVEL", "INFO")
@@ -60,9 +83,30 @@ class Settings:
         self.openai = OpenAIConfig()
         self.anthropic = AnthropicConfig()
         self.files = FileConfig()
+        self.http = HTTPPoolConfig()
+        self.llm_cache = LLMCacheConfig()
+        self.llm_backend = LLMBackendConfig()
         self.logging = LoggingConfig()
         self.debug = os.getenv("DEBUG", "false").lower() == "true"
         self.requests_per_minute = int(os.getenv("RATE_LIMIT", "30"))
+        self.tokens_per_minute = int(os.getenv("TOKEN_RATE_LIMIT", "200000"))
+        # Retries of rate-limited or failed LLM requests, with exponential backoff
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "5"))
+        # Only send the sections relevant to each missing-information bullet to ContentEditor
+        self.targeted_editing = os.getenv("TARGETED_EDITING", "false").lower() == "true"
+        # Find missing information and edit the article in one LLM call per source
+        self.fused_analysis = os.getenv("FUSED_ANALYSIS", "false").lower() == "true"
+        # Refine suggestions with the agent's whole conversation instead of the suggestion's surroundings
+        self.full_refinement_context = os.getenv("FULL_REFINEMENT_CONTEXT", "false").lower() == "true"
+        # Check neutrality section by section in parallel, rescanning only sections that changed
+        self.neutrality_sections = os.getenv("NEUTRALITY_SECTIONS", "false").lower() == "true"
+        # Stream LLM output into the log and emit suggestions as they are generated (ignored while
+        # LLM_CACHE is on, as streamed responses are not cached)
+        self.streaming = os.getenv("STREAMING", "false").lower() == "true"
+        # Maximum number of sources processed in parallel
+        self.max_concurrency = int(os.getenv("MAX_CONCURRENCY", "4"))
+        # Inputs above this estimated token count are split into chunks processed in parallel
+        self.max_input_tokens = int(os.getenv("MAX_INPUT_TOKENS", "16000"))
 
 # Singleton instance
 config = Settings()
\ No newline at end of file
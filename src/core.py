@@ -4,6 +4,11 @@ from src.utils.file_parser import ContentParser
 from src.config.settings import config
 from src.ui.suggestion import Suggestion
 from src.ui.logger import StreamlitLogger
+from src.utils.wikitext_patcher import WikitextPatcher
+from src.utils.concurrency import run_concurrently
+from src.utils.helpers import wikitext_to_section_plaintexts
+from src.utils.rate_limiter import streaming_enabled
+from typing import Callable
 import io
 
 def _research_text(article_title: str, parsed_source_list: list[str], source_source: str) -> tuple[list[ResearcherAgent],list[str]]:
@@ -42,10 +47,30 @@ def _analyze_research_and_article(article_title: str, article_content: str, summ
     analysis = new_analyzer.find_missing_information()
     return analysis
 
-def _edit_article(article_title: str, article_content: str, summary: str, idx: int) -> list[Suggestion]:
+def _edit_article(article_title: str, article_content: str, summary: str, idx: int, on_suggestion: Callable[[Suggestion], None] = None) -> list[Suggestion]:
     new_editor = ContentEditor(article_title, article_content, summary, idx)
-    new_editor.improve_article_with_missing_info()
-    return new_editor.get_diff_suggestions()
+    if streaming_enabled() and not config.targeted_editing:
+        return new_editor.stream_article_with_missing_info(on_suggestion)
+    if config.targeted_editing:
+        new_editor.improve_sections_with_missing_info()
+    else:
+        new_editor.improve_article_with_missing_info()
+    suggestion_list = new_editor.get_diff_suggestions()
+    if on_suggestion:
+        for suggestion in suggestion_list:
+            on_suggestion(suggestion)
+    return suggestion_list
+
+def _analyze_and_edit_article(article_title: str, article_content: str, summary: str, idx: int, on_suggestion: Callable[[Suggestion], None] = None) -> list[Suggestion]:
+    new_editor = ContentEditor(article_title, article_content, summary, idx)
+    new_editor.analyze_and_edit()
+    StreamlitLogger.log(f"[Analyzer#{idx}] Response:\n{new_editor.analysis}")
+    suggestion_list = new_editor.get_diff_suggestions()
+    StreamlitLogger.log(f"[ContentEditor#{idx}] Edit Diff List:\n{suggestion_list}")
+    if on_suggestion:
+        for suggestion in suggestion_list:
+            on_suggestion(suggestion)
+    return suggestion_list
 
 def enhance_article(article_title: str, source_files: list[io.BytesIO], source_urls: str) -> list[Suggestion]:
     # Initialize components
@@ -100,14 +125,21 @@ def enhance_article(article_title: str, source_files: list[io.BytesIO], source_u
 
     return suggestion_list
 
-def check_neutrality(article_title: str, article_content: str, wikitext_content):
+def check_neutrality(article_title: str, article_content: str, wikitext_content, on_suggestion: Callable[[Suggestion], None] = None):
     suggestion_list :list[Suggestion] = []
 
     neutrality = NeutralityChecker()
 
-    neutrality.get_neutral_alternatives(article_content)
-    suggestion_list += neutrality.get_suggestions(article_content)
+    if config.neutrality_sections:
+        neutrality.get_neutral_alternatives_by_section(article_content, wikitext_to_section_plaintexts(wikitext_content))
+        suggestion_list += neutrality.get_suggestions(article_content)
+    elif streaming_enabled():
+        suggestion_list += neutrality.stream_suggestions(article_content, on_suggestion)
+    else:
+        neutrality.get_neutral_alternatives(article_content)
+        suggestion_list += neutrality.get_suggestions(article_content)
 
+    WikitextPatcher.anchor_suggestions(suggestion_list, wikitext_content)
     return suggestion_list
 
 def improve_linking(article_title: str, article_content: str, wikitext_content):
@@ -118,34 +150,62 @@ def improve_linking(article_title: str, article_content: str, wikitext_content):
     link_improver.execute_flow()
     suggestion_list += link_improver.get_suggestions()
 
+    WikitextPatcher.anchor_suggestions(suggestion_list, wikitext_content)
     return suggestion_list
 
 def summarize_sources(article_title: str, article_content: str, wikitext_content, sources):
     b64_file_list = ContentParser.encode_pdfs_into_b64(sources)
     StreamlitLogger.log("Encoded sources.")
-    summaries = []
 
-    for i in range(len(b64_file_list)):
-        StreamlitLogger.log(f"Parsing source ({i+1})")
-        researcherV2 = ResearcherAgentV2(article_title, b64_file_list[i], article_content)
+    def summarize(job):
+        idx, b64_file = job
+        StreamlitLogger.log(f"Parsing source ({idx})")
+        researcherV2 = ResearcherAgentV2(article_title, b64_file, article_content, idx)
+
+        researcherV2.summarize_source(stream=streaming_enabled())
+        return researcherV2.stparsed_response
 
-        researcherV2.summarize_source()
-        summaries.append(researcherV2.stparsed_response)
+    # sources are independent, summarize them in parallel and keep their order; a failed
+    # source stays in the list as None, so every summary keeps its source's number
+    summaries = []
+    results = run_concurrently(summarize, list(enumerate(b64_file_list, start=1)), config.max_concurrency)
+    for idx, result in enumerate(results, start=1):
+        if result.ok:
+            summaries.append(result.value)
+        else:
+            summaries.append(None)
+            StreamlitLogger.log(f"[ResearcherAgentV2#{idx}] Failed to summarize source ({idx}): {str(result.error)}")
 
     return summaries 
 
-def enhance_with_source_summaries(article_title: str, article_content: str, wikitext_content, summaries):
+def format_source_summary(summary) -> str:
+    """Flatten a ResearcherAgentV2 summary (text and citation list) into the analyzer's input"""
+    return f"{summary[0]}\n\n{'\n'.join(summary[1])}"
+
+def enhance_with_source_summaries(article_title: str, article_content: str, wikitext_content, summaries, on_suggestion: Callable[[Suggestion], None] = None):
     suggestion_list :list[Suggestion] = []
 
-    StreamlitLogger.log("Generating suggestions...")
-    for idx, summary in enumerate(summaries, start=1):
-        parsed_summary = f"{summary[0]}\n\n{'\n'.join(summary[1])}"
+    def enhance(job):
+        idx, summary = job
+        parsed_summary = format_source_summary(summary)
+
+        if config.fused_analysis:
+            return _analyze_and_edit_article(article_title, article_content, parsed_summary, idx, on_suggestion)
 
         analysis = _analyze_research_and_article(article_title, article_content, parsed_summary)
         StreamlitLogger.log(f"[Analyzer#{idx}] Response:\n{analysis}")
-        edit_suggestions = _edit_article(article_title, article_content, analysis, idx)
+        edit_suggestions = _edit_article(article_title, article_content, analysis, idx, on_suggestion)
         StreamlitLogger.log(f"[ContentEditor#{idx}] Edit Diff List:\n{edit_suggestions}")
-        
-        suggestion_list += edit_suggestions
+        return edit_suggestions
 
+    StreamlitLogger.log("Generating suggestions...")
+    jobs = [(idx, summary) for idx, summary in enumerate(summaries, start=1) if summary is not None]
+    results = run_concurrently(enhance, jobs, config.max_concurrency)
+    for (idx, _), result in zip(jobs, results):
+        if result.ok:
+            suggestion_list += result.value
+        else:
+            StreamlitLogger.log(f"[ContentEditor#{idx}] Failed to generate suggestions for source {idx}: {str(result.error)}")
+
+    WikitextPatcher.anchor_suggestions(suggestion_list, wikitext_content)
     return suggestion_list
\ No newline at end of file
@@ -1,17 +1,38 @@
-from typing import Callable
+from typing import Callable, Dict
 
 # Shared logger to allow agents to log to the UI
 
 class StreamlitLogger:
     _log_callback: Callable[[str], None] = None
-    
+    _stream_callback: Callable[[str, str], None] = None
+    _stream_buffers: Dict[str, str] = {}
+
     @classmethod
-    def initialize(cls, callback: Callable[[str], None]):
+    def initialize(cls, callback: Callable[[str], None], stream_callback: Callable[[str, str], None] = None):
         cls._log_callback = callback
-        
+        cls._stream_callback = stream_callback
+
     @classmethod
     def log(cls, message: str):
         if cls._log_callback:
             cls._log_callback(message)
         else:
-            print(f"Fallback Log: {message}")  # For CLI/debugging
\ No newline at end of file
+            print(f"Fallback Log: {message}")  # For CLI/debugging
+
+    @classmethod
+    def stream(cls, source: str, chunk: str):
+        """Show LLM output as it arrives; the stream callback receives the source and its text so far"""
+        cls._stream_buffers[source] = cls._stream_buffers.get(source, "") + chunk
+        if cls._stream_callback:
+            cls._stream_callback(source, cls._stream_buffers[source])
+        else:
+            print(chunk, end="", flush=True)
+
+    @classmethod
+    def end_stream(cls, source: str):
+        """Close a stream and keep its full text as a regular log entry"""
+        text = cls._stream_buffers.pop(source, "")
+        if not cls._stream_callback:
+            print(flush=True)
+        if text:
+            cls.log(f"[{source}] Response:\n{text}")
@@ -12,10 +12,12 @@ class Suggestion:
         type (str): Category of the suggestion
         text (str): Human-readable description of the suggestion
         context (str): Context around the suggested material
-        patch Callable[[str],str]: Function to patch the original text with the suggestion
+        patch Callable[[str],str]: Function to patch the original text with the suggestion; WikitextPatcher patches also
+            carry the resolved wikitext span and the hash of the revision it was resolved against
         callback object: object of the agent so we can callback for refinements
         status (str): Current approval status; new suggestions should be 'pending'
         extra List[str]: Storing additional information, varies between agent tasks or empty list
+        conflicts List[int]: Ids of other pending suggestions whose wikitext span overlaps this one
         id (int): Unique identifier (auto-generated)
     """
     type: str
@@ -25,6 +27,7 @@ class Suggestion:
     context: str = "Unknown"
     status: str = 'pending'
     extra: List[str] = field(default_factory=list)
+    conflicts: List[int] = field(default_factory=list)
     id: int = field(init=False, default_factory=lambda: Suggestion._next_id())
     
     # Class-level ID counter
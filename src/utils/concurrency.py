@@ -0,0 +1,67 @@
+# utils/concurrency.py
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+import threading
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+@dataclass
+class TaskResult:
+    """
+    Outcome of one task of run_concurrently.
+
+    Attributes:
+        value (Any): Return value of the task, None if it failed
+        error (Optional[Exception]): Exception raised by the task
+    """
+    value: Any = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+def run_concurrently(func: Callable[..., Any], items: Sequence[Any], max_workers: int) -> List[TaskResult]:
+    """
+    Call func(item) for every item on a thread pool of at most max_workers threads and
+    return the results in the order of items. A task that raises does not affect the
+    others; its exception is returned in its TaskResult instead.
+
+    LLM calls spend their time waiting on the network, so threads are enough here. The
+    worker threads share the Streamlit script context of the caller, so session state
+    (API keys) and the logger keep working inside the tasks.
+    """
+    if max_workers <= 1 or len(items) <= 1:
+        return [_run_task(func, item) for item in items]
+
+    with _executor(max_workers, len(items)) as executor:
+        return list(executor.map(lambda item: _run_task(func, item), items))
+
+def iter_concurrently(func: Callable[..., Any], items: Sequence[Any], max_workers: int) -> Iterator[Tuple[int, TaskResult]]:
+    """
+    Like run_concurrently, but yields (index in items, TaskResult) pairs in the order the
+    tasks finish, so the caller can use every result as soon as it is ready.
+    """
+    if max_workers <= 1 or len(items) <= 1:
+        for idx, item in enumerate(items):
+            yield idx, _run_task(func, item)
+        return
+
+    with _executor(max_workers, len(items)) as executor:
+        futures = {executor.submit(_run_task, func, item): idx for idx, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def _run_task(func: Callable[..., Any], item: Any) -> TaskResult:
+    try:
+        return TaskResult(value=func(item))
+    except Exception as e:
+        return TaskResult(error=e)
+
+def _executor(max_workers: int, task_count: int) -> ThreadPoolExecutor:
+    # worker threads share the Streamlit script context of the calling thread
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(
+        max_workers=min(max_workers, task_count),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+    )
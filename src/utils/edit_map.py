@@ -0,0 +1,99 @@
+# utils/edit_map.py
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+from itertools import accumulate
+from typing import List, Optional, Tuple
+
+MAX_REVISIONS = 256  # revision transitions remembered by RevisionLog
+MAX_REBASE_STEPS = 64  # longest chain of revisions a span is carried through
+
+def revision_hash(wikitext: str) -> str:
+    """Content hash identifying a wikitext revision"""
+    return hashlib.sha1(wikitext.encode("utf-8")).hexdigest()
+
+@dataclass
+class Edit:
+    """Replacement of old_text[start:end] by new_length characters"""
+    start: int
+    end: int
+    new_length: int
+
+    @property
+    def delta(self) -> int:
+        return self.new_length - (self.end - self.start)
+
+class EditMap:
+    """
+    Sorted, non-overlapping edits taking one revision to the next. Maps spans of the old
+    revision onto the new one in O(log k) for k edits.
+    """
+
+    def __init__(self, edits: List[Edit]):
+        self.edits: List[Edit] = sorted(edits, key=lambda edit: (edit.start, edit.end))
+        self._ends = [edit.end for edit in self.edits]
+        self._shifts = [0] + list(accumulate(edit.delta for edit in self.edits))
+
+    @classmethod
+    def from_texts(cls, old: str, new: str) -> "EditMap":
+        """Describe old -> new as a single edit between their common prefix and suffix"""
+        limit = min(len(old), len(new))
+        prefix = 0
+        while prefix < limit and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+            suffix += 1
+        if prefix == len(old) == len(new):
+            return cls([])
+        return cls([Edit(prefix, len(old) - suffix, len(new) - suffix - prefix)])
+
+    def map_span(self, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """
+        Return the span [start, end) in the new revision, or None if an edit touched it.
+        Insertions exactly at the start of the span push it right, insertions at its end don't.
+        """
+        # every edit ending at or before start lies entirely before the span
+        before = bisect_right(self._ends, start)
+        if before < len(self.edits) and self.edits[before].start < end:
+            return None
+        shift = self._shifts[before]
+        return start + shift, end + shift
+
+class RevisionLog:
+    """Process-wide record of how each wikitext revision turned into the next one"""
+    _transitions: "OrderedDict[str, Tuple[str, EditMap]]" = OrderedDict()
+
+    @classmethod
+    def record(cls, old_revision: str, new_revision: str, edit_map: EditMap):
+        if old_revision == new_revision:
+            return
+        cls._transitions[old_revision] = (new_revision, edit_map)
+        cls._transitions.move_to_end(old_revision)
+        while len(cls._transitions) > MAX_REVISIONS:
+            cls._transitions.popitem(last=False)
+
+    @classmethod
+    def record_texts(cls, old: str, new: str):
+        """Record a free-form edit, e.g. typed into the text area"""
+        if old != new:
+            cls.record(revision_hash(old), revision_hash(new), EditMap.from_texts(old, new))
+
+    @classmethod
+    def rebase(cls, span: Tuple[int, int], from_revision: str, to_revision: str) -> Optional[Tuple[int, int]]:
+        """
+        Carry a span from one revision to a later one through the recorded edits. Returns
+        None if there is no recorded path or an edit on the way touched the span.
+        """
+        revision = from_revision
+        for _ in range(MAX_REBASE_STEPS):
+            if revision == to_revision:
+                return span
+            if revision not in cls._transitions:
+                return None
+            revision, edit_map = cls._transitions[revision]
+            span = edit_map.map_span(*span)
+            if span is None:
+                return None
+        return span if revision == to_revision else None
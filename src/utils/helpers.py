@@ -1,10 +1,19 @@
 # helper functions commonly used
-import mwparserfromhell
 import html
+import mwparserfromhell
 from mwparserfromhell.nodes import Tag, Template, Wikilink, Text
 import re
 from typing import Optional, Tuple, List, Dict
 import urllib.parse
+import time
+from src.utils.offset_index import get_offset_index, normalize_whitespace
+from src.utils.parse_cache import parse_cache
+from src.utils.section_index import get_section_index
+
+# Limits of the markup-tolerant fallback excerpt search
+FALLBACK_TIME_BUDGET = 0.5  # seconds
+FALLBACK_MAX_CANDIDATES = 2000
+FALLBACK_WINDOW_FACTOR = 5  # the matched wikitext may be this many times longer than the excerpt
 
 def extract_context_from_words(full_text: str, words: str):
     """Given a full text and a few words, extract the sentence(s) they were in. Splits on periods, so words cannot contain periods."""
@@ -105,175 +114,149 @@ def find_excerpt_position(plain_excerpt: str, wikitext: str) -> Optional[Tuple[i
     Returns:
         A tuple of (start_index, end_index) in the wikitext, or None if not found
     """
-    # Parse the wikitext
-    wikicode = mwparserfromhell.parse(wikitext)
-    
-    # Get the plain text version of the wikitext
-    plain_text = wikicode.strip_code()
-    
-    # Create a clean version of both texts for matching
-    clean_plain_excerpt = re.sub(r'\s+', ' ', plain_excerpt).strip()
-    clean_plain_text = re.sub(r'\s+', ' ', plain_text).strip()
-    
-    # First try exact matching
-    excerpt_pos = clean_plain_text.find(clean_plain_excerpt)
+    # The offset index is built once per wikitext revision, so this is a string search
+    # plus two array reads instead of a reparse per candidate end position
+    clean_plain_excerpt = normalize_whitespace(plain_excerpt)
+    if not clean_plain_excerpt:
+        return None
+
+    position = get_offset_index(wikitext).find(clean_plain_excerpt)
     
-    if excerpt_pos == -1:
+    if position is None:
         # If exact match fails, try more flexible matching
-        return fuzzy_find_excerpt(clean_plain_excerpt, wikitext)
-    
-    # Build the mapping between plain text and wikitext
-    mapping = build_text_to_wikitext_mapping(wikicode, wikitext)
+        return fallback_find_excerpt(clean_plain_excerpt, wikitext)
     
-    # Find the actual starting position in clean_plain_text
-    actual_start_pos = 0
-    for i in range(len(clean_plain_text)):
-        if i == excerpt_pos:
-            actual_start_pos = mapping[i]["wikitext_pos"] if i < len(mapping) else 0
-            break
-    
-    # Get the approximate end of the excerpt in wikitext
-    # We'll refine this by checking the rendered text
-    approx_wiki_len = len(clean_plain_excerpt) * 3  # Estimate wikitext is 3x longer than plain text
+    return position
+
+def fallback_find_excerpt(plain_excerpt: str, wikitext: str, time_budget: float = FALLBACK_TIME_BUDGET,
+                          max_candidates: int = FALLBACK_MAX_CANDIDATES, stats: Optional[Dict[str, float]] = None) -> Optional[Tuple[int, int]]:
+    """
+    Last resort approach for excerpts the offset index cannot see, e.g. text inside
+    template parameters or tables. Never parses the whole wikitext.
+
+    Every occurrence of the excerpt's first word is a candidate start (at most
+    max_candidates of them). From each candidate the remaining words are matched in
+    order inside a window of FALLBACK_WINDOW_FACTOR * len(excerpt) characters, so the
+    total work is bounded by O(len(wikitext) + max_candidates * window). The search
+    also stops once time_budget seconds have elapsed.
+
+    A match is only accepted if its stripped text is the excerpt and neither end lies
+    in markup (template or parameter names, link targets, URLs, tags), so splicing it
+    never deletes markup between or around the matched words.
     
-    # Start from a potential end position and gradually reduce until we match
-    for end_pos in range(actual_start_pos + approx_wiki_len, actual_start_pos, -1):
-        if end_pos >= len(wikitext):
-            end_pos = len(wikitext) - 1
-            
-        candidate_wikitext = wikitext[actual_start_pos:end_pos]
-        candidate_plain = mwparserfromhell.parse(candidate_wikitext).strip_code()
-        candidate_plain = re.sub(r'\s+', ' ', candidate_plain).strip()
+    Args:
+        plain_excerpt: The plain text excerpt to find
+        wikitext: The wikitext source to search in
+        time_budget: Wall-clock limit in seconds, the best span found so far is kept
+        max_candidates: Maximum number of candidate start positions to try
+        stats: If given, filled with the number of candidates tried, of spans parsed to
+            check them, the slowest of those parses in seconds, and whether the time
+            budget ran out
         
-        # Check if this candidate contains our excerpt
-        if clean_plain_excerpt in candidate_plain:
-            # Now find the minimum wikitext that contains the excerpt
-            for i in range(end_pos, actual_start_pos, -1):
-                shorter_wikitext = wikitext[actual_start_pos:i]
-                shorter_plain = mwparserfromhell.parse(shorter_wikitext).strip_code()
-                shorter_plain = re.sub(r'\s+', ' ', shorter_plain).strip()
-                
-                if clean_plain_excerpt not in shorter_plain:
-                    return actual_start_pos, i
-            
-            return actual_start_pos, end_pos
-    
-    # If we couldn't find a good match with the mapping approach, try the fallback
-    return fallback_find_excerpt(plain_excerpt, wikitext)
+    Returns:
+        The shortest (start_index, end_index) span containing all words of the excerpt
+        in order, or None if not found
+    """
+    words = normalize_whitespace(plain_excerpt).split(' ')
+    if not words[0]:
+        return None
 
-def build_text_to_wikitext_mapping(wikicode, wikitext):
-    """Build a mapping from positions in plain text to positions in wikitext."""
-    mapping = []
-    current_wikitext_pos = 0
-    
-    for node in wikicode.nodes:
-        if isinstance(node, mwparserfromhell.nodes.text.Text):
-            # For plain text nodes, each character maps directly
-            for char in str(node):
-                mapping.append({
-                    "char": char,
-                    "wikitext_pos": current_wikitext_pos
-                })
-                current_wikitext_pos += 1
-        else:
-            # For complex nodes (templates, links, etc.)
-            node_wikitext = str(node)
-            node_plain = node.strip_code() if hasattr(node, 'strip_code') else ''
-            
-            # Map each plain text character to the start of this node
-            for char in node_plain:
-                mapping.append({
-                    "char": char,
-                    "wikitext_pos": current_wikitext_pos
-                })
-            
-            # Update wikitext position to end of this node
-            current_wikitext_pos += len(node_wikitext)
-    
-    return mapping
+    # plaintext characters like '&' are usually written as entities in the wikitext
+    alternatives = [
+        [word] if html.escape(word, quote=False) == word else [word, html.escape(word, quote=False)]
+        for word in words
+    ]
+    window = FALLBACK_WINDOW_FACTOR * len(plain_excerpt)
+    deadline = time.monotonic() + time_budget
+    best = None
+    counts = {"candidates": 0, "parsed": 0, "slowest_parse": 0.0, "budget_exhausted": False}
+    if stats is not None:
+        stats.update(counts)
+        counts = stats
 
-def fuzzy_find_excerpt(plain_excerpt, wikitext):
-    """Use a more flexible approach to find the excerpt by checking multiple windows."""
-    clean_excerpt = re.sub(r'\s+', ' ', plain_excerpt).strip()
-    words = clean_excerpt.split()
-    
-    # Look for the start and end words
-    start_word = words[0]
-    end_word = words[-1]
-    
-    # Find potential start positions
-    start_positions = []
-    for match in re.finditer(re.escape(start_word), wikitext):
-        start_positions.append(match.start())
-    
-    # Find potential end positions
-    end_positions = []
-    for match in re.finditer(re.escape(end_word), wikitext):
-        end_positions.append(match.end())
-    
-    # Try various start and end combinations
-    for start in start_positions:
-        for end in end_positions:
-            if end <= start:
-                continue
-                
-            # Only consider reasonable lengths to avoid checking the entire document
-            if end - start > len(plain_excerpt) * 5:
+    for start in _iter_word_positions(wikitext, alternatives[0], max_candidates):
+        if time.monotonic() > deadline:
+            counts["budget_exhausted"] = True
+            break
+        counts["candidates"] += 1
+
+        limit = min(start + window, len(wikitext))
+        pos = start
+        for options in alternatives:
+            match = _find_first(wikitext, options, pos, limit)
+            if match is None:
+                break
+            pos = match[1]
+        else:
+            if best is not None and pos - start >= best[1] - best[0]:
                 continue
-                
-            candidate = wikitext[start:end]
-            candidate_plain = mwparserfromhell.parse(candidate).strip_code()
-            candidate_plain = re.sub(r'\s+', ' ', candidate_plain).strip()
-            
-            # Check if the excerpt is contained in this candidate
-            if clean_excerpt in candidate_plain:
-                return start, end
-    
-    return fallback_find_excerpt(plain_excerpt, wikitext)
+            counts["parsed"] += 1
+            parse_start = time.monotonic()
+            plain = _is_plain_span(wikitext, start, pos, plain_excerpt)
+            counts["slowest_parse"] = max(counts["slowest_parse"], time.monotonic() - parse_start)
+            if plain:
+                best = (start, pos)
+                if pos - start == len(plain_excerpt):
+                    # cannot get any tighter than the excerpt itself
+                    break
 
-def fallback_find_excerpt(plain_excerpt, wikitext):
-    """Last resort approach for complex cases."""
-    # Generate overlapping chunks of the wikitext
-    chunk_size = min(len(wikitext), 1000)  # Use reasonably sized chunks
-    overlap = 200
-    
-    for i in range(0, len(wikitext), chunk_size - overlap):
-        chunk = wikitext[i:i+chunk_size]
-        chunk_plain = mwparserfromhell.parse(chunk).strip_code()
-        chunk_plain = re.sub(r'\s+', ' ', chunk_plain).strip()
-        
-        clean_excerpt = re.sub(r'\s+', ' ', plain_excerpt).strip()
-        
-        if clean_excerpt in chunk_plain:
-            # Found the chunk, now narrow down
-            for start in range(i, i+chunk_size):
-                for end in range(start + len(clean_excerpt), i+chunk_size + 1):
-                    # Don't check sections that are too large
-                    if end - start > len(clean_excerpt) * 5:
-                        continue
-                        
-                    section = wikitext[start:end]
-                    section_plain = mwparserfromhell.parse(section).strip_code()
-                    section_plain = re.sub(r'\s+', ' ', section_plain).strip()
-                    
-                    if clean_excerpt in section_plain:
-                        # Try to find the minimum section that contains the excerpt
-                        minimum_length = end - start
-                        best_start, best_end = start, end
-                        
-                        for s in range(start, end):
-                            for e in range(s + len(clean_excerpt), end + 1):
-                                subsection = wikitext[s:e]
-                                subsection_plain = mwparserfromhell.parse(subsection).strip_code()
-                                subsection_plain = re.sub(r'\s+', ' ', subsection_plain).strip()
-                                
-                                if clean_excerpt in subsection_plain and e - s < minimum_length:
-                                    minimum_length = e - s
-                                    best_start, best_end = s, e
-                        
-                        return best_start, best_end
-    
-    return None
+    return best
+
+def _is_plain_span(wikitext: str, start: int, end: int, plain_excerpt: str) -> bool:
+    """Check that wikitext[start:end] reads as the excerpt and does not start or end inside markup"""
+    stripped = mwparserfromhell.parse(wikitext[start:end]).strip_code(normalize=True, collapse=True, keep_template_params=True)
+    if normalize_whitespace(stripped) != normalize_whitespace(plain_excerpt):
+        return False
+    return not (_in_markup(wikitext, start) or _in_markup(wikitext, end - 1))
+
+def _in_markup(wikitext: str, pos: int) -> bool:
+    """Whether wikitext[pos] belongs to markup rather than readable text (nesting is not tracked)"""
+    # template name or parameter name
+    opener = wikitext.rfind("{{", 0, pos + 1)
+    if opener > wikitext.rfind("}}", 0, pos + 1):
+        separator = max(wikitext.rfind("|", opener, pos + 1), wikitext.rfind("=", opener, pos + 1))
+        if separator == -1:
+            return True
+        if wikitext[separator] == "|":
+            following = re.compile(r"[|=]|}}").search(wikitext, pos)
+            if following and following.group() == "=":
+                return True
+
+    # link target
+    opener = wikitext.rfind("[[", 0, pos + 1)
+    if opener > wikitext.rfind("]]", 0, pos + 1) and wikitext.find("|", opener, pos + 1) == -1:
+        return True
+
+    # URL of an external link, or a bare URL
+    opener = wikitext.rfind("[", 0, pos + 1)
+    if (opener > wikitext.rfind("]", 0, pos + 1) and not wikitext.startswith("[[", opener - 1)
+            and not re.search(r"\s", wikitext[opener:pos + 1])):
+        return True
+    line_start = wikitext.rfind("\n", 0, pos + 1) + 1
+    if re.search(r"(?:https?:)?//\S*$", wikitext[line_start:pos + 1]):
+        return True
+
+    # inside a tag
+    return wikitext.rfind("<", 0, pos + 1) > wikitext.rfind(">", 0, pos + 1)
+
+def _iter_word_positions(wikitext: str, options: List[str], max_count: int):
+    """Yield up to max_count ascending positions where any of the options occurs"""
+    pos = 0
+    for _ in range(max_count):
+        found = _find_first(wikitext, options, pos, len(wikitext))
+        if found is None:
+            return
+        yield found[0]
+        pos = found[0] + 1
+
+def _find_first(wikitext: str, options: List[str], start: int, limit: int) -> Optional[Tuple[int, int]]:
+    """Return the (start, end) of the earliest occurrence of any option inside wikitext[start:limit]"""
+    best = None
+    for option in options:
+        found = wikitext.find(option, start, limit)
+        if found != -1 and (best is None or found < best[0]):
+            best = (found, found + len(option))
+    return best
 
 def process_node(node):
     """Recursively process nodes with explicit tag handling"""
@@ -314,11 +297,17 @@ def process_table(table_node):
     return "\n".join(table_text)
 
 def wikitext_to_plaintext(wikitext):
-    parsed = mwparserfromhell.parse(wikitext)
-    processed = []
-    
-    for node in parsed.nodes:
-        processed.append(process_node(node))
+    return parse_cache.get_derived(wikitext, "plaintext", _build_plaintext)
+
+def _processed_sections(wikitext):
+    # only sections that changed since a previous revision are parsed again
+    return get_section_index(wikitext).view(
+        "processed_nodes",
+        lambda parsed: "".join(process_node(node) for node in parsed.nodes)
+    )
+
+def _build_plaintext(wikitext):
+    processed = _processed_sections(wikitext)
     
     # Combine and clean up while preserving paragraphs
     return "\n".join(
@@ -326,6 +315,14 @@ def wikitext_to_plaintext(wikitext):
         if line.strip()
     )
 
+def wikitext_to_section_plaintexts(wikitext) -> List[str]:
+    """Plain text of every non-empty section, in article order, cleaned up like wikitext_to_plaintext"""
+    sections = [
+        "\n".join(line.strip() for line in processed.splitlines() if line.strip())
+        for processed in _processed_sections(wikitext)
+    ]
+    return [section for section in sections if section]
+
 def process_node_skip_special(node):
     """Process nodes while skipping tables and references entirely"""
     if isinstance(node, Text):
@@ -351,11 +348,13 @@ def process_node_skip_special(node):
         return str(node) if node else ""
 
 def wikitext_to_plaintext_skip_tables_refs(wikitext):
-    parsed = mwparserfromhell.parse(wikitext)
-    processed = []
-    
-    for node in parsed.nodes:
-        processed.append(process_node_skip_special(node))
+    return parse_cache.get_derived(wikitext, "plaintext_skip_tables_refs", _build_plaintext_skip_tables_refs)
+
+def _build_plaintext_skip_tables_refs(wikitext):
+    processed = get_section_index(wikitext).view(
+        "processed_nodes_skip_special",
+        lambda parsed: "".join(process_node_skip_special(node) for node in parsed.nodes)
+    )
     
     # Combine results while preserving paragraph breaks
     return "\n\n".join(
@@ -375,6 +374,26 @@ def strip_code_block(text):
         return match.group(1).strip()
     return text.strip()
 
+def strip_html(text: str) -> str:
+    """Plain text of the small HTML snippets used in suggestion texts and contexts"""
+    text = re.sub(r"<br\s*/?>", "\n", text)
+    return html.unescape(re.sub(r"<[^>]+>", "", text)).strip()
+
+def compact_refinement_context(conversation_context: list, task: str, surrounding: str, answer: str) -> list:
+    """
+    Stand-in for an agent's full conversation when refining one of its suggestions: the
+    agent's system prompt, a short description of the task with the text around the
+    suggestion, and the suggestion itself as the assistant's answer.
+    """
+    system_prompt = "You are a Wikipedia editor. Follow Wikipedia's neutral tone and style."
+    if conversation_context and isinstance(conversation_context[0], dict) and conversation_context[0].get("role") == "system":
+        system_prompt = conversation_context[0]["content"]
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"{task}\n\nThe relevant part of the article:\n{surrounding}"},
+        {"role": "assistant", "content": answer},
+    ]
+
 def get_wikipedia_link(title):
     # Handle empty input
     if not title.strip():
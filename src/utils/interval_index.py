@@ -0,0 +1,64 @@
+# utils/interval_index.py
+from bisect import bisect_left, bisect_right
+from typing import Any, List, Tuple
+
+class IntervalIndex:
+    """
+    Static interval tree over half-open spans [start, end), stored as start-sorted arrays
+    with a segment tree of maximum ends. Building is O(n log n); finding the k spans that
+    overlap a query is O(log n + k).
+
+    Two spans overlap if they share any character, or if they start at the same offset
+    (two insertions at one point cannot both be applied).
+    """
+
+    def __init__(self, intervals: List[Tuple[int, int, Any]]):
+        ordered = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+        self.starts: List[int] = [interval[0] for interval in ordered]
+        self.ends: List[int] = [interval[1] for interval in ordered]
+        self.values: List[Any] = [interval[2] for interval in ordered]
+
+        self._size = 1
+        while self._size < len(ordered):
+            self._size *= 2
+        self._max_end = [-1] * (2 * self._size)
+        self._max_end[self._size:self._size + len(ordered)] = self.ends
+        for node in range(self._size - 1, 0, -1):
+            self._max_end[node] = max(self._max_end[2 * node], self._max_end[2 * node + 1])
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def overlapping(self, start: int, end: int) -> List[Any]:
+        """Return the values of all spans overlapping [start, end), in start order"""
+        found = set(range(bisect_left(self.starts, start), bisect_right(self.starts, start)))
+
+        # spans starting before the query ends, whose end lies past the query start
+        limit = bisect_left(self.starts, max(end, start + 1))
+        self._collect(1, 0, self._size, limit, start, found)
+
+        return [self.values[idx] for idx in sorted(found)]
+
+    def _collect(self, node: int, low: int, high: int, limit: int, start: int, found: set):
+        if low >= limit or self._max_end[node] <= start:
+            return
+        if high - low == 1:
+            found.add(low)
+            return
+        middle = (low + high) // 2
+        self._collect(2 * node, low, middle, limit, start, found)
+        self._collect(2 * node + 1, middle, high, limit, start, found)
+
+    def groups(self) -> List[List[Any]]:
+        """Split the values into groups of transitively overlapping spans, in start order"""
+        groups = []
+        group_end = None
+        group_start = None
+        for start, end, value in zip(self.starts, self.ends, self.values):
+            if groups and (start < group_end or start == group_start):
+                groups[-1].append(value)
+                group_end = max(group_end, end)
+            else:
+                groups.append([value])
+                group_start, group_end = start, end
+        return groups
@@ -0,0 +1,87 @@
+# utils/lexical_index.py
+from collections import Counter
+import math
+import re
+from typing import List, Tuple
+
+WORD_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has had have he her his in is it its of on or she that the "
+    "their they this to was were which with".split()
+)
+BULLET_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.*\S)")
+HEADING_PATTERN = re.compile(r"^(=+)\s*(.*?)\s*\1[ \t]*$", re.MULTILINE)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords"""
+    return [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+
+def split_sections(text: str) -> List[Tuple[str, int, int]]:
+    """
+    Return the (heading, start, end) of the lead and of every section of a plaintext article
+    that keeps its "== Heading ==" lines; start and end delimit the section's text without
+    its heading line, and sections without text are left out
+    """
+    bounds = []
+    heading, start = "", 0
+    for match in HEADING_PATTERN.finditer(text):
+        bounds.append((heading, start, match.start()))
+        heading, start = match.group(2), match.end()
+    bounds.append((heading, start, len(text)))
+
+    sections = []
+    for heading, start, end in bounds:
+        body = text[start:end]
+        body_start = start + len(body) - len(body.lstrip())
+        body_end = start + len(body.rstrip())
+        if body_start < body_end:
+            sections.append((heading, body_start, body_end))
+    return sections
+
+def parse_bullets(text: str) -> List[str]:
+    """Extract the bullet points of an LLM answer; falls back to non-empty lines"""
+    bullets = [match.group(1) for match in map(BULLET_PATTERN.match, text.splitlines()) if match]
+    if bullets:
+        return bullets
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+class LexicalIndex:
+    """
+    Okapi BM25 index over a list of passages, to match short queries (e.g. missing
+    information bullets) to the passages of an article without any network call.
+    """
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, passages: List[str]):
+        self.term_counts: List[Counter] = [Counter(tokenize(passage)) for passage in passages]
+        self.lengths: List[int] = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length: float = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+        document_frequency = Counter()
+        for counts in self.term_counts:
+            document_frequency.update(counts.keys())
+        total = len(passages)
+        self.idf = {
+            term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """BM25 score of every passage for the query"""
+        query_terms = tokenize(query)
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            norm = self.K1 * (1 - self.B + self.B * length / (self.average_length or 1))
+            for term in query_terms:
+                frequency = counts.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (self.K1 + 1) / (frequency + norm)
+            scores.append(score)
+        return scores
+
+    def top(self, query: str, k: int) -> List[int]:
+        """Indices of the k best passages for the query, best first, ignoring passages scoring 0"""
+        ranked = sorted(enumerate(self.scores(query)), key=lambda item: -item[1])
+        return [idx for idx, score in ranked[:k] if score > 0]
@@ -0,0 +1,161 @@
+# utils/llm_cache.py
+import hashlib
+import importlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from pydantic import BaseModel
+from src.config.settings import config
+
+class LLMCacheMiss(Exception):
+    """Raised in replay mode when a request has no cached response"""
+    pass
+
+def _jsonable(value: Any) -> Any:
+    """json.dumps fallback for the objects found in LLM requests"""
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        # response schemas are keyed by their JSON schema, not their class name
+        return value.model_json_schema()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", exclude_none=True)
+    return repr(value)
+
+def _response_type(response: BaseModel) -> str:
+    cls = type(response)
+    origin = cls.__pydantic_generic_metadata__["origin"] or cls
+    return f"{origin.__module__}:{origin.__qualname__}"
+
+class LLMCache:
+    """
+    Content-addressed on-disk cache of LLM responses, stored in SQLite. A response is keyed
+    by the provider and a hash of the whole request (model, messages, response schema and
+    every other parameter), so only byte-for-byte identical requests hit.
+
+    Modes (LLM_CACHE): 'off', 'on' (read and write), or 'replay', which only reads and raises
+    LLMCacheMiss for unknown requests, e.g. to run benchmarks without network access.
+    Entries expire after LLM_CACHE_TTL_HOURS, and the least recently used ones are evicted
+    once the cache grows past LLM_CACHE_MB.
+    """
+
+    def __init__(self, path: str, mode: str, ttl_seconds: float, max_bytes: int):
+        self.path: str = path
+        self.mode: str = mode
+        self.ttl_seconds: float = ttl_seconds
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self.writes: int = 0
+        self.evictions: int = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("on", "replay")
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, provider TEXT, model TEXT, response_type TEXT, "
+                "response TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._connection.commit()
+        return self._connection
+
+    def cacheable(self, request: Dict[str, Any]) -> bool:
+        """Only complete (non-streaming) message requests are cached"""
+        return self.enabled and "messages" in request and not request.get("stream")
+
+    def key(self, provider: str, request: Dict[str, Any]) -> str:
+        payload = json.dumps({"provider": provider, "request": request}, sort_keys=True, default=_jsonable)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, request: Dict[str, Any]) -> Optional[Any]:
+        """Return the cached response of a request, None if there is none (LLMCacheMiss in replay mode)"""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT response_type, response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is not None and now - row[2] > self.ttl_seconds:
+                self._db().execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db().commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise LLMCacheMiss(f"No cached response for request {key[:12]} ({request.get('model')}).")
+                return None
+            self._db().execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db().commit()
+            self.hits += 1
+
+        module, name = row[0].split(":")
+        response_class = getattr(importlib.import_module(module), name)
+        if response_class.__pydantic_generic_metadata__["parameters"]:
+            # parsed completions are generic over the response schema
+            response_class = response_class[request["response_format"]]
+        return response_class.model_validate_json(row[1])
+
+    def put(self, key: str, provider: str, request: Dict[str, Any], response: Any):
+        if self.mode != "on" or not isinstance(response, BaseModel):
+            return
+        data = response.model_dump_json(warnings=False)
+        now = time.time()
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, provider, request.get("model", ""), _response_type(response), data, len(data), now, now),
+            )
+            self.writes += 1
+            self._evict(now)
+            self._db().commit()
+
+    def _evict(self, now: float):
+        db = self._db()
+        self.evictions += db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,)).rowcount
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # least recently used first
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = (0, 0)
+            if self.enabled:
+                entries, size = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {
+                "mode": self.mode,
+                "entries": entries,
+                "bytes": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._db().execute("DELETE FROM responses")
+            self._db().commit()
+            self.hits = self.misses = self.writes = self.evictions = 0
+
+# Singleton instance
+llm_cache = LLMCache(
+    config.llm_cache.path,
+    config.llm_cache.mode,
+    config.llm_cache.ttl_seconds,
+    config.llm_cache.max_bytes,
+)
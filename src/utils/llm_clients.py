@@ -0,0 +1,85 @@
+# utils/llm_clients.py
+import threading
+from typing import Any, Dict, Tuple
+from anthropic import Anthropic
+import anthropic
+import httpx
+from openai import OpenAI
+import openai
+from src.config.settings import config
+from src.utils.local_llm import LocalAnthropic, LocalOpenAI, LocalResponder
+
+class LLMClientRegistry:
+    """
+    Process-wide pool of LLM clients, one per provider and API key. The OpenAI and Anthropic
+    clients are thread-safe, so every agent and worker thread shares the same client and
+    its pool of warm keep-alive connections instead of opening new ones per agent.
+
+    Retries are left to the rate limiter (utils/rate_limiter.py), so the SDK's own retries
+    are disabled. With LLM_BACKEND=local, every agent gets the in-process stand-ins of
+    utils/local_llm.py instead, e.g. to benchmark the pipeline without network access.
+    """
+    _clients: Dict[Tuple[str, str], Any] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _limits(cls) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=config.http.max_connections,
+            max_keepalive_connections=config.http.max_keepalive_connections,
+            keepalive_expiry=config.http.keepalive_expiry,
+        )
+
+    @classmethod
+    def openai(cls, api_key: str) -> OpenAI:
+        with cls._lock:
+            key = ("openai", api_key)
+            if key not in cls._clients:
+                cls._clients[key] = OpenAI(
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=openai.DefaultHttpxClient(limits=cls._limits()),
+                )
+            return cls._clients[key]
+
+    @classmethod
+    def anthropic(cls, api_key: str) -> Anthropic:
+        with cls._lock:
+            key = ("anthropic", api_key)
+            if key not in cls._clients:
+                cls._clients[key] = Anthropic(
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=anthropic.DefaultHttpxClient(limits=cls._limits()),
+                )
+            return cls._clients[key]
+
+    @classmethod
+    def local(cls, provider: str):
+        """Stand-in client of the local backend (LLM_BACKEND=local), which needs no API key"""
+        with cls._lock:
+            key = (provider, "local")
+            if key not in cls._clients:
+                responder = LocalResponder(config.llm_backend.local_latency, config.llm_backend.local_tokens_per_second)
+                cls._clients[key] = LocalAnthropic(responder) if provider == "anthropic" else LocalOpenAI(responder)
+            return cls._clients[key]
+
+    @classmethod
+    def clear(cls):
+        """Close and forget all pooled clients (e.g. after the API keys changed)"""
+        with cls._lock:
+            for client in cls._clients.values():
+                client.close()
+            cls._clients.clear()
+
+def get_openai_client() -> OpenAI:
+    """Shared OpenAI client for the API key of the current session."""
+    if config.llm_backend.name == "local":
+        return LLMClientRegistry.local("openai")
+    return LLMClientRegistry.openai(config.openai.api_key)
+
+def get_anthropic_client() -> Anthropic:
+    """Shared Anthropic client for the API key of the current session."""
+    if config.llm_backend.name == "local":
+        return LLMClientRegistry.local("anthropic")
+    return LLMClientRegistry.anthropic(config.anthropic.api_key)
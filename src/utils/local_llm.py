@@ -0,0 +1,322 @@
+# utils/local_llm.py
+from contextlib import contextmanager
+import hashlib
+import json
+import re
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+from anthropic.types import Message
+import jiter
+from openai.lib.streaming.chat import ContentDeltaEvent
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ParsedChatCompletion
+from src.utils.token_budget import CHARS_PER_TOKEN
+
+BULLET_COUNT = 5  # bullet points in every plain-text answer
+LIST_LENGTH = 3  # items in every list of a structured answer
+TOOL_CALL_COUNT = 3  # tool calls made in the first tool-calling round
+CHUNK_CHARS = 16  # characters per streamed chunk
+
+# the text an agent prompt asks about follows the last of these
+SUBJECT_MARKER = re.compile(r"(?:starts now|to edit|is the following):[ \t]*\n")
+WORD_PATTERN = re.compile(r"\b[A-Za-z][A-Za-z-]{4,}\b")
+JSON_KEY_PATTERN = re.compile(r"'(\w+)'\s*:\s*'string'")
+
+class LocalResponder:
+    """
+    Deterministic answers computed from the request alone, so the same request always gets
+    the same answer:
+    - structured output (response_format) gets an instance of the schema, filled with
+      words that occur in the request's text, so the agents' guardrails keep them;
+    - "answer with ONLY the new article/passage" requests get that text back with a new
+      sentence added to every third paragraph, which the diff turns into suggestions;
+    - the first round of a request with tools calls every tool a few times, the next
+      round answers;
+    - everything else gets a list of bullet points.
+
+    Answers arrive after `latency` seconds plus one second per `tokens_per_second` output
+    tokens (0 disables the delay), also when streamed.
+    """
+
+    def __init__(self, latency: float, tokens_per_second: float):
+        self.latency: float = latency
+        self.tokens_per_second: float = tokens_per_second
+
+    def wait(self, text: str, first: bool = True):
+        """Sleep as long as the simulated model takes to write text"""
+        delay = self.latency if first else 0.0
+        if self.tokens_per_second > 0:
+            delay += len(text) / CHARS_PER_TOKEN / self.tokens_per_second
+        if delay > 0:
+            time.sleep(delay)
+
+    def chunks(self, text: str) -> Iterator[str]:
+        """Split an answer into stream deltas, sleeping before each as the model would"""
+        for start in range(0, len(text), CHUNK_CHARS):
+            piece = text[start:start + CHUNK_CHARS]
+            self.wait(piece, first=start == 0)
+            yield piece
+
+    @staticmethod
+    def _content_text(content: Any) -> str:
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            # content blocks; documents are base64 and carry no usable text
+            return "\n".join(block.get("text", "") for block in content if isinstance(block, dict))
+        return getattr(content, "content", None) or ""
+
+    def prompt(self, request: Dict[str, Any]) -> str:
+        """Text of the last user message"""
+        for message in reversed(request.get("messages", [])):
+            if isinstance(message, dict) and message.get("role") == "user":
+                return self._content_text(message.get("content"))
+        return ""
+
+    def subject(self, request: Dict[str, Any]) -> str:
+        """The text the prompt is about: what follows its last subject marker, else the whole prompt"""
+        prompt = self.prompt(request)
+        matches = list(SUBJECT_MARKER.finditer(prompt))
+        return prompt[matches[-1].end():] if matches else prompt
+
+    def words(self, request: Dict[str, Any]) -> List[str]:
+        """Distinct words of the subject, in order of appearance"""
+        return list(dict.fromkeys(WORD_PATTERN.findall(self.subject(request)))) or ["Example"]
+
+    @staticmethod
+    def seed(request: Dict[str, Any]) -> int:
+        payload = json.dumps(request.get("messages", []), sort_keys=True, default=repr)
+        return int(hashlib.sha256(payload.encode("utf-8")).hexdigest()[:8], 16)
+
+    def _sentence(self, request: Dict[str, Any], idx: int) -> str:
+        words = self.words(request)
+        seed = self.seed(request) + idx
+        return f"{words[seed % len(words)].capitalize()} was recorded as {seed % 90 + 10} in {1800 + seed % 200}."
+
+    def text(self, request: Dict[str, Any]) -> str:
+        prompt = self.prompt(request)
+        if "answer with only the new" in prompt.lower():
+            paragraphs = self.subject(request).split("\n")
+            for idx in range(0, len(paragraphs), 3):
+                if paragraphs[idx].strip():
+                    paragraphs[idx] = f"{paragraphs[idx]} {self._sentence(request, idx)}"
+            return "\n".join(paragraphs)
+
+        keys = JSON_KEY_PATTERN.findall(prompt)
+        if "JSON" in prompt and keys:
+            # free-form JSON requested through an example object
+            words = self.words(request)
+            return json.dumps([{key: words[(idx + offset) % len(words)] for offset, key in enumerate(keys)} for idx in range(LIST_LENGTH)])
+
+        return "\n".join(f"- {self._sentence(request, idx)}" for idx in range(BULLET_COUNT))
+
+    def tool_calls(self, request: Dict[str, Any]) -> Optional[List[dict]]:
+        """Tool calls for the first round of a tool-calling request, None once it should answer"""
+        tools = request.get("tools")
+        if not tools or request.get("tool_choice") == "none":
+            return None
+        if any((message.get("role") if isinstance(message, dict) else getattr(message, "role", None)) == "tool"
+               for message in request.get("messages", [])):
+            return None
+
+        words = self.words(request)
+        calls = []
+        for tool in tools:
+            parameters = tool["function"].get("parameters", {})
+            for idx in range(TOOL_CALL_COUNT):
+                arguments = self.fill(parameters, parameters, words, idx)
+                calls.append({
+                    "id": f"call_{len(calls)}",
+                    "type": "function",
+                    "function": {"name": tool["function"]["name"], "arguments": json.dumps(arguments)},
+                })
+        return calls
+
+    def fill(self, schema: dict, root: dict, words: List[str], idx: int = 0) -> Any:
+        """A value valid for a JSON schema; strings are words of the request"""
+        if "$ref" in schema:
+            return self.fill(root["$defs"][schema["$ref"].split("/")[-1]], root, words, idx)
+        if "anyOf" in schema:
+            return self.fill(schema["anyOf"][0], root, words, idx)
+        kind = schema.get("type")
+        if kind == "object":
+            return {
+                name: self.fill(prop, root, words, idx * len(schema["properties"]) + offset)
+                for offset, (name, prop) in enumerate(schema.get("properties", {}).items())
+            }
+        if kind == "array":
+            return [self.fill(schema.get("items", {}), root, words, idx * LIST_LENGTH + item) for item in range(LIST_LENGTH)]
+        if kind == "integer":
+            return idx + 1
+        if kind == "number":
+            return float(idx + 1)
+        if kind == "boolean":
+            return False
+        if "enum" in schema:
+            return schema["enum"][0]
+        return words[idx % len(words)]
+
+    def structured(self, request: Dict[str, Any]) -> str:
+        """JSON answer for a request with a pydantic or json_schema response_format"""
+        response_format = request["response_format"]
+        if isinstance(response_format, dict):
+            schema = response_format["json_schema"]["schema"]
+        else:
+            schema = response_format.model_json_schema()
+        return json.dumps(self.fill(schema, schema, self.words(request)))
+
+    @staticmethod
+    def usage(request: Dict[str, Any], answer: str) -> tuple:
+        prompt_chars = len(json.dumps(request.get("messages", []), default=repr)) + len(json.dumps(request.get("system", ""), default=repr))
+        return prompt_chars // CHARS_PER_TOKEN, len(answer) // CHARS_PER_TOKEN + 1
+
+class LocalOpenAI:
+    """In-process stand-in for the OpenAI client methods the agents use"""
+
+    def __init__(self, responder: LocalResponder):
+        self.responder: LocalResponder = responder
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self.parse, stream=self.stream)))
+
+    def _completion(self, request: Dict[str, Any], message: dict, completion_class=ChatCompletion) -> ChatCompletion:
+        prompt_tokens, completion_tokens = self.responder.usage(request, json.dumps(message))
+        return completion_class.model_validate({
+            "id": f"local-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "local"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+                "message": {"role": "assistant", **message},
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def create(self, **request):
+        response_format = request.get("response_format")
+        if response_format is not None and not isinstance(response_format, dict):
+            raise TypeError("Pass pydantic response formats to beta.chat.completions.parse.")
+        tool_calls = self.responder.tool_calls(request)
+        if tool_calls:
+            self.responder.wait(json.dumps(tool_calls))
+            return self._completion(request, {"content": None, "tool_calls": tool_calls})
+
+        if response_format and response_format.get("type") == "json_schema":
+            answer = self.responder.structured(request)
+        else:
+            answer = self.responder.text(request)
+        if request.get("stream"):
+            return self._chunks(request, answer)
+        self.responder.wait(answer)
+        return self._completion(request, {"content": answer})
+
+    def _chunks(self, request: Dict[str, Any], answer: str) -> Iterator[ChatCompletionChunk]:
+        completion_id = f"local-{uuid.uuid4().hex[:12]}"
+        for piece in self.responder.chunks(answer):
+            yield ChatCompletionChunk.model_validate({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "local"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            })
+
+    def parse(self, **request) -> ParsedChatCompletion:
+        tool_calls = self.responder.tool_calls(request)
+        if tool_calls:
+            self.responder.wait(json.dumps(tool_calls))
+            return self._completion(request, {"content": None, "tool_calls": tool_calls}, ParsedChatCompletion[request["response_format"]])
+        answer = self.responder.structured(request)
+        self.responder.wait(answer)
+        return self._completion(request, {"content": answer, "parsed": json.loads(answer)}, ParsedChatCompletion[request["response_format"]])
+
+    @contextmanager
+    def stream(self, **request):
+        answer = self.responder.structured(request)
+
+        def events():
+            snapshot = ""
+            for piece in self.responder.chunks(answer):
+                snapshot += piece
+                parsed = jiter.from_json(snapshot.encode("utf-8"), partial_mode="trailing-strings")
+                yield ContentDeltaEvent(type="content.delta", delta=piece, snapshot=snapshot, parsed=parsed)
+
+        def final():
+            return self._completion(request, {"content": answer, "parsed": json.loads(answer)}, ParsedChatCompletion[request["response_format"]])
+
+        yield _EventStream(events(), final)
+
+    def close(self):
+        pass
+
+class LocalAnthropic:
+    """In-process stand-in for the Anthropic client methods the agents use"""
+
+    def __init__(self, responder: LocalResponder):
+        self.responder: LocalResponder = responder
+        self.messages = SimpleNamespace(create=self.create, stream=self.stream)
+
+    def _message(self, request: Dict[str, Any], lines: List[str]) -> Message:
+        input_tokens, output_tokens = self.responder.usage(request, "\n".join(lines))
+        citations = any(
+            isinstance(block, dict) and (block.get("citations") or {}).get("enabled")
+            for message in request.get("messages", []) if isinstance(message.get("content"), list)
+            for block in message["content"]
+        )
+        content = []
+        for idx, line in enumerate(lines):
+            block = {"type": "text", "text": line + "\n"}
+            if citations:
+                block["citations"] = [{
+                    "type": "page_location",
+                    "cited_text": line.lstrip("- "),
+                    "document_index": 0,
+                    "document_title": "User-submitted document",
+                    "start_page_number": idx + 1,
+                    "end_page_number": idx + 2,
+                }]
+            content.append(block)
+        return Message.model_validate({
+            "id": f"local-{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get("model", "local"),
+            "content": content,
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0},
+        })
+
+    def create(self, **request) -> Message:
+        answer = self.responder.text(request)
+        self.responder.wait(answer)
+        return self._message(request, answer.split("\n"))
+
+    @contextmanager
+    def stream(self, **request):
+        answer = self.responder.text(request)
+        yield SimpleNamespace(
+            text_stream=self.responder.chunks(answer),
+            get_final_message=lambda: self._message(request, answer.split("\n")),
+        )
+
+    def close(self):
+        pass
+
+class _EventStream:
+    """Iterable of stream events with the final completion, like the OpenAI ChatCompletionStream"""
+
+    def __init__(self, events: Iterator[Any], final):
+        self._events = events
+        self._final = final
+
+    def __iter__(self):
+        return self._events
+
+    def get_final_completion(self):
+        # consume the rest of the answer first, as the SDK does
+        for _ in self._events:
+            pass
+        return self._final()
@@ -0,0 +1,241 @@
+# utils/offset_index.py
+import mwparserfromhell
+from mwparserfromhell.nodes import Argument, ExternalLink, Heading, Tag, Text, Wikilink
+from array import array
+from bisect import bisect_right
+import re
+from typing import Any, List, Optional, Tuple
+from src.utils.parse_cache import parse_cache
+from src.utils.section_index import get_section_index
+
+STRIP_KWARGS = {"normalize": True, "collapse": True, "keep_template_params": False}
+
+def normalize_whitespace(text: str) -> str:
+    """Collapse every run of whitespace into a single space and trim the ends."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+def _child_code(node):
+    """
+    Return the child Wikicode that produces the stripped text of a markup node,
+    along with its offset inside str(node), or None if the node has no such child.
+    """
+    node_len = len(str(node))
+
+    if isinstance(node, Wikilink):
+        if node.text is not None:
+            return node.text, node_len - 2 - len(str(node.text))
+        return node.title, 2
+
+    if isinstance(node, Heading):
+        return node.title, node.level
+
+    if isinstance(node, Tag):
+        if node.self_closing or node.contents is None:
+            return None
+        if node.wiki_markup:
+            closing_len = len(node.closing_wiki_markup or "")
+        else:
+            closing_len = len(f"</{node.closing_tag}>")
+        return node.contents, node_len - closing_len - len(str(node.contents))
+
+    if isinstance(node, ExternalLink):
+        if not node.brackets:
+            return node.url, 0
+        if node.title is not None:
+            return node.title, node_len - 1 - len(str(node.title))
+        return None
+
+    if isinstance(node, Argument):
+        if node.default is not None:
+            return node.default, node_len - 3 - len(str(node.default))
+        return None
+
+    return None
+
+def _walk(wikicode, base: int, owner: int, out: dict, trim: bool = True):
+    """
+    Append the stripped text of wikicode to out["chars"], recording for every character
+    the wikitext span [start, end) it came from and the innermost markup node that owns
+    it. Markup nodes are recorded in out["nodes"] as (start, end, parent). Mirrors
+    Wikicode.strip_code(); trim=False skips its newline trimming, for top-level pieces.
+    """
+    chars, starts, ends, owners = out["chars"], out["starts"], out["ends"], out["owners"]
+    first = len(chars)
+    pos = base
+
+    for node in wikicode.nodes:
+        node_str = str(node)
+        node_end = pos + len(node_str)
+
+        if isinstance(node, Text):
+            for offset, char in enumerate(node_str):
+                chars.append(char)
+                starts.append(pos + offset)
+                ends.append(pos + offset + 1)
+                owners.append(owner)
+        else:
+            stripped = node.__strip__(**STRIP_KWARGS)
+            if stripped:
+                node_id = len(out["nodes"])
+                out["nodes"].append((pos, node_end, owner))
+
+                child = _child_code(node)
+                if child is not None and node_str[child[1]:child[1] + len(str(child[0]))] == str(child[0]):
+                    _walk(child[0], pos + child[1], node_id, out)
+                else:
+                    # entities and anything we cannot descend into map onto the whole node
+                    for char in str(stripped):
+                        chars.append(char)
+                        starts.append(pos)
+                        ends.append(node_end)
+                        owners.append(node_id)
+
+        pos = node_end
+
+    if not trim:
+        return
+
+    # strip_code() trims newlines at both ends of every (nested) Wikicode
+    lead = first
+    while lead < len(chars) and chars[lead] == "\n":
+        lead += 1
+    trail = len(chars)
+    while trail > lead and chars[trail - 1] == "\n":
+        trail -= 1
+    for values in (chars, starts, ends, owners):
+        del values[trail:]
+        del values[first:lead]
+
+class OffsetIndex:
+    """
+    Array-backed bidirectional index between the whitespace-normalized plaintext of
+    an article and its wikitext. Built once per wikitext revision.
+
+    Attributes:
+        wikitext (str): The wikitext the index was built from
+        text (str): Normalized plaintext (strip_code() with collapsed whitespace)
+        starts (array): Wikitext start offset of every plaintext character
+        ends (array): Wikitext end offset (exclusive) of every plaintext character
+        owners (array): Innermost markup node of every plaintext character, -1 for top-level text
+        node_starts, node_ends, node_parents (array): Span and enclosing node of every markup node
+    """
+
+    def __init__(self, wikitext: str, pieces: Optional[List[Tuple[Any, int]]] = None):
+        """
+        Args:
+            wikitext: The wikitext to index
+            pieces: Consecutive (wikicode, offset) parts covering the wikitext, e.g. its
+                sections; the whole wikitext is parsed in one piece when omitted
+        """
+        self.wikitext: str = wikitext
+        if pieces is None:
+            pieces = [(mwparserfromhell.parse(wikitext), 0)]
+
+        raw = {"chars": [], "starts": [], "ends": [], "owners": [], "nodes": []}
+        for wikicode, offset in pieces:
+            _walk(wikicode, offset, -1, raw, trim=False)
+
+        self.node_starts = array('l', (node[0] for node in raw["nodes"]))
+        self.node_ends = array('l', (node[1] for node in raw["nodes"]))
+        self.node_parents = array('l', (node[2] for node in raw["nodes"]))
+
+        chars = []
+        self.starts = array('l')
+        self.ends = array('l')
+        self.owners = array('l')
+
+        for char, start, end, owner in zip(raw["chars"], raw["starts"], raw["ends"], raw["owners"]):
+            if char.isspace():
+                if not chars or chars[-1] == ' ':
+                    continue
+                char = ' '
+            chars.append(char)
+            self.starts.append(start)
+            self.ends.append(end)
+            self.owners.append(owner)
+
+        if chars and chars[-1] == ' ':
+            chars.pop()
+            for values in (self.starts, self.ends, self.owners):
+                values.pop()
+
+        self.text: str = "".join(chars)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    @property
+    def memory_size(self) -> int:
+        """Approximate memory held by the index, in bytes"""
+        arrays = (self.starts, self.ends, self.owners, self.node_starts, self.node_ends, self.node_parents)
+        return len(self.text) + sum(values.itemsize * len(values) for values in arrays)
+
+    def to_wikitext_span(self, plain_start: int, plain_end: int) -> Tuple[int, int]:
+        """
+        Map the plaintext range [plain_start, plain_end) to a wikitext span. If the range
+        crosses the boundary of a markup node (link, tag, ...) the span is widened to
+        cover that node whole, so splicing the span never leaves broken markup behind.
+        """
+        last = plain_end - 1
+        start = self.starts[plain_start]
+        end = self.ends[last]
+
+        # Climb out of every node that holds one end of the range but not the other
+        node = self.owners[plain_start]
+        while node != -1 and not (self.node_starts[node] <= self.starts[last] < self.node_ends[node]):
+            start = self.node_starts[node]
+            node = self.node_parents[node]
+
+        node = self.owners[last]
+        while node != -1 and not (self.node_starts[node] <= self.starts[plain_start] < self.node_ends[node]):
+            end = self.node_ends[node]
+            node = self.node_parents[node]
+
+        return start, end
+
+    def insertion_point(self, plain_pos: int, attach_before: bool) -> int:
+        """
+        Wikitext offset at which to insert text that goes before plaintext character
+        plain_pos: right after character plain_pos - 1 if attach_before, else right before
+        character plain_pos. Markup nodes that hold that character but not its neighbour
+        on the other side are stepped out of, so the insertion never lands inside them.
+        """
+        if attach_before:
+            char, neighbour, offset = plain_pos - 1, plain_pos, self.ends[plain_pos - 1]
+        else:
+            char, neighbour, offset = plain_pos, plain_pos - 1, self.starts[plain_pos]
+        has_neighbour = 0 <= neighbour < len(self.text)
+
+        node = self.owners[char]
+        while node != -1 and not (has_neighbour and self.node_starts[node] <= self.starts[neighbour] < self.node_ends[node]):
+            offset = self.node_ends[node] if attach_before else self.node_starts[node]
+            node = self.node_parents[node]
+        return offset
+
+    def to_plaintext_offset(self, wikitext_pos: int) -> int:
+        """Map a wikitext offset to the offset of the first plaintext character at or after it."""
+        return bisect_right(self.ends, wikitext_pos)
+
+    def find(self, plain_excerpt: str, plain_start: int = 0) -> Optional[Tuple[int, int]]:
+        """
+        Find a plain text excerpt and return its (start_index, end_index) in the wikitext,
+        or None if the excerpt does not occur in the normalized plaintext.
+        """
+        clean_excerpt = normalize_whitespace(plain_excerpt)
+        if not clean_excerpt:
+            return None
+
+        pos = self.text.find(clean_excerpt, plain_start)
+        if pos == -1:
+            return None
+
+        return self.to_wikitext_span(pos, pos + len(clean_excerpt))
+
+def _build_offset_index(wikitext: str) -> OffsetIndex:
+    section_index = get_section_index(wikitext)
+    pieces = [(section_index.wikicode(section), section.start) for section in section_index.sections]
+    return OffsetIndex(wikitext, pieces)
+
+def get_offset_index(wikitext: str) -> OffsetIndex:
+    """Return the OffsetIndex of a wikitext revision, building it on first use from its (cached) sections."""
+    return parse_cache.get_derived(wikitext, "offset_index", _build_offset_index)
@@ -0,0 +1,134 @@
+# utils/parse_cache.py
+import mwparserfromhell
+from mwparserfromhell.wikicode import Wikicode
+from collections import OrderedDict
+import os
+import threading
+from typing import Any, Callable, Dict, Tuple
+from src.utils.edit_map import revision_hash
+
+MAX_CACHE_BYTES = int(os.getenv("PARSE_CACHE_MB", "256")) * 1024 * 1024
+WIKICODE_BYTES_PER_CHAR = 40  # rough footprint of a parsed Wikicode tree per wikitext character
+
+def _estimate_size(value: Any, wikitext: str) -> int:
+    if isinstance(value, Wikicode):
+        return len(wikitext) * WIKICODE_BYTES_PER_CHAR
+    if isinstance(value, str):
+        return len(value)
+    if hasattr(value, "memory_size"):
+        return value.memory_size
+    return 0
+
+class ParseCache:
+    """
+    Process-wide LRU cache of parsed Wikicode and the views derived from it (plaintext,
+    offset index, ...), keyed by the content hash of the wikitext. Entries are evicted,
+    least recently used first, once their estimated size exceeds max_bytes.
+
+    Cached Wikicode is shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_bytes: int = MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self._pending: Dict[Tuple[str, str], threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_wikicode(self, wikitext: str):
+        """Return the parsed Wikicode of a wikitext, parsing it at most once per revision"""
+        return self.get_derived(wikitext, "wikicode", mwparserfromhell.parse)
+
+    def get_view(self, wikitext: str, name: str, builder: Callable[[Any], Any]) -> Any:
+        """
+        Return a named view of a wikitext revision, building it with builder(wikicode) on a miss.
+
+        Args:
+            wikitext: The wikitext the view is derived from
+            name: Name of the view, e.g. "plaintext"
+            builder: Callable taking the parsed Wikicode and returning the view
+        """
+        return self.get_derived(wikitext, name, lambda text: builder(self.get_wikicode(text)))
+
+    def get_derived(self, wikitext: str, name: str, builder: Callable[[str], Any]) -> Any:
+        """
+        Like get_view, but builder receives the wikitext itself and no parse is forced.
+
+        The builder runs outside the cache lock, so different revisions and views are
+        built concurrently; callers asking for a view that is being built wait for it.
+        """
+        key = revision_hash(wikitext)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and name in entry:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[name]
+            pending = self._pending.get((key, name))
+            if pending is None:
+                self.misses += 1
+                building = self._pending[(key, name)] = threading.Event()
+
+        if pending is not None:
+            pending.wait()
+            # built by another thread by now, or rebuilt here if that build failed
+            return self.get_derived(wikitext, name, builder)
+
+        try:
+            value = builder(wikitext)
+
+            with self._lock:
+                # the builder may have created or evicted the entry through nested lookups
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = {}
+                    self._entries[key] = entry
+                    self._sizes[key] = 0
+                if name not in entry:
+                    entry[name] = value
+                    size = _estimate_size(value, wikitext)
+                    self._sizes[key] += size
+                    self._total_bytes += size
+
+                self._entries.move_to_end(key)
+                self._evict(keep=key)
+                return entry[name]
+        finally:
+            with self._lock:
+                del self._pending[(key, name)]
+            building.set()
+
+    def _evict(self, keep: str):
+        """Drop least recently used entries until the cache fits, never dropping keep"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            del self._entries[key]
+            self._total_bytes -= self._sizes.pop(key)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size of the cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+# Singleton instance
+parse_cache = ParseCache()
@@ -0,0 +1,189 @@
+# utils/rate_limiter.py
+from contextlib import contextmanager
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+import anthropic
+import openai
+from src.config.settings import config
+from src.ui.logger import StreamlitLogger
+from src.utils.llm_cache import LLMCacheMiss, llm_cache
+from src.utils.token_budget import CHARS_PER_TOKEN
+
+BACKOFF_BASE = 1.0  # seconds before the first retry
+BACKOFF_MAX = 60.0  # longest wait between two retries
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    anthropic.RateLimitError,
+    anthropic.APIConnectionError,
+    anthropic.InternalServerError,
+)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously up to its capacity. Reservations are
+    taken immediately and may drive the level negative; the caller then waits until the
+    bucket has refilled, so concurrent callers are served in the order they arrived.
+    """
+
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity: float = capacity
+        self.per_second: float = per_second
+        self.level: float = capacity
+        self.updated: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket and return how long to wait before using it, in seconds"""
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.per_second)
+            self.updated = now
+            # a single request larger than the bucket would otherwise wait forever
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.per_second)
+
+    def adjust(self, amount: float):
+        """Correct an earlier reservation once the real amount is known"""
+        with self._lock:
+            self.level -= amount
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets for one provider and model, with
+    retries and jittered exponential backoff for rate limits and transient errors.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+
+    def acquire(self, estimated_tokens: int) -> int:
+        """Block until a request of estimated_tokens fits both budgets; returns the tokens reserved"""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        if wait > 0:
+            time.sleep(wait)
+        return estimated_tokens
+
+    def record_usage(self, estimated_tokens: int, response: Any):
+        """Replace the estimate by the token usage reported in the response, if any"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        actual = getattr(usage, "total_tokens", None)
+        if actual is None:
+            actual = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+        if actual:
+            self.tokens.adjust(actual - estimated_tokens)
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call func(*args, **kwargs) within the budgets, retrying retryable errors"""
+        def attempt():
+            estimate = self.acquire(estimate_tokens(kwargs))
+            response = func(*args, **kwargs)
+            self.record_usage(estimate, response)
+            return response
+        return self._with_retries(attempt, getattr(func, "__qualname__", "request"))
+
+    @contextmanager
+    def stream(self, func: Callable[..., Any], *args, **kwargs):
+        """Rate-limited counterpart of `with func(*args, **kwargs) as stream:` for SDK stream managers"""
+        def attempt():
+            self.acquire(estimate_tokens(kwargs))
+            manager = func(*args, **kwargs)
+            # the request is sent when the manager is entered
+            return manager, manager.__enter__()
+        manager, stream = self._with_retries(attempt, getattr(func, "__qualname__", "stream"))
+        try:
+            yield stream
+        except BaseException as e:
+            if not manager.__exit__(type(e), e, e.__traceback__):
+                raise
+        else:
+            manager.__exit__(None, None, None)
+
+    def _with_retries(self, attempt: Callable[[], Any], label: str) -> Any:
+        for retry in range(config.max_retries + 1):
+            try:
+                return attempt()
+            except RETRYABLE_ERRORS as e:
+                if retry == config.max_retries:
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retry))
+                StreamlitLogger.log(f"[RateLimiter] {label} failed ({type(e).__name__}), retrying in {delay:.1f}s ({retry+1}/{config.max_retries})...")
+                time.sleep(delay)
+
+def _retry_after(error: Exception):
+    """Delay requested by the server through the retry-after header, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return min(BACKOFF_MAX, float(response.headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """Rough token count of a request: its text content plus the output tokens it may use"""
+    def text_length(value) -> int:
+        if isinstance(value, str):
+            return len(value)
+        if isinstance(value, dict):
+            # base64 document payloads are not counted as text
+            return sum(text_length(item) for key, item in value.items() if key != "data")
+        if isinstance(value, (list, tuple)):
+            return sum(text_length(item) for item in value)
+        return len(getattr(value, "content", None) or "")
+
+    chars = text_length(request.get("messages", [])) + text_length(request.get("system", ""))
+    return chars // CHARS_PER_TOKEN + (request.get("max_tokens") or 0)
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider: str, model: str = "default") -> RateLimiter:
+    """Return the process-wide RateLimiter of a provider and model, creating it on first use."""
+    with _limiters_lock:
+        key = (provider, model)
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(config.requests_per_minute, config.tokens_per_minute)
+        return _limiters[key]
+
+def streaming_enabled() -> bool:
+    """
+    Whether to stream LLM output. Streamed responses are not cached, so with the response
+    cache on, requests are made whole instead, to be served from and stored in the cache.
+    """
+    return config.streaming and not llm_cache.enabled
+
+def _refuse_stream_in_replay(request: Dict[str, Any]):
+    # replay mode must never reach the network, and streams cannot be replayed
+    if llm_cache.mode == "replay":
+        raise LLMCacheMiss(f"Streamed requests are not cached and cannot be replayed ({request.get('model')}).")
+
+def limited_call(provider: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call an LLM client method through the response cache and the rate limiter of its provider and model"""
+    if kwargs.get("stream"):
+        _refuse_stream_in_replay(kwargs)
+    key = llm_cache.key(provider, kwargs) if llm_cache.cacheable(kwargs) else None
+    if key is not None:
+        cached = llm_cache.get(key, kwargs)
+        if cached is not None:
+            return cached
+
+    response = get_rate_limiter(provider, kwargs.get("model", "default")).call(func, *args, **kwargs)
+
+    if key is not None:
+        llm_cache.put(key, provider, kwargs, response)
+    return response
+
+def limited_stream(provider: str, func: Callable[..., Any], *args, **kwargs):
+    """Open an LLM client stream manager through the rate limiter of its provider and model"""
+    _refuse_stream_in_replay(kwargs)
+    return get_rate_limiter(provider, kwargs.get("model", "default")).stream(func, *args, **kwargs)
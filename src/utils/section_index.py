@@ -0,0 +1,73 @@
+# utils/section_index.py
+from dataclasses import dataclass
+import re
+from typing import Any, Callable, List, Optional
+from src.utils.parse_cache import parse_cache
+
+HEADING_PATTERN = re.compile(r"^(={1,6})[ \t]*(.+?)[ \t]*\1[ \t]*$", re.MULTILINE)
+
+@dataclass
+class Section:
+    """
+    A heading-delimited block of wikitext. The lead section has an empty title and level 0.
+
+    Attributes:
+        title (str): Heading text
+        level (int): Number of '=' around the heading
+        start (int): Offset of the heading line in the article wikitext
+        end (int): Offset where the next section starts
+        text (str): The section's wikitext, heading included
+    """
+    title: str
+    level: int
+    start: int
+    end: int
+    text: str
+
+class SectionIndex:
+    """
+    Heading-level split of an article. Every section is parsed and converted on its own
+    through the shared parse cache, keyed by the section's content hash, so after an edit
+    only the sections whose text changed are parsed again.
+
+    Markup that spans a heading (e.g. a template opened in one section and closed in the
+    next) is parsed per section, which matches how MediaWiki treats headings in practice.
+    """
+
+    def __init__(self, wikitext: str):
+        self.wikitext: str = wikitext
+        self.sections: List[Section] = []
+
+        bounds = [(0, "", 0)] + [
+            (match.start(), match.group(2), len(match.group(1)))
+            for match in HEADING_PATTERN.finditer(wikitext)
+        ]
+        for idx, (start, title, level) in enumerate(bounds):
+            end = bounds[idx + 1][0] if idx + 1 < len(bounds) else len(wikitext)
+            if end > start or idx == 0:
+                self.sections.append(Section(title, level, start, end, wikitext[start:end]))
+
+    @property
+    def memory_size(self) -> int:
+        """Approximate memory held by the section texts, in bytes"""
+        return len(self.wikitext)
+
+    def wikicode(self, section: Section):
+        """Parsed Wikicode of a single section"""
+        return parse_cache.get_wikicode(section.text)
+
+    def view(self, name: str, builder: Callable[[Any], Any]) -> List[Any]:
+        """Return builder(wikicode) for every section, reusing cached results of unchanged sections"""
+        return [parse_cache.get_view(section.text, name, builder) for section in self.sections]
+
+    def find(self, title: str) -> Optional[Section]:
+        """Return the first section with the given heading title"""
+        title = title.strip()
+        for section in self.sections:
+            if section.level and section.title == title:
+                return section
+        return None
+
+def get_section_index(wikitext: str) -> SectionIndex:
+    """Return the SectionIndex of a wikitext revision, building it on first use."""
+    return parse_cache.get_derived(wikitext, "section_index", SectionIndex)
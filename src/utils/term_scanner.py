@@ -0,0 +1,141 @@
+# utils/term_scanner.py
+from bisect import bisect_right
+from collections import deque
+from dataclasses import dataclass
+import re
+from typing import Dict, Iterable, List, Tuple
+
+# Where a term occurrence sits in the wikitext
+CONTEXT_TEXT = "text"
+CONTEXT_WIKILINK = "wikilink"
+CONTEXT_TEMPLATE = "template"
+CONTEXT_REF = "ref"
+
+MARKUP_TOKEN = re.compile(r"\[\[|\]\]|\{\{|\}\}|<ref\b[^>]*?/>|<ref\b[^>]*>|</ref\s*>", re.IGNORECASE)
+
+@dataclass
+class TermHit:
+    """
+    A single occurrence of a term.
+
+    Attributes:
+        term (str): The term that was found
+        start (int): Start offset in the scanned text
+        end (int): End offset (exclusive) in the scanned text
+        context (str): One of 'text', 'wikilink', 'template' or 'ref'
+    """
+    term: str
+    start: int
+    end: int
+    context: str
+
+def markup_regions(text: str) -> List[Tuple[int, int, str]]:
+    """
+    Return the outermost [[wikilink]], {{template}} and <ref> regions of a wikitext as
+    sorted (start, end, context) tuples, in a single linear pass. Unclosed markup is ignored.
+    """
+    regions = []
+    stack = []
+
+    for token in MARKUP_TOKEN.finditer(text):
+        value = token.group(0)
+        lowered = value.lower()
+
+        if lowered.startswith("<ref") and lowered.endswith("/>"):
+            if not stack:
+                regions.append((token.start(), token.end(), CONTEXT_REF))
+            continue
+
+        if value == "[[":
+            stack.append((CONTEXT_WIKILINK, token.start()))
+        elif value == "{{":
+            stack.append((CONTEXT_TEMPLATE, token.start()))
+        elif lowered.startswith("<ref"):
+            stack.append((CONTEXT_REF, token.start()))
+        else:
+            closes = {"]]": CONTEXT_WIKILINK, "}}": CONTEXT_TEMPLATE}.get(value, CONTEXT_REF)
+            # drop stray closers, and unwind anything left open inside the closed element
+            for depth in range(len(stack) - 1, -1, -1):
+                if stack[depth][0] == closes:
+                    start = stack[depth][1]
+                    del stack[depth:]
+                    if not stack:
+                        regions.append((start, token.end(), closes))
+                    break
+
+    return regions
+
+class TermScanner:
+    """
+    Aho-Corasick automaton over a fixed set of terms. Finds every occurrence of every
+    term in one pass over the text, and classifies each occurrence by the wikitext
+    markup it sits in.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self.terms: List[str] = list(dict.fromkeys(term for term in terms if term))
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for term_idx, term in enumerate(self.terms):
+            state = 0
+            for char in term:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append(term_idx)
+
+        # breadth-first construction of failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def scan(self, text: str, classify: bool = True) -> List[TermHit]:
+        """
+        Return every term occurrence in text, sorted by start offset.
+
+        Args:
+            text: The text to scan
+            classify: Classify hits by markup region; if False every hit is 'text'
+        """
+        hits = []
+        goto, fail, output, terms = self._goto, self._fail, self._output, self.terms
+        state = 0
+
+        for pos, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for term_idx in output[state]:
+                term = terms[term_idx]
+                hits.append(TermHit(term, pos + 1 - len(term), pos + 1, CONTEXT_TEXT))
+
+        hits.sort(key=lambda hit: (hit.start, -hit.end))
+
+        if classify:
+            regions = markup_regions(text)
+            region_starts = [region[0] for region in regions]
+            for hit in hits:
+                slot = bisect_right(region_starts, hit.start) - 1
+                if slot >= 0 and hit.start < regions[slot][1]:
+                    hit.context = regions[slot][2]
+
+        return hits
+
+    def scan_by_term(self, text: str, classify: bool = True) -> Dict[str, List[TermHit]]:
+        """Return the hits of every term in document order, keyed by term (missing terms map to [])"""
+        grouped = {term: [] for term in self.terms}
+        for hit in self.scan(text, classify):
+            grouped[hit.term].append(hit)
+        return grouped
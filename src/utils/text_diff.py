@@ -0,0 +1,162 @@
+# utils/text_diff.py
+from bisect import bisect_left
+import difflib
+import re
+from typing import Dict, List, Tuple
+
+Opcode = Tuple[str, int, int, int, int]
+
+TOKEN_PATTERN = re.compile(r"\s+|\w+|[^\w\s]")
+# how far ahead in the original a streamed paragraph may re-align
+LOOKAHEAD_PARAGRAPHS = 50
+
+def _split_paragraphs(text: str) -> Tuple[List[str], List[int]]:
+    """Split text into lines (newlines kept) and return them with their start offsets"""
+    paragraphs = text.splitlines(keepends=True)
+    offsets = []
+    pos = 0
+    for paragraph in paragraphs:
+        offsets.append(pos)
+        pos += len(paragraph)
+    offsets.append(pos)
+    return paragraphs, offsets
+
+def _tokenize(text: str, base: int) -> Tuple[List[str], List[int]]:
+    """Split text into word, punctuation and whitespace tokens, with absolute start offsets"""
+    tokens = []
+    offsets = []
+    for match in TOKEN_PATTERN.finditer(text):
+        tokens.append(match.group(0))
+        offsets.append(base + match.start())
+    offsets.append(base + len(text))
+    return tokens, offsets
+
+def _token_opcodes(a: str, b: str, a_start: int, a_end: int, b_start: int, b_end: int) -> List[Opcode]:
+    """Word-level diff of a[a_start:a_end] against b[b_start:b_end], in character offsets"""
+    a_tokens, a_offsets = _tokenize(a[a_start:a_end], a_start)
+    b_tokens, b_offsets = _tokenize(b[b_start:b_end], b_start)
+    matcher = difflib.SequenceMatcher(None, a_tokens, b_tokens, autojunk=False)
+    return [
+        (tag, a_offsets[i1], a_offsets[i2], b_offsets[j1], b_offsets[j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+    ]
+
+def _coalesce(opcodes: List[Opcode]) -> List[Opcode]:
+    """Join neighbouring opcodes of the same kind (equal or change) and fix up change tags"""
+    merged = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i1 == i2 and j1 == j2:
+            continue
+        is_equal = tag == 'equal'
+        if merged and (merged[-1][0] == 'equal') == is_equal:
+            _, p1, _, q1, _ = merged[-1]
+            merged[-1] = (tag, p1, i2, q1, j2)
+        else:
+            merged.append((tag, i1, i2, j1, j2))
+
+    fixed = []
+    for tag, i1, i2, j1, j2 in merged:
+        if tag != 'equal':
+            if i2 > i1 and j2 > j1:
+                tag = 'replace'
+            elif i2 > i1:
+                tag = 'delete'
+            else:
+                tag = 'insert'
+        fixed.append((tag, i1, i2, j1, j2))
+    return fixed
+
+def paragraph_diff_opcodes(a: str, b: str) -> List[Opcode]:
+    """
+    Two-stage diff returning difflib-style opcodes in character offsets of a and b.
+
+    Paragraphs (lines) are aligned first by their content; only the runs of paragraphs
+    that changed are then diffed word by word. Unchanged paragraphs are matched as whole
+    (hashed) strings, so the expensive token diff only runs over the edited regions, and
+    autojunk is disabled so the result does not depend on the article length.
+    """
+    a_paragraphs, a_offsets = _split_paragraphs(a)
+    b_paragraphs, b_offsets = _split_paragraphs(b)
+    # blank lines are everywhere and would only slow the alignment down
+    matcher = difflib.SequenceMatcher(lambda paragraph: not paragraph.strip(), a_paragraphs, b_paragraphs, autojunk=False)
+
+    opcodes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        a_start, a_end = a_offsets[i1], a_offsets[i2]
+        b_start, b_end = b_offsets[j1], b_offsets[j2]
+        if tag == 'replace':
+            opcodes += _token_opcodes(a, b, a_start, a_end, b_start, b_end)
+        else:
+            opcodes.append((tag, a_start, a_end, b_start, b_end))
+
+    return _coalesce(opcodes)
+
+class IncrementalParagraphDiff:
+    """
+    Streaming counterpart of paragraph_diff_opcodes. The edited text is fed chunk by chunk;
+    every completed line that is identical to an upcoming original paragraph re-aligns the
+    two texts, and the block of changed paragraphs before it is diffed word by word right
+    away. Each paragraph is looked up once in a hash map, so feeding the whole text is linear
+    in its length plus the size of the changed blocks.
+
+    Opcodes are in character offsets of the original and of the edited text fed so far.
+    """
+
+    def __init__(self, a: str):
+        self.a: str = a
+        self.b: str = ""
+        self.a_paragraphs, self.a_offsets = _split_paragraphs(a)
+        self.positions: Dict[str, List[int]] = {}
+        for idx, paragraph in enumerate(self.a_paragraphs):
+            if paragraph.strip():
+                self.positions.setdefault(paragraph, []).append(idx)
+
+        self.a_line = 0  # first original paragraph not aligned yet
+        self.b_pos = 0  # start of the first edited paragraph not aligned yet
+        self.b_scan = 0  # end of the complete lines consumed so far
+
+    def feed(self, chunk: str) -> List[Opcode]:
+        """Add streamed text and return the opcodes of the blocks it completed"""
+        self.b += chunk
+        opcodes = []
+        newline = self.b.find("\n", self.b_scan)
+        while newline >= 0:
+            line_start, self.b_scan = self.b_scan, newline + 1
+            match = self._match(self.b[line_start:self.b_scan], line_start)
+            if match is not None:
+                opcodes += self._block(self.a_offsets[self.a_line], self.a_offsets[match], self.b_pos, line_start)
+                opcodes.append(('equal', self.a_offsets[match], self.a_offsets[match + 1], line_start, self.b_scan))
+                self.a_line = match + 1
+                self.b_pos = self.b_scan
+            newline = self.b.find("\n", self.b_scan)
+        return opcodes
+
+    def finish(self) -> List[Opcode]:
+        """Diff whatever is left once the stream has ended"""
+        opcodes = self._block(self.a_offsets[self.a_line], len(self.a), self.b_pos, len(self.b))
+        self.a_line = len(self.a_paragraphs)
+        self.b_pos = self.b_scan = len(self.b)
+        return opcodes
+
+    def _match(self, line: str, line_start: int):
+        """Index of the original paragraph the line re-aligns with, if any"""
+        if not line.strip():
+            # blank lines only align when nothing is pending on either side
+            if self.b_pos == line_start and self.a_line < len(self.a_paragraphs) and self.a_paragraphs[self.a_line] == line:
+                return self.a_line
+            return None
+        candidates = self.positions.get(line)
+        if not candidates:
+            return None
+        idx = bisect_left(candidates, self.a_line)
+        if idx < len(candidates) and candidates[idx] < self.a_line + LOOKAHEAD_PARAGRAPHS:
+            return candidates[idx]
+        return None
+
+    def _block(self, a_start: int, a_end: int, b_start: int, b_end: int) -> List[Opcode]:
+        if a_start == a_end and b_start == b_end:
+            return []
+        return [
+            (tag, a_start + i1, a_start + i2, b_start + j1, b_start + j2)
+            for tag, i1, i2, j1, j2 in paragraph_diff_opcodes(self.a[a_start:a_end], self.b[b_start:b_end])
+        ]
@@ -0,0 +1,45 @@
+# utils/token_budget.py
+from typing import List
+
+CHARS_PER_TOKEN = 4  # rough average for English prose, used instead of a real tokenizer
+SEPARATORS = ["\n\n", "\n", ". ", " "]  # preferred cut points, coarsest first
+
+def count_tokens(text: str) -> int:
+    """Cheap estimate of the number of tokens of a text"""
+    return len(text) // CHARS_PER_TOKEN
+
+def split_to_budget(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text into consecutive chunks of at most max_tokens (estimated), cutting at
+    paragraph breaks where possible, then at line breaks, sentences and words. The chunks
+    keep every character, so "".join(chunks) == text.
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return [text] if text else []
+    return _split(text, max_chars, 0)
+
+def _split(text: str, max_chars: int, level: int) -> List[str]:
+    if level == len(SEPARATORS):
+        return [text[pos:pos + max_chars] for pos in range(0, len(text), max_chars)]
+
+    separator = SEPARATORS[level]
+    parts = text.split(separator)
+    pieces = [part + separator for part in parts[:-1]] + [parts[-1]]
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if len(piece) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks += _split(piece, max_chars, level + 1)
+        elif len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current += piece
+    if current:
+        chunks.append(current)
+    return chunks
@@ -1,37 +1,433 @@
 from src.utils.helpers import find_excerpt_position
+from src.utils.edit_map import Edit, EditMap, RevisionLog, revision_hash
+from src.utils.section_index import get_section_index
+from src.utils.interval_index import IntervalIndex
+from src.utils.offset_index import get_offset_index, normalize_whitespace
+from abc import ABC, abstractmethod
+from bisect import bisect_left
 import re
-from typing import Callable
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+# A resolved edit: replace wikitext[start:end] with text
+Splice = Tuple[int, int, str]
+
+HEADING_LINE = re.compile(r"^\s*=+.*=+\s*$")
+MIN_ONE_SIDED_ANCHOR = 8  # shorter anchors match too many places to be trusted on their own
+
+class AnchoredPatch(ABC):
+    """
+    Base for patches that remember where they apply. The first resolve() locates the
+    patch and stores its span with the hash of that wikitext revision; later calls
+    return the stored span, rebased through RevisionLog if the text changed since,
+    and only search again when an edit touched the span.
+    """
+    span: Optional[Tuple[int, int]]
+    revision: Optional[str]
+
+    @abstractmethod
+    def _locate(self, wikitext: str) -> Optional[Splice]:
+        """Search the wikitext for the patch, returning its splice or None if it is not found"""
+
+    def resolve(self, wikitext: str, revision: Optional[str] = None) -> Optional[Splice]:
+        if revision is None:
+            revision = revision_hash(wikitext)
+
+        if self.span is not None:
+            span = RevisionLog.rebase(self.span, self.revision, revision)
+            if span is not None:
+                self.span, self.revision = span, revision
+                return span[0], span[1], self._replacement()
+
+        resolved = self._locate(wikitext)
+        if resolved is None:
+            return None
+        self.span, self.revision = (resolved[0], resolved[1]), revision
+        return resolved
+
+    @abstractmethod
+    def _replacement(self) -> str:
+        """Text the located span is replaced with"""
+
+    def __call__(self, wikitext: str) -> str:
+        return WikitextPatcher.splice(wikitext, self.resolve(wikitext))
+
+@dataclass
+class TextReplacementPatch(AnchoredPatch):
+    """Patch replacing the first occurrence of a plain text excerpt"""
+    original_excerpt: str
+    new_text: str
+    span: Optional[Tuple[int, int]] = None
+    revision: Optional[str] = None
+
+    def _locate(self, wikitext: str) -> Optional[Splice]:
+        pos = find_excerpt_position(self.original_excerpt, wikitext)
+        if not pos:
+            return None
+        return pos[0], pos[1], self.new_text
+
+    def _replacement(self) -> str:
+        return self.new_text
+
+def _line_break(index, plain_pos: int, forward: bool) -> int:
+    """Plaintext offset of the nearest line break in the wikitext after (or before) plain_pos"""
+    positions = range(plain_pos, len(index.text)) if forward else range(plain_pos - 1, -1, -1)
+    for k in positions:
+        if index.text[k] != " ":
+            continue
+        # the wikitext between the characters around the space, markup included
+        start = index.ends[k - 1] if k > 0 else 0
+        end = index.starts[k + 1] if k + 1 < len(index.text) else len(index.wikitext)
+        between = index.wikitext[start:end]
+        if between.lstrip(" \t").startswith("\n") or between.rstrip(" \t").endswith("\n"):
+            return k if forward else k + 1
+    return len(index.text) if forward else 0
+
+@dataclass
+class InsertionPatch(AnchoredPatch):
+    """
+    Patch inserting text between two plain text anchors. The text is spliced in at a single
+    wikitext offset, so markup between the anchors (references, comments, ...) is kept.
+
+    Attributes:
+        context_before (str): Plain text right before the insertion point
+        gap (str): Whitespace-only plain text the insertion replaces, if any
+        context_after (str): Plain text right after the gap
+        new_text (str): Text to insert
+    """
+    context_before: str
+    gap: str
+    context_after: str
+    new_text: str
+    span: Optional[Tuple[int, int]] = None
+    revision: Optional[str] = None
+
+    def _whitespace(self) -> Tuple[str, str]:
+        """Original and edited whitespace between the two anchors"""
+        before_ws = self.context_before[len(self.context_before.rstrip()):]
+        after_ws = self.context_after[:len(self.context_after) - len(self.context_after.lstrip())]
+        return before_ws + self.gap + after_ws, before_ws + self.new_text + after_ws
+
+    def _attaches_before(self) -> bool:
+        # text that ends a paragraph stays with the text before it, anything else with the text after
+        _, edited = self._whitespace()
+        if not self.context_after.strip():
+            return True
+        if not self.context_before.strip():
+            return False
+        return "\n" in edited[len(edited.rstrip()):]
+
+    def _locate(self, wikitext: str) -> Optional[Splice]:
+        before = self._anchor(self.context_before, at_end=True)
+        after = self._anchor(self.context_after, at_end=False)
+        attach_before = self._attaches_before()
+        index = get_offset_index(wikitext)
+
+        anchors = None
+        if before and after:
+            separator = " " if self._whitespace()[0] else ""
+            pos = index.text.find(before + separator + after)
+            if pos != -1:
+                anchors = pos + len(before), pos + len(before) + len(separator)
+            else:
+                anchors = self._find_split_anchors(index, before, after)
+
+        if anchors is not None:
+            before_end, after_start = anchors
+        elif attach_before:
+            # only the side the text attaches to has to be found; text attaching before ends a line
+            before_end = self._find_one_sided(index, before, at_end=True, at_line_break=True)
+            if before_end is None:
+                return None
+        else:
+            original, _ = self._whitespace()
+            at_line_break = not self.context_before.strip() or "\n" in original
+            after_start = self._find_one_sided(index, after, at_end=False, at_line_break=at_line_break)
+            if after_start is None:
+                return None
+
+        if attach_before:
+            offset = index.insertion_point(before_end, attach_before=True)
+        else:
+            offset = index.insertion_point(after_start, attach_before=False)
+        return offset, offset, self._replacement()
+
+    @staticmethod
+    def _anchor(context: str, at_end: bool) -> str:
+        """
+        The line of an editor plaintext context next to the insertion point. Headings are
+        markup the offset index does not keep as lines, so a heading line is no anchor.
+        """
+        if at_end:
+            context = context.rstrip()
+            line = context[context.rfind("\n") + 1:]
+        else:
+            line = context.lstrip().split("\n", 1)[0]
+        if HEADING_LINE.match(line):
+            return ""
+        return normalize_whitespace(line)
+
+    @staticmethod
+    def _find_one_sided(index, anchor: str, at_end: bool, at_line_break: bool) -> Optional[int]:
+        """
+        Plaintext offset of the insertion point next to a single anchor, i.e. where the
+        anchor ends (at_end) or starts. The editor's plaintext renders piped links by their
+        target, so words are dropped from the far side of the anchor until it is found, and
+        if the insertion point is a line break, from the near side as well; the line break
+        next to what is left is then the insertion point. The anchor must be unique, since
+        there is no second anchor to confirm it.
+        """
+        words = anchor.split(" ")
+        sides = [True, False] if at_line_break else [True]
+        for drop_far in sides:
+            for dropped in range(len(words)):
+                kept = words[dropped:] if drop_far == at_end else words[:len(words) - dropped]
+                candidate = " ".join(kept)
+                if len(candidate) < MIN_ONE_SIDED_ANCHOR:
+                    break
+                pos = index.text.find(candidate)
+                if pos == -1:
+                    continue
+                if index.text.find(candidate, pos + 1) != -1:
+                    return None
+                plain_pos = pos + len(candidate) if at_end else pos
+                return _line_break(index, plain_pos, at_end) if at_line_break else plain_pos
+        return None
+
+    @staticmethod
+    def _find_split_anchors(index, before: str, after: str) -> Optional[Tuple[int, int]]:
+        """
+        Anchors separated only by text inside markup (e.g. a reference, which the editor's
+        plaintext leaves out but the offset index keeps); returns where the first ends and
+        the second starts
+        """
+        if not (before and after):
+            return None
+        pos = index.text.find(before)
+        while pos != -1:
+            before_end = pos + len(before)
+            after_start = index.text.find(after, before_end)
+            if after_start == -1:
+                return None
+            if all(index.owners[k] != -1 or index.text[k] == " " for k in range(before_end, after_start)):
+                return before_end, after_start
+            pos = index.text.find(before, pos + 1)
+        return None
+
+    def _replacement(self) -> str:
+        original, edited = self._whitespace()
+        if not original:
+            # no whitespace between the anchors, e.g. a change inside a word
+            return self.new_text
+        # the original whitespace stays in the wikitext on the other side of the insertion
+        return edited.rstrip() if self._attaches_before() else edited.lstrip()
+
+@dataclass
+class SectionPatch(AnchoredPatch):
+    """Patch replacing a whole section, heading included"""
+    section_title: str
+    new_content: str
+    span: Optional[Tuple[int, int]] = None
+    revision: Optional[str] = None
+
+    def _locate(self, wikitext: str) -> Optional[Splice]:
+        section = get_section_index(wikitext).find(self.section_title)
+        if section is None or section.start == 0:
+            return None
+        # from the newline before the heading up to, not including, the newline before the next one
+        end = section.end - 1 if section.end < len(wikitext) else section.end
+        return section.start - 1, end, self._replacement()
+
+    def _replacement(self) -> str:
+        return f"\n{self.new_content.strip()}"
+
+@dataclass
+class CitationPatch(AnchoredPatch):
+    """Patch appending a <ref> right after a plain text excerpt"""
+    context: str
+    citation: str
+    span: Optional[Tuple[int, int]] = None
+    revision: Optional[str] = None
+
+    def _locate(self, wikitext: str) -> Optional[Splice]:
+        pos = find_excerpt_position(self.context, wikitext)
+        if not pos:
+            return None
+        return pos[1], pos[1], self._replacement()
+
+    def _replacement(self) -> str:
+        return f"<ref>{self.citation}</ref>"
+
+@dataclass
+class PatchReport:
+    """
+    Outcome of one suggestion in a batch apply.
+
+    Attributes:
+        suggestion_id (int): Id of the suggestion
+        status (str): 'applied', 'conflict' or 'not_found'
+        span (Optional[Tuple[int, int]]): Resolved span in the original wikitext, if any
+    """
+    suggestion_id: int
+    status: str
+    span: Optional[Tuple[int, int]] = None
 
 class WikitextPatcher:
     @staticmethod
-    def create_text_replacement_patch(original_excerpt: str, new_text: str) -> Callable[[str], str]:
-        """Create patch for simple text replacements"""
-        def patch(wikitext: str) -> str:
-            pos = find_excerpt_position(original_excerpt, wikitext)
-            print(f"{pos}",flush=True)
-            if not pos:
-                print("Was not patched.",flush=True)
-                return wikitext
-            return wikitext[:pos[0]] + new_text + wikitext[pos[1]:]
-        return patch
+    def create_text_replacement_patch(original_excerpt: str, new_text: str, span: Optional[Tuple[int, int]] = None,
+                                      wikitext: Optional[str] = None) -> Callable[[str], str]:
+        """Create patch for simple text replacements, optionally anchored to a known span of wikitext"""
+        if span is not None and wikitext is not None:
+            return TextReplacementPatch(original_excerpt, new_text, span, revision_hash(wikitext))
+        return TextReplacementPatch(original_excerpt, new_text)
+
+    @staticmethod
+    def create_insertion_patch(context_before: str, gap: str, context_after: str, new_text: str) -> Callable[[str], str]:
+        """Create patch inserting text between two plain text anchors, without touching the markup between them"""
+        return InsertionPatch(context_before, gap, context_after, new_text)
 
     @staticmethod
     def create_section_patch(section_title: str, new_content: str) -> Callable[[str], str]:
         """Create patch for entire section replacements"""
-        def patch(wikitext: str) -> str:
-            section_pattern = rf"(\n==+ {re.escape(section_title)} ==+.*?)(?=\n==|$)"
-            match = re.search(section_pattern, wikitext, re.DOTALL)
-            if not match:
-                return wikitext
-            return wikitext.replace(match.group(1), f"\n{new_content.strip()}")
-        return patch
+        return SectionPatch(section_title, new_content)
 
     @staticmethod
     def create_citation_patch(context: str, citation: str) -> Callable[[str], str]:
         """Create patch for adding citations"""
-        def patch(wikitext: str) -> str:
-            pos = find_excerpt_position(context, wikitext)
-            if not pos:
-                return wikitext
-            return wikitext[:pos[1]] + f"<ref>{citation}</ref>" + wikitext[pos[1]:]
-        return patch
\ No newline at end of file
+        return CitationPatch(context, citation)
+
+    @staticmethod
+    def splice(wikitext: str, splice: Optional[Splice]) -> str:
+        """Apply a single resolved splice, or return the wikitext unchanged if there is none"""
+        if splice is None:
+            print("Was not patched.", flush=True)
+            return wikitext
+        start, end, text = splice
+        return wikitext[:start] + text + wikitext[end:]
+
+    @staticmethod
+    def apply_batch(wikitext: str, suggestions: list) -> Tuple[str, List[PatchReport]]:
+        """
+        Apply the patches of many suggestions in a single pass.
+
+        Every patch is resolved against the same wikitext snapshot (so the article is parsed
+        once), overlapping spans are rejected in favour of the earlier suggestion, and the
+        surviving splices are applied from the end of the document backwards.
+
+        Args:
+            wikitext: The wikitext to patch
+            suggestions: Suggestions whose patch should be applied, in priority order
+
+        Returns:
+            The patched wikitext and one PatchReport per suggestion, in input order
+        """
+        reports: List[PatchReport] = []
+        accepted: List[Splice] = []
+        accepted_starts: List[int] = []
+        opaque = []
+        revision = revision_hash(wikitext)
+
+        for suggestion in suggestions:
+            patch = suggestion.patch
+            if not hasattr(patch, "resolve"):
+                # plain callables cannot be resolved up front, run them after the splice pass
+                report = PatchReport(suggestion.id, "not_found")
+                opaque.append((patch, report))
+                reports.append(report)
+                continue
+
+            resolved = patch.resolve(wikitext, revision)
+            if resolved is None:
+                reports.append(PatchReport(suggestion.id, "not_found"))
+                continue
+
+            start, end, _ = resolved
+            slot = bisect_left(accepted_starts, start)
+            if WikitextPatcher._overlaps(accepted, slot, start, end):
+                reports.append(PatchReport(suggestion.id, "conflict", (start, end)))
+                continue
+
+            accepted.insert(slot, resolved)
+            accepted_starts.insert(slot, start)
+            reports.append(PatchReport(suggestion.id, "applied", (start, end)))
+
+        parts = []
+        tail = len(wikitext)
+        for start, end, text in reversed(accepted):
+            parts.append(wikitext[end:tail])
+            parts.append(text)
+            tail = start
+        parts.append(wikitext[:tail])
+        modified = "".join(reversed(parts))
+
+        # remember the splices so anchored suggestions can be rebased onto the new revision
+        RevisionLog.record(
+            revision,
+            revision_hash(modified),
+            EditMap([Edit(start, end, len(text)) for start, end, text in accepted])
+        )
+
+        for patch, report in opaque:
+            patched = patch(modified)
+            if patched != modified:
+                report.status = "applied"
+                RevisionLog.record_texts(modified, patched)
+            modified = patched
+
+        return modified, reports
+
+    @staticmethod
+    def anchor_suggestions(suggestions: list, wikitext: str):
+        """Resolve the patch of every suggestion against the wikitext it was generated from"""
+        revision = revision_hash(wikitext)
+        for suggestion in suggestions:
+            if isinstance(suggestion.patch, AnchoredPatch):
+                suggestion.patch.resolve(wikitext, revision)
+
+    @staticmethod
+    def find_conflicts(suggestions: list, wikitext: str) -> list:
+        """
+        Flag suggestions whose wikitext spans overlap, and order them so overlapping ones are adjacent.
+
+        Spans are resolved (or rebased) against the given wikitext and put in an interval index,
+        so each suggestion is checked in O(log n). Rejected suggestions are ignored. Each
+        suggestion's conflicts are set to the ids of the suggestions it overlaps.
+
+        Returns:
+            The same suggestions, grouped by overlap; groups keep the order of their first member
+        """
+        revision = revision_hash(wikitext)
+        intervals = []
+        for position, suggestion in enumerate(suggestions):
+            suggestion.conflicts = []
+            if suggestion.status == 'rejected' or not isinstance(suggestion.patch, AnchoredPatch):
+                continue
+            resolved = suggestion.patch.resolve(wikitext, revision)
+            if resolved is not None:
+                intervals.append((resolved[0], resolved[1], position))
+
+        index = IntervalIndex(intervals)
+        for start, end, position in intervals:
+            suggestions[position].conflicts = [
+                suggestions[other].id for other in index.overlapping(start, end) if other != position
+            ]
+
+        group_of = {}
+        for group in index.groups():
+            for position in group:
+                group_of[position] = min(group)
+        order = sorted(range(len(suggestions)), key=lambda position: (group_of.get(position, position), position))
+        return [suggestions[position] for position in order]
+
+    @staticmethod
+    def _overlaps(accepted: List[Splice], slot: int, start: int, end: int) -> bool:
+        """Check a span against its sorted neighbours; insertions at the same point also clash"""
+        if slot > 0:
+            prev_start, prev_end, _ = accepted[slot - 1]
+            if prev_end > start or prev_start == start:
+                return True
+        if slot < len(accepted):
+            next_start, _, _ = accepted[slot]
+            if next_start < end or next_start == start:
+                return True
+        return False
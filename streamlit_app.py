@@ -10,6 +10,10 @@ from typing import Dict, Callable
 from bs4 import BeautifulSoup
 import requests
 from src.utils.helpers import wikitext_to_plaintext, wikitext_to_plaintext_skip_tables_refs
+from src.utils.wikitext_patcher import WikitextPatcher
+from src.utils.edit_map import RevisionLog
+from src.utils.llm_cache import llm_cache
+from src.utils.concurrency import iter_concurrently
 from pathlib import Path
 import json
 
@@ -28,7 +32,12 @@ def setup_logger():
             with st.session_state.log_container:
                 st.code(entry)
     
-    StreamlitLogger.initialize(streamlit_log)
+    def streamlit_stream(source: str, text: str):
+        # live view of a streaming completion, replaced by a log entry once it ends
+        if 'stream_placeholder' in st.session_state:
+            st.session_state.stream_placeholder.code(f"[{source}] {text}", language="text", wrap_lines=True)
+    
+    StreamlitLogger.initialize(streamlit_log, streamlit_stream)
 
 setup_logger()
 
@@ -87,6 +96,9 @@ class AnalysisFlow(Enum):
     LANGUAGE_NEUTRALITY = "Check Language Neutrality"
     IMPROVE_LINKING = "Improve Hyperlinking"
 
+# runs every registered flow at once; used as the active flow while it runs
+RUN_ALL_FLOWS = "Run All Flows"
+
 # Initialize Wikipedia Client
 wiki = WikipediaClient()
 st.set_page_config(page_title="WAIT Editor", layout="wide")
@@ -123,6 +135,12 @@ def register_flow(flow: AnalysisFlow):
         return func
     return decorator
 
+def show_streamed_suggestion(suggestion: Suggestion):
+    """Preview a suggestion in the running flow's status box as soon as it is generated"""
+    if 'suggestion_feed' in st.session_state:
+        with st.session_state.suggestion_feed:
+            st.markdown(f"**{suggestion.type}:** {suggestion.text}", unsafe_allow_html=True)
+
 @register_flow(AnalysisFlow.SOURCE_IMPROVEMENT)
 def handle_source_improvement(article_title: str, sources: list, urls: list, original_content: str, wikitext_content: str):
     #try:
@@ -135,17 +153,17 @@ def handle_source_improvement(article_title: str, sources: list, urls: list, ori
     StreamlitLogger.log("Processing sources...")
     #source_url_data = [url.strip() for url in urls if url.strip()]
     source_summaries = core.summarize_sources(article_title, original_content, wikitext_content, sources)
-
-    st.session_state.summaries = source_summaries
     
     # use a special table-less version for this one
     original_content = wikitext_to_plaintext_skip_tables_refs(wikitext_content)
     
-    enhancement_suggestions = core.enhance_with_source_summaries(article_title, original_content, wikitext_content, source_summaries)
+    enhancement_suggestions = core.enhance_with_source_summaries(article_title, original_content, wikitext_content, source_summaries, show_streamed_suggestion)
     
+    # stored in the session state by the caller, as handlers may run on worker threads
     return {
         "status": "success",
-        "suggestions": enhancement_suggestions
+        "suggestions": enhancement_suggestions,
+        "summaries": source_summaries
     }
     #except Exception as e:
     #    StreamlitLogger.log(f"Error: {str(e)}")
@@ -157,7 +175,7 @@ def handle_neutrality_improvement(article_title: str, sources: list, urls: list,
         StreamlitLogger.log("Starting language neutrality analysis...")
         
         StreamlitLogger.log("Generating suggestions...")
-        enhancement_suggestions = core.check_neutrality(article_title, original_content, wikitext_content)
+        enhancement_suggestions = core.check_neutrality(article_title, original_content, wikitext_content, show_streamed_suggestion)
         
         return {
             "status": "success",
@@ -215,17 +233,102 @@ def show_processing_log():
                 st.code(message, language="text", wrap_lines=True)
 
 def render_flow_buttons():
-    cols = st.columns(len(FLOW_REGISTRY))
-    for idx, (flow, _) in enumerate(FLOW_REGISTRY.items()):
+    cols = st.columns(len(FLOW_REGISTRY) + 1)
+    for idx, flow in enumerate(list(FLOW_REGISTRY) + [RUN_ALL_FLOWS]):
         with cols[idx]:
-            if st.button(flow.value):
+            if st.button(flow.value if isinstance(flow, AnalysisFlow) else flow):
                 st.session_state.active_flow = flow
                 st.session_state.flow_status[flow] = {
                     "running": True,
                     "result": None
                 }
 
+def load_article_content():
+    """Plain text and wikitext of the article, fetched from Wikipedia if none was loaded"""
+    # replace with current content if exists
+    if st.session_state.current_wikitext == "":
+        return wiki.get_article_plain_text(article_title), wiki.get_article_page_source(article_title)
+    return wikitext_to_plaintext(st.session_state.current_wikitext), st.session_state.current_wikitext
+
+def process_all_flows():
+    """
+    Run every registered flow at the same time, one worker thread per flow, on the article
+    fetched and parsed once. Suggestions are merged as each flow finishes, so the whole run
+    takes as long as the slowest flow.
+    """
+    flow_status = st.session_state.flow_status.get(RUN_ALL_FLOWS, {})
+    if flow_status.get('completed'):
+        return
+
+    with st.status(f"Running {RUN_ALL_FLOWS}...", expanded=True) as status:
+        if not flow_status.get('running', False):
+            st.session_state.flow_status[RUN_ALL_FLOWS] = {
+                'running': True,
+                'completed': False
+            }
+            st.rerun()
+
+        st.session_state.suggestion_feed = st.container()
+        st.session_state.stream_placeholder = st.empty()
+        try:
+            original_content, original_wikitext_content = load_article_content()
+            # parse once up front; the flows then share the parsed article through the parse cache
+            wikitext_to_plaintext_skip_tables_refs(original_wikitext_content)
+            url_list = [url.strip() for url in urls.split(",")] if urls else []
+
+            flows = [flow for flow, handler in FLOW_REGISTRY.items() if handler]
+            def run(flow: AnalysisFlow):
+                return FLOW_REGISTRY[flow](article_title, sources, url_list, original_content, original_wikitext_content)
+
+            started = time.perf_counter()
+            merged_suggestions = []
+            for done, (idx, task) in enumerate(iter_concurrently(run, flows, len(flows)), start=1):
+                flow = flows[idx]
+                result = task.value if task.ok else {"status": "error"}
+                if not task.ok:
+                    StreamlitLogger.log(f"Error in {flow.value}: {str(task.error)}")
+                st.session_state.flow_status[flow] = {
+                    "running": False,
+                    "completed": task.ok,
+                    "result": result
+                }
+
+                if "summaries" in result:
+                    st.session_state.summaries = result["summaries"]
+                if result["status"] == "success":
+                    merged_suggestions += result["suggestions"]
+                    # flag overlapping suggestions, also across flows
+                    st.session_state.suggestions = WikitextPatcher.find_conflicts(
+                        merged_suggestions,
+                        original_wikitext_content
+                    )
+                StreamlitLogger.log(f"{flow.value} finished after {time.perf_counter() - started:.1f}s with {len(result.get('suggestions', []))} suggestion(s).")
+                status.update(label=f"Running {RUN_ALL_FLOWS}... ({done}/{len(flows)} done)")
+
+            st.session_state.flow_status[RUN_ALL_FLOWS] = {
+                "running": False,
+                "completed": True,
+                "result": {"status": "success", "suggestions": merged_suggestions}
+            }
+            if llm_cache.enabled:
+                StreamlitLogger.log(f"LLM response cache: {llm_cache.stats()}")
+
+        except Exception as e:
+            StreamlitLogger.log(f"Error in {RUN_ALL_FLOWS}: {str(e)}")
+            st.session_state.flow_status[RUN_ALL_FLOWS] = {
+                "running": False,
+                "completed": False,
+                "result": {"status": "error"}
+            }
+        del st.session_state.suggestion_feed
+        del st.session_state.stream_placeholder
+        st.rerun()
+
 def process_active_flow():
+    if st.session_state.active_flow == RUN_ALL_FLOWS:
+        process_all_flows()
+        return
+
     if st.session_state.active_flow:
         # Validate flow exists in registry
         if st.session_state.active_flow not in FLOW_REGISTRY:
@@ -241,15 +344,10 @@ def process_active_flow():
         if not flow_status.get('completed'):
             with st.status(f"Running {flow.value}...", expanded=True) as status:
                 if flow_status.get('running', False):
+                    st.session_state.suggestion_feed = st.container()
+                    st.session_state.stream_placeholder = st.empty()
                     try:
-                        
-                        # replace with current content if exists
-                        if st.session_state.current_wikitext == "":
-                            original_content = wiki.get_article_plain_text(article_title)
-                            original_wikitext_content = wiki.get_article_page_source(article_title)
-                        else:
-                            original_content = wikitext_to_plaintext(st.session_state.current_wikitext)
-                            original_wikitext_content = st.session_state.current_wikitext
+                        original_content, original_wikitext_content = load_article_content()
 
                         result = handler(
                             article_title,
@@ -264,8 +362,16 @@ def process_active_flow():
                             "result": result
                         }
                         
+                        if "summaries" in result:
+                            st.session_state.summaries = result["summaries"]
                         if result["status"] == "success":
-                            st.session_state.suggestions = result["suggestions"]
+                            # flag overlapping suggestions and keep them next to each other
+                            st.session_state.suggestions = WikitextPatcher.find_conflicts(
+                                result["suggestions"],
+                                original_wikitext_content
+                            )
+                        if llm_cache.enabled:
+                            StreamlitLogger.log(f"LLM response cache: {llm_cache.stats()}")
                             
                     except Exception as e:
                         StreamlitLogger.log(f"Error in {flow.value}: {str(e)}")
@@ -274,6 +380,8 @@ def process_active_flow():
                             "completed": False,
                             "result": {"status": "error"}
                         }
+                    del st.session_state.suggestion_feed
+                    del st.session_state.stream_placeholder
                     st.rerun()
                 else:
                     # Initialize flow run
@@ -302,6 +410,10 @@ if 'summaries' in st.session_state and st.session_state.summaries:
     for idx, summary in enumerate(st.session_state.summaries):
 
         with st.expander(f"Document #{idx+1}", expanded=True):
+            if summary is None:
+                st.warning("This source could not be summarized.")
+                continue
+
             col1, col2 = st.columns([2, 2])
 
             with col1:
@@ -319,6 +431,7 @@ if 'suggestions' not in st.session_state:
 # Suggestions rendering
 if 'suggestions' in st.session_state and st.session_state.suggestions:
     st.header("Improvement Suggestions")
+    suggestion_numbers = {s.id: number for number, s in enumerate(st.session_state.suggestions, start=1)}
     
     for idx, suggestion in enumerate(st.session_state.suggestions):
         suggestion_id = suggestion.id
@@ -336,6 +449,10 @@ if 'suggestions' in st.session_state and st.session_state.suggestions:
                 {suggestion.text.replace("\n", " ")}
                 <em>{suggestion.context.replace("\n", " ")}</em>
                 """, unsafe_allow_html=True)
+
+                if suggestion.conflicts:
+                    conflicting = ", ".join(f"#{suggestion_numbers[c]}" for c in suggestion.conflicts if c in suggestion_numbers)
+                    st.warning(f"Overlaps with suggestion {conflicting}; only one of them can be applied.")
                 
             with col2:
                 status_container = st.empty()
@@ -416,12 +533,15 @@ def apply_suggestions(wikitext: str, apply=True) -> str:
     # Apply patches
     modified = wikitext
     if apply:
-        for suggestion in st.session_state.suggestions:
-            if suggestion.status == 'accepted':
-                modified = suggestion.patch(modified)
-                print("patching")
-        
-        print("patched",flush=True)
+        accepted = [s for s in st.session_state.suggestions if s.status == 'accepted']
+        # resolve all patches against one snapshot and splice them in a single pass
+        modified, reports = WikitextPatcher.apply_batch(wikitext, accepted)
+
+        for report in reports:
+            if report.status != 'applied':
+                StreamlitLogger.log(f"Suggestion {report.suggestion_id} was not applied ({report.status}).")
+        applied_count = sum(1 for report in reports if report.status == 'applied')
+        StreamlitLogger.log(f"Applied {applied_count}/{len(reports)} accepted suggestions.")
     return modified
 
 def revert_changes():
@@ -468,6 +588,8 @@ with col3:
             st.rerun()
 
 def update_wikitext():
+    # record the manual edit so anchored suggestions can be rebased instead of searched again
+    RevisionLog.record_texts(st.session_state.current_wikitext, st.session_state.current_wikitext_box)
     st.session_state.current_wikitext = st.session_state.current_wikitext_box
 
 # Display current wikitext
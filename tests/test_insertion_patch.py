@@ -0,0 +1,55 @@
+# tests/test_insertion_patch.py
+# Insertions diffed on the editor's plaintext must land in the wikitext, also next to
+# headings and piped links, which the plaintext and the offset index render differently.
+# Run from the repository root: python -m pytest tests
+import pytest
+from src.agents.content_editor import LEN_CTX
+from src.utils.helpers import wikitext_to_plaintext_skip_tables_refs
+from src.utils.text_diff import paragraph_diff_opcodes
+from src.utils.wikitext_patcher import WikitextPatcher
+
+WIKITEXT = (
+    "'''HMS Example''' was a [[gunvessel]] of the [[Royal Navy]]. She served on the [[China Station|station in China]].\n\n"
+    "== History ==\n"
+    "The ship was built in 1860 at [[Pembroke Dockyard]].<ref>Smith, p. 4</ref> She was sold in 1875.\n\n"
+    "== Fate ==\n"
+    "She was broken up at [[Chatham Dockyard|Chatham]]. Nothing remains.\n"
+)
+
+def _insertion_patch(wikitext: str, edit):
+    """Diff the plaintext against its edited version and build the insertion patch like ContentEditor"""
+    original = wikitext_to_plaintext_skip_tables_refs(wikitext)
+    edited = edit(original)
+    inserts = [opcode for opcode in paragraph_diff_opcodes(original, edited) if opcode[0] == 'insert']
+    assert len(inserts) == 1
+
+    _, i1, i2, j1, j2 = inserts[0]
+    return WikitextPatcher.create_insertion_patch(
+        original[max(i1 - LEN_CTX, 0):i1],
+        original[i1:i2],
+        original[i2:min(i2 + LEN_CTX, len(original))],
+        edited[j1:j2]
+    )
+
+@pytest.mark.parametrize("edit, inserted", [
+    # appended to the lead, right after a piped link and before a heading
+    (lambda text: text.replace("China Station.\n\n", "China Station. She carried four guns.\n\n"),
+     "[[China Station|station in China]]. She carried four guns.\n\n== History =="),
+    # first sentence of a section, right after its heading
+    (lambda text: text.replace("== Fate ==\n", "== Fate ==\nShe was decommissioned in 1880. "),
+     "== Fate ==\nShe was decommissioned in 1880. She was broken up"),
+    # next to a piped link inside a paragraph
+    (lambda text: text.replace("Chatham Dockyard. ", "Chatham Dockyard. Her bell survives. "),
+     "[[Chatham Dockyard|Chatham]]. Her bell survives. Nothing remains."),
+    # at the end of a paragraph, after a reference
+    (lambda text: text.replace("sold in 1875.", "sold in 1875. She was renamed in 1870."),
+     "<ref>Smith, p. 4</ref> She was sold in 1875. She was renamed in 1870.\n\n== Fate =="),
+])
+def test_insertion_next_to_markup(edit, inserted):
+    patch = _insertion_patch(WIKITEXT, edit)
+    assert patch.resolve(WIKITEXT) is not None
+
+    patched = patch(WIKITEXT)
+    assert inserted in patched
+    # the inserted sentence is the only change
+    assert patched.replace(patch.new_text.strip() + " ", "", 1).replace(" " + patch.new_text.strip(), "", 1) == WIKITEXT